@@ -3,9 +3,15 @@ from input import InputData
 from transformer import SpaceTransformer
 from space_merger import SpaceMerger
 from pprint import pprint
-from botsort_tracker import track2, track_raw
+from botsort_tracker import track2, track_raw, tracking_conf
 from output_ import DetectionsOutput
+from pipeline import Pipeline
+from camera_pool import CameraPool
+from kafka import ControlListener
+from cfg.paths_config import __KAFKA_CONFIG__, __PROFILES_DIR__
+from tracker.tracking_utils.profiler import profiler
 import time
+import sys
 
 running = True;
 
@@ -14,34 +20,50 @@ def initialize():
     # Request init config and allocate start up resources
     return status
 
-def main_loop():
+def main_loop(pipelined=False):
+    global running
+    input_data = None
+    output = None
+    control_listener = None
+    camera_pool = None
     try:
-        global running
-        #input data from external source
-        input_data = InputData()
         config_data = DataLoader().load_config_data()
+        stitching_map = config_data['stitching_map']
+
+        # Opt-in, one geometry worker per camera instead of the fused transform of all the cameras
+        camera_pool = CameraPool(stitching_map.num_cams) if tracking_conf.camera_workers else None
 
-        # Transformer
-        f_width = 2590
-        f_height  = 1942
-        space_transformer = SpaceTransformer(f_width, f_height, config_data['cams_config'])
+        #input data from external source
+        input_data = InputData(camera_pool=camera_pool)
 
-        # Space Merger
-        transformer = space_transformer.get_transformer(1)
-        mini_boundary = transformer.get_mini_boudary()
-        main_boundary = transformer.getDstPts()
-        space_merger = SpaceMerger(main_boundary, mini_boundary)
+        # Transformer and Space Merger, both driven by the stitching map of the calibration
+        space_transformer = SpaceTransformer(stitching_map, camera_pool)
+        space_merger = SpaceMerger(stitching_map)
+        if camera_pool is None:
+            space_transformer.fuse()
 
         # Output
-        output = DetectionsOutput()
+        output = DetectionsOutput(tracking_conf.output_format, tracking_conf.output_compact_topic,
+                                  tracking_conf.output_keyframe_interval)
+
+        # Profiling on demand, SIGUSR1 / SIGUSR2 or the control topic
+        profiler.configure(__PROFILES_DIR__, tracking_conf.profile_seconds, tracking_conf.profile_interval,
+                           tracking_conf.profile_frames, 'pipeline-tracking' if pipelined else None)
+        profiler.install_signal_handlers()
+        if tracking_conf.profile_control_topic is not None:
+            control_listener = ControlListener(__KAFKA_CONFIG__, tracking_conf.profile_control_topic, profiler.handle_command)
+            control_listener.start()
+
+        if pipelined:
+            return pipeline_loop(input_data, space_transformer, space_merger, output, camera_pool)
 
         while running:
             start_time = time.time()
-            data  = input_data.wait_for_data()
+            data  = input_data.wait_for_batch()
             
             
-            transformed_data = space_transformer.apply_transform(data)
-            merged_data = space_merger.merge(transformed_data)
+            transformed_data = space_transformer.apply_transform_batch(data)
+            merged_data = space_merger.merge_batch(transformed_data)
             map_data, tracked_data = track2(merged_data)
            
             output.update(tracked_data)
@@ -49,13 +71,65 @@ def main_loop():
 
             end_time = time.time()
             
-            print(f"Waiting Time is: {round((end_time - start_time)*1e3)} ms")
+            stats = input_data.get_stats()
+            output_stats = output.get_stats()
+            print(f"Waiting Time is: {round((end_time - start_time)*1e3)} ms \t Dropped Frames: {stats['dropped']} \t Lag: {stats['lag_frames']}"
+                  f" \t Output Spool: {output_stats['spooled']} \t Delivery p99: {output_stats['delivery_p99_ms']} ms")
+            if camera_pool is not None:
+                print(' \t '.join(f"{name}: {timing['last_ms']} ms" for name, timing in camera_pool.get_timings().items()))
 
-        input_data.stop()
         return 0
     except KeyboardInterrupt as ke:
         running = False
-        input_data.stop()
+    finally:
+        # Stop the input first, then flush the output spool, then the helpers
+        if input_data is not None:
+            input_data.stop()
+        if output is not None:
+            output.close()
+        if control_listener is not None:
+            control_listener.stop()
+        if camera_pool is not None:
+            camera_pool.close()
+
+
+def pipeline_loop(input_data:InputData, space_transformer:SpaceTransformer, space_merger:SpaceMerger, output:DetectionsOutput,
+                  camera_pool:CameraPool=None):
+    """
+    Runs the live loop as a staged pipeline: decode -> geometry -> tracking -> publish.
+    """
+    global running
+
+    def geometry(batch):
+        return space_merger.merge_batch(space_transformer.apply_transform_batch(batch))
+
+    def tracking(merged_data):
+        _, tracked_data = track2(merged_data)
+        return tracked_data
+
+    def publish(tracked_data):
+        output.update(tracked_data)
+        output.write_to_kafka()
+
+    pipeline = Pipeline(lambda: input_data.wait_for_batch(timeout=0.5),
+                        [('geometry', geometry), ('tracking', tracking), ('publish', publish)],
+                        queue_size=2)
+    pipeline.start()
+    try:
+        while running and pipeline.is_running():
+            time.sleep(1)
+            pprint(pipeline.get_timings())
+            if camera_pool is not None:
+                pprint(camera_pool.get_timings())
+            pprint(input_data.get_stats())
+            pprint(output.get_stats())
+    finally:
+        pipeline.stop()
+        pipeline.join(timeout=5)
+
+    if pipeline.error is not None:
+        raise pipeline.error
+    return 0
 
 
 def clean_up():
@@ -67,5 +141,5 @@ def clean_up():
         
 
 if __name__ == "__main__":
-        main_loop()
+        main_loop(pipelined='--pipelined' in sys.argv)
     
\ No newline at end of file
@@ -7,11 +7,23 @@ import time
 from tracker.kalman_associator import AssociationsManager
 from pprint import pprint
 from state_representation import State
-
-tracker = BoTSORT(TrackingConf(), 10)
+from frame_batch import FrameBatch
+from tracker.tracking_utils.debug_sink import debug_sink
+from tracker.tracking_utils.metrics import metrics
+from tracker.retention import PoolMetrics
+
+tracking_conf = TrackingConf()
+debug_sink.configure(tracking_conf.debug_sink_mode, tracking_conf.debug_sink_path,
+                     tracking_conf.debug_sink_sample_every, tracking_conf.debug_sink_capacity)
+if tracking_conf.metrics_enabled:
+    metrics.configure(True, tracking_conf.metrics_port)
+tracker = BoTSORT(tracking_conf, 10)
+pool_metrics = PoolMetrics(tracking_conf.pool_metrics_history)
 frame_count = 0
 
 def convert_to_output_results(arr):
+    if isinstance(arr, FrameBatch):
+        return arr.to_output_results()
     num_entries = len(arr)
     output_results = np.zeros((num_entries, 12))  # Assuming there are 10 elements in total
     for idx, entry in enumerate(arr):
@@ -32,28 +44,26 @@ def convert_to_output_results(arr):
     return output_results
 
 
-def convert_one(det):
-    x1, y1= det['coordinates']
-    return np.array([x1, y1])
-
-def coordinates_association(det, res_list)->dict:
-    coord_list = convert_one(det)
-    test_list = []
-    for r in res_list:
-        res = r.coordinates
-        test_list.append(res)
-        if res[0] == coord_list[0] and res[1] == coord_list[1]:
-            det['track_id'] = r.track_id
-            return det
-    return det
-
 def associate_dets_with_ids(dets:list[dict], track_res:list)->list[dict]:
-    for det in dets:
-        det = coordinates_association(det, track_res)
-        if det.get('has_child'):
-            det['child'] = coordinates_association(det['child'], track_res)
+    """
+    Sets the BoTSORT track id of the detections, the tracks carry the index of the detection they were updated with.
+    """
+    det_index, track_ids = STrack.multi_ids(track_res)
+    for idx, track_id in zip(det_index.tolist(), track_ids.tolist()):
+        if idx >= 0:
+            dets[idx]['track_id'] = track_id
     return dets
 
+def associate_batch_with_ids(batch:FrameBatch, track_res:list)->FrameBatch:
+    """
+    Array version of associate_dets_with_ids, the BoTSORT input rows are the top level rows of the batch.
+    """
+    det_index, track_ids = STrack.multi_ids(track_res)
+    found = det_index >= 0
+    batch.track_id[:] = -1
+    batch.track_id[batch.top_level()[det_index[found]]] = track_ids[found]
+    return batch
+
 def draw_bbox(frame, det)->cv.Mat:
     frame_c = frame
     x1 , y1, w, h = det._tlwh
@@ -220,8 +230,8 @@ b_c1 =  ( 90.3    ,  103.52    ,  243.37)#(164.37 ,  133.26 , 142.19) #(229, 152
 b_c2 =  (104.19   ,   108.46    ,  105.73)#(249.18 , 251.15 , 246.8)
  
 tracks_manager = TrackObjectsManager()
-associations_manager = AssociationsManager((b_c1, b_c2))
-missed_detections_stateman = State()
+associations_manager = AssociationsManager((b_c1, b_c2), tracking_conf.linear_proximity, tracking_conf.reset_compact_interval)
+missed_detections_stateman = State(tracking_conf.linear_proximity)
 
 def filter_list(full_list:list, comp_list:list)->list:
     for det in comp_list:
@@ -235,6 +245,17 @@ def filter_list(full_list:list, comp_list:list)->list:
     comp_list.extend(full_list)
     return comp_list
 
+def record_pool_sizes()->None:
+    sizes = tracker.pool_sizes()
+    sizes.update(associations_manager.pool_sizes())
+    pool_metrics.record(tracker.frame_id, sizes)
+
+def get_pool_metrics()->dict:
+    """
+    Pool sizes of the last frame, their peaks and the history of the last pool_metrics_history frames.
+    """
+    return {'latest': pool_metrics.latest(), 'peak': pool_metrics.peak(), 'history': pool_metrics.history()}
+
 def track2(detections:list):
     global tracker
     global tracks_manager
@@ -242,11 +263,16 @@ def track2(detections:list):
     # detections = missed_detections_stateman.update_state_data(detections)
     det_output = convert_to_output_results(detections)
     online_tracks = tracker.update(det_output)
+    if isinstance(detections, FrameBatch):
+        # Output boundary, the rest of the association layer works on dicts
+        detections = associate_batch_with_ids(detections, online_tracks).to_dicts()
+    else:
+        detections = associate_dets_with_ids(detections, online_tracks)
     o_detections = detections
-    detections = associate_dets_with_ids(detections, online_tracks)
     # detections = tracks_manager.update(detections)
     associations_manager.update(o_detections)
     dets = associations_manager.get_dets()
+    record_pool_sizes()
 
     tracking_results = {}
     res = []
@@ -282,7 +308,11 @@ def track2(detections:list):
 
 def track_raw(detections:list):
     # print(f"Kit Detector Time: {kit_detector.get_execution_time()} ms \t For Detections {len(detections)}")
-    detections = missed_detections_stateman.update_state_data(detections)
+    coordinates = None
+    if isinstance(detections, FrameBatch):
+        coordinates = detections.coordinates[detections.top_level()]
+        detections = detections.to_dicts()
+    detections = missed_detections_stateman.update_state_data(detections, coordinates)
     res = []
     tracking_results = {}
     for _, det in enumerate(detections):
@@ -0,0 +1,103 @@
+"""
+Per camera worker pool for the geometry of a frame.
+
+The cameras are independent until SpaceMerger, so their box-to-point and homography can run side by side:
+    1. map(func, items) hands item c to the worker of camera c (fan-out), every camera always runs on the same thread.
+    2. The caller waits until every camera is done (fan-in barrier) and gets the results in camera order,
+       an exception raised on a worker is raised again on the caller.
+    3. The workers are started the first time a camera shows up, so the pool follows the number of cameras of the rig.
+cv2.perspectiveTransform and the NumPy kernels release the GIL, the Python glue around them does not,
+so the pool only pays off when there is enough work per camera (the fused transform is faster on small frames).
+"""
+import threading
+import queue
+import time
+from pipeline import StageTimer
+from tracker.tracking_utils.metrics import metrics
+
+
+class CameraPool:
+    STOP = object()
+
+    def __init__(self, num_cams:int=0, name:str='camera')->None:
+        self.name = name
+        self.__workers = []
+        self.__timers = []
+        self.__barrier_timer = StageTimer('barrier') # fan-out to fan-in of a whole frame
+        self.__lock = threading.Lock()
+        self.__done = threading.Condition(self.__lock)
+        self.__pending = 0
+        self.__results = []
+        self.__error = None
+        self.__grow(num_cams)
+
+    def __len__(self)->int:
+        return len(self.__workers)
+
+    def __grow(self, num_cams:int)->None:
+        for idx in range(len(self.__workers), num_cams):
+            tasks = queue.SimpleQueue()
+            t = threading.Thread(target=self.__run_worker, args=(idx, tasks), name=f'{self.name}-{idx}', daemon=True)
+            self.__workers.append((t, tasks))
+            self.__timers.append(StageTimer(f'{self.name}_{idx}'))
+            t.start()
+
+    def __run_worker(self, idx:int, tasks:queue.SimpleQueue)->None:
+        timer = self.__timers[idx]
+        while True:
+            task = tasks.get()
+            if task is CameraPool.STOP:
+                return
+            func, item = task
+            res, error = None, None
+            start_time = time.perf_counter()
+            try:
+                with metrics.timer(f'{self.name}_{idx}'):
+                    res = func(idx, item)
+            except Exception as e:
+                error = e
+            timer.add(time.perf_counter() - start_time)
+            with self.__done:
+                self.__results[idx] = res
+                if error is not None and self.__error is None:
+                    self.__error = error
+                self.__pending -= 1
+                if self.__pending == 0:
+                    self.__done.notify()
+
+    def map(self, func, items:list)->list:
+        """
+        Calls func(camera, items[camera]) on the worker of every camera and waits for all of them.
+        Not reentrant, one frame at a time (the geometry stage is single threaded).
+        """
+        start_time = time.perf_counter()
+        if len(items) > len(self.__workers):
+            self.__grow(len(items))
+        with self.__done:
+            self.__results = [None]*len(items)
+            self.__error = None
+            self.__pending = len(items)
+        for idx, item in enumerate(items):
+            self.__workers[idx][1].put((func, item))
+        with self.__done:
+            while self.__pending > 0:
+                self.__done.wait()
+            results, error = self.__results, self.__error
+        self.__barrier_timer.add(time.perf_counter() - start_time)
+        if error is not None:
+            raise error
+        return results
+
+    def get_timings(self)->dict:
+        """
+        Latency of every camera and of the whole fan-out / fan-in, see pipeline.StageTimer.
+        """
+        result = {timer.name: timer.to_dict() for timer in self.__timers}
+        result[self.__barrier_timer.name] = self.__barrier_timer.to_dict()
+        return result
+
+    def close(self)->None:
+        for t, tasks in self.__workers:
+            tasks.put(CameraPool.STOP)
+        for t, tasks in self.__workers:
+            t.join(timeout=1)
@@ -23,4 +23,29 @@ class TrackingConf(object):
         self.fast_reid_weights = re_id_model_path.as_posix()
         self.proximity_thresh = 0.8
         self.appearance_thresh = 0.1
-        self.device = "cuda"
\ No newline at end of file
+        self.device = "cuda"
+        self.linear_proximity = False # Use the LinearProximityCalculator in the association layer (lowest total distance pairing, differs from the greedy one in crowded scenes)
+        self.debug_sink_mode = "off" # off, sampled or ring
+        self.debug_sink_path = "debug.jsonl"
+        self.debug_sink_sample_every = 100
+        self.debug_sink_capacity = 256
+        self.track_table_compact_interval = 30 # frames between two compactions of the removed BoTSORT tracks
+        self.removed_history_size = 1024 # ids of the removed BoTSORT tracks that are remembered after compaction
+        self.reset_compact_interval = 30 # frames between two compactions of the tracklets waiting for a reset
+        self.pool_metrics_history = 600 # frames of pool sizes kept for get_pool_metrics
+        self.association_space = "image" # BoTSORT association, image (IoU of the stitched boxes) or pitch (pitch coordinates)
+        self.pitch_gate_distance = 0.03 # pitch distance over which a track and a detection are not matched in the pitch space
+        self.pitch_gate_metric = "maha" # maha or euclidean cost in the pitch space
+        self.pitch_second_thresh = 0.99 # cost limit of the low score pass in the pitch space, the gate already sets the feasible pairs (cost 1 outside it)
+        self.pitch_unconfirmed_thresh = 0.99 # cost limit of the unconfirmed tracks pass in the pitch space
+        self.pitch_duplicate_distance = 0.005 # tracked and lost tracks closer than this are duplicates in the pitch space
+        self.metrics_enabled = False # stage timers and counters of the hot path, see tracking_utils/metrics.py
+        self.metrics_port = 9108 # localhost port of the /metrics endpoint, None to only keep them in process
+        self.profile_seconds = 10 # seconds of stack sampling on SIGUSR1 / a 'sample' control message
+        self.profile_interval = 0.005 # seconds between two stack samples
+        self.profile_frames = 100 # frames run under cProfile on SIGUSR2 / a 'profile_frames' control message
+        self.profile_control_topic = None # Kafka topic of the profiler control messages, None to only use the signals
+        self.output_format = "json" # ui-data output, json or compact (binary keyframe / delta frames, see codec.py)
+        self.output_compact_topic = "ui-data-compact" # topic of the compact frames, the json frames stay on ui-data
+        self.output_keyframe_interval = 30 # frames between two compact keyframes
+        self.camera_workers = False # geometry of every camera on its own worker (camera_pool.py) instead of the fused transform
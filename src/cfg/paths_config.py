@@ -4,6 +4,7 @@ from pathlib import Path
 
 __BASE_DIR__ = Path(r"./src").resolve()
 __TRACKING_DATA_DIR__ = (__BASE_DIR__ / Path(r'tracking_data_files')).resolve()
+__PROFILES_DIR__ = (__BASE_DIR__ / Path(r'profiles')).resolve()
 __KAFKA_CONFIG__ = (__BASE_DIR__ / Path(r'cfg/tracking_core_kafka_config.ini')).resolve()
 __CALIBRATION_CFG_DIR__ = (__BASE_DIR__ / Path(r'calibration')).resolve()
 __MODELS_DIR__ = (__BASE_DIR__ / Path(r'model/weights')).resolve()
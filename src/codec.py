@@ -0,0 +1,424 @@
+"""
+Message codecs for the Kafka boundary.
+
+Schemas
+    kit-detector-topic (input):
+        {'cams': {<cam>: {'detections': [{'bbox': {'x', 'y', 'width', 'height'}, 'confidence', 'class', 'kit_color'}]}}}
+    ui-data (output):
+        {'tracks': [{'coordinates': [x, y], 'tracking-id', 'bbox': {'x1', 'y1', 'x2', 'y2'}, 'conf', 'kit_color', 'alert'}]}
+
+1. decode_detections() parses the input message straight into a FrameBatch.
+2. encode_tracks() serializes the output payload, NumPy arrays and scalars are written as they are (no tolist()).
+Unless a backend is given the fastest installed one is used, to decode msgspec (typed decode against the schema),
+orjson, then the stdlib json, to encode orjson, msgspec, then the stdlib json.
+
+Compact ui-data (optional, CompactEncoder / CompactDecoder), little endian:
+    header  : magic b'TK', version u8, kind u8 (0 keyframe, 1 delta), seq u32, time f64,
+              records u16, anonymous u16, removed u16
+    records : fixed width TRACK_RECORD rows, first the tracks keyed by their id then the anonymous ones
+    removed : i4 ids of the keyed tracks gone since the previous frame
+A keyframe carries every track, a delta only the keyed tracks that changed. Tracks are keyed when their
+tracking-id is a non negative int that is unique in the frame, the others (None, -1, duplicates) are anonymous
+and sent in every frame.
+"""
+import json
+import struct
+import time
+import numpy as np
+from frame_batch import FrameBatch
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+MSGSPEC = 'msgspec'
+ORJSON = 'orjson'
+STDLIB = 'json'
+
+
+def available_backends()->list[str]:
+    backends = []
+    if msgspec is not None:
+        backends.append(MSGSPEC)
+    if orjson is not None:
+        backends.append(ORJSON)
+    backends.append(STDLIB)
+    return backends
+
+
+if msgspec is not None:
+    class BBox(msgspec.Struct):
+        x: float
+        y: float
+        width: float
+        height: float
+
+    class Detection(msgspec.Struct):
+        bbox: BBox
+        confidence: float = 0.
+        cls: float = msgspec.field(default=0., name='class')
+        kit_color: list[float]|None = None
+
+    class CameraDetections(msgspec.Struct):
+        detections: list[Detection] = []
+
+    class DetectorMessage(msgspec.Struct):
+        cams: dict[str, CameraDetections]
+
+    __message_decoder = msgspec.json.Decoder(DetectorMessage)
+    __msgspec_encoder = None
+
+
+def _to_json(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def __batch_from_struct(message)->FrameBatch:
+    cams_data = message.cams
+    num_dets = sum(len(cam.detections) for cam in cams_data.values())
+    batch = FrameBatch(num_dets)
+    batch.num_cams = len(cams_data)
+
+    row = 0
+    for idx, cam in enumerate(cams_data.values()):
+        for det in cam.detections:
+            bbox = det.bbox
+            batch.camera[row] = idx
+            batch.bbox[row] = (bbox.x, bbox.y, bbox.x + bbox.width, bbox.y + bbox.height)
+            batch.conf[row] = det.confidence
+            batch.cls[row] = det.cls
+            if det.kit_color is not None:
+                batch.kit_color[row] = det.kit_color
+            row += 1
+    batch.box[:] = batch.bbox
+    return batch
+
+
+def decode_detections(data:bytes|str, backend:str=None)->FrameBatch:
+    """
+    Decodes a kit-detector message into a FrameBatch (foot points are not computed here).
+    """
+    backend = backend or available_backends()[0]
+    if backend == MSGSPEC:
+        return __batch_from_struct(__message_decoder.decode(data))
+    if backend == ORJSON:
+        return FrameBatch.from_message(orjson.loads(data))
+    return FrameBatch.from_message(json.loads(data))
+
+
+def decode(data:bytes|str, backend:str=None):
+    """
+    Schemaless decode, for the payloads that are consumed as dicts.
+    """
+    backend = backend or available_backends()[0]
+    if backend == MSGSPEC:
+        return msgspec.json.decode(data)
+    if backend == ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_tracks(tracking_results:dict, backend:str=None)->bytes:
+    """
+    Serializes the ui-data payload, NumPy values may be used anywhere in it.
+    backend: one of available_backends(), None picks the fastest installed encoder.
+    """
+    global __msgspec_encoder
+    if backend is None:
+        # orjson writes the NumPy buffers natively, it is the faster encoder when both are installed
+        backend = ORJSON if orjson is not None else available_backends()[0]
+    if backend == ORJSON:
+        return orjson.dumps(tracking_results, option=orjson.OPT_SERIALIZE_NUMPY, default=_to_json)
+    if backend == MSGSPEC:
+        if __msgspec_encoder is None:
+            __msgspec_encoder = msgspec.json.Encoder(enc_hook=_to_json)
+        return __msgspec_encoder.encode(tracking_results)
+    return json.dumps(tracking_results, default=_to_json).encode('utf-8')
+
+
+TRACK_RECORD = np.dtype([
+    ('id', '<i4'),
+    ('coordinates', '<f4', 2),
+    ('bbox', '<f4', 4), # x1, y1, x2, y2
+    ('conf', '<f2'),
+    ('kit_color', 'u1', 3),
+    ('flags', 'u1')
+])
+HAS_ID = 0x01
+HAS_COLOR = 0x02
+HAS_ALERT = 0x04
+ALERT = 0x08
+
+COMPACT_MAGIC = b'TK'
+COMPACT_VERSION = 1
+KEYFRAME = 0
+DELTA = 1
+_COMPACT_HEADER = struct.Struct('<2sBBIdHHH')
+
+
+def _track_records(tracks:list[dict])->np.ndarray:
+    records = np.zeros(len(tracks), dtype=TRACK_RECORD)
+    if len(tracks) == 0:
+        return records
+    ids, coordinates, bboxes, conf, colors, flags = [], [], [], [], [], []
+    for track in tracks:
+        track_id, color, alert = track.get('tracking-id'), track.get('kit_color'), track.get('alert')
+        bbox = track['bbox']
+        ids.append(-1 if track_id is None else track_id)
+        coordinates.append(track['coordinates'])
+        bboxes.append((bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2']))
+        conf.append(track['conf'])
+        colors.append((0, 0, 0) if color is None else color)
+        flags.append((HAS_ID if track_id is not None else 0) | (HAS_COLOR if color is not None else 0)
+                     | (HAS_ALERT if alert is not None else 0) | (ALERT if alert else 0))
+    records['id'] = ids
+    records['coordinates'] = coordinates
+    records['bbox'] = bboxes
+    records['conf'] = conf
+    records['kit_color'] = colors
+    records['flags'] = flags
+    return records
+
+
+class CompactEncoder:
+    """
+    Stateful encoder of the compact ui-data frames, one per output stream.
+    """
+    def __init__(self, keyframe_interval:int=30)->None:
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.__seq = 0
+        self.__previous_ids = np.zeros(0, dtype=np.int32) # sorted ids of the keyed tracks sent last
+        self.__previous = np.zeros((0, TRACK_RECORD.itemsize), dtype=np.uint8) # their records as bytes
+
+    def encode(self, tracking_results:dict)->bytes:
+        """
+        1. The tracks are keyed when their id is set, non negative and unique in the frame, sorted by id.
+        2. A delta keeps the keyed records that are new or differ from the previous frame, and the ids that are gone.
+        """
+        records = _track_records(tracking_results['tracks'])
+        order = np.argsort(records['id'], kind='stable')
+        ids = records['id'][order]
+        duplicate = np.zeros(ids.shape[0], dtype=bool)
+        same = ids[1:] == ids[:-1]
+        duplicate[1:] |= same
+        duplicate[:-1] |= same
+        keyed_mask = ~duplicate & (ids >= 0) & ((records['flags'][order] & HAS_ID) != 0)
+        keyed = records[order[keyed_mask]]
+        anonymous = records[np.sort(order[~keyed_mask])]
+        keyed_ids = keyed['id']
+        raw = keyed.view(np.uint8).reshape(-1, TRACK_RECORD.itemsize)
+
+        keyframe = self.__seq % self.keyframe_interval == 0
+        if keyframe:
+            changed, removed = keyed, np.zeros(0, dtype='<i4')
+        else:
+            pos = np.minimum(np.searchsorted(self.__previous_ids, keyed_ids), max(self.__previous_ids.shape[0] - 1, 0))
+            found = self.__previous_ids[pos] == keyed_ids if self.__previous_ids.shape[0] > 0 else np.zeros(keyed_ids.shape[0], dtype=bool)
+            modified = ~found
+            modified[found] = (self.__previous[pos[found]] != raw[found]).any(axis=1)
+            changed = keyed[modified]
+            removed = self.__previous_ids[~np.isin(self.__previous_ids, keyed_ids)].astype('<i4')
+        self.__previous_ids, self.__previous = keyed_ids, raw
+
+        header = _COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, KEYFRAME if keyframe else DELTA, self.__seq,
+                                      time.time(), changed.shape[0], anonymous.shape[0], removed.shape[0])
+        self.__seq = (self.__seq + 1) & 0xFFFFFFFF
+        return b''.join((header, changed.tobytes(), anonymous.tobytes(), removed.tobytes()))
+
+    def reset(self)->None:
+        """
+        The next frame is a keyframe.
+        """
+        self.__seq = 0
+        self.__previous_ids = np.zeros(0, dtype=np.int32)
+        self.__previous = np.zeros((0, TRACK_RECORD.itemsize), dtype=np.uint8)
+
+
+class CompactDecoder:
+    """
+    Consumer side of CompactEncoder, keeps the keyed tracks between the frames.
+    After a lost frame (seq gap) the deltas are skipped until the next keyframe.
+    """
+    def __init__(self)->None:
+        self.__tracks = {} # id -> record
+        self.__seq = None
+        self.gaps = 0
+        self.time = None
+
+    def decode(self, data:bytes)->np.ndarray|None:
+        """
+        Returns every track of the frame as a TRACK_RECORD array (keyed then anonymous), None while waiting for a keyframe.
+        """
+        magic, version, kind, seq, stamp, num_records, num_anonymous, num_removed = _COMPACT_HEADER.unpack_from(data)
+        if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+            raise ValueError("Error: Not a compact ui-data frame")
+        offset = _COMPACT_HEADER.size
+        records = np.frombuffer(data, TRACK_RECORD, num_records, offset)
+        offset += records.nbytes
+        anonymous = np.frombuffer(data, TRACK_RECORD, num_anonymous, offset)
+        offset += anonymous.nbytes
+        removed = np.frombuffer(data, '<i4', num_removed, offset)
+
+        if kind == KEYFRAME:
+            self.__tracks = {}
+        elif self.__seq is None or seq != ((self.__seq + 1) & 0xFFFFFFFF):
+            if self.__seq is not None:
+                self.gaps += 1
+            self.__seq = None
+            return None
+        self.__seq = seq
+        self.time = stamp
+        for track_id in removed.tolist():
+            self.__tracks.pop(track_id, None)
+        for record in records:
+            self.__tracks[int(record['id'])] = record
+
+        keyed = np.array(list(self.__tracks.values()), dtype=TRACK_RECORD)
+        return np.concatenate((keyed, anonymous))
+
+    def decode_tracks(self, data:bytes)->dict|None:
+        """
+        Same as decode, in the JSON ui-data layout.
+        """
+        records = self.decode(data)
+        if records is None:
+            return None
+        return {'tracks': tracks_from_records(records)}
+
+
+def tracks_from_records(records:np.ndarray)->list[dict]:
+    tracks = []
+    flags = records['flags'].tolist()
+    for record, flag, track_id, coordinates, bbox, conf, color in zip(records, flags, records['id'].tolist(),
+                                                                      records['coordinates'].tolist(), records['bbox'].tolist(),
+                                                                      records['conf'].tolist(), records['kit_color'].tolist()):
+        tracks.append({
+            'coordinates': coordinates,
+            'tracking-id': track_id if flag & HAS_ID else None,
+            'bbox': dict(zip(('x1', 'y1', 'x2', 'y2'), bbox)),
+            'conf': conf,
+            'kit_color': color if flag & HAS_COLOR else None,
+            'alert': bool(flag & ALERT) if flag & HAS_ALERT else None
+        })
+    return tracks
+
+
+def detector_message_from_tracks(tracks:dict, width:int=2590, num_cams:int=3)->bytes:
+    """
+    Rebuilds a kit-detector message from a recorded ui-data frame (boxes are split back into the cameras by x),
+    used by the benchmark because only the output frames are recorded.
+    """
+    cams = {f'cam_{idx}': {'detections': []} for idx in range(num_cams)}
+    for track in tracks['tracks']:
+        bbox = track['bbox']
+        cam = int(bbox['x1'] // width)
+        if cam < 0 or cam >= num_cams:
+            continue
+        cams[f'cam_{cam}']['detections'].append({
+            'bbox': {'x': bbox['x1'] - cam*width, 'y': bbox['y1'], 'width': bbox['x2'] - bbox['x1'], 'height': bbox['y2'] - bbox['y1']},
+            'confidence': track['conf'],
+            'class': 0,
+            'kit_color': track['kit_color']
+        })
+    return json.dumps({'cams': cams}).encode('utf-8')
+
+
+def benchmark(files:list, repeat:int=5)->dict:
+    """
+    Times decode_detections and encode_tracks for every installed backend over the recorded frames.
+    Returns {backend: {'decode_ms': per frame, 'encode_ms': per frame, 'bytes': per output frame}}, the compact output
+    is timed under 'compact' (its decode_ms is the CompactDecoder of the output).
+    """
+    import time
+    outputs, messages = [], []
+    for file in files:
+        with open(file, 'rb') as fp:
+            data = json.loads(fp.read())
+        messages.append(detector_message_from_tracks(data))
+        # Output payloads carry NumPy values in the live loop
+        for track in data['tracks']:
+            track['coordinates'] = np.array(track['coordinates'])
+            track['conf'] = np.float64(track['conf'])
+        outputs.append(data)
+
+    results = {}
+    for backend in available_backends():
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                decode_detections(message, backend)
+        decode_time = (time.perf_counter() - start_time) / (repeat*len(messages))
+
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            for output in outputs:
+                encode_tracks(output, backend)
+        encode_time = (time.perf_counter() - start_time) / (repeat*len(outputs))
+        results[backend] = {'decode_ms': round(decode_time*1e3, 4), 'encode_ms': round(encode_time*1e3, 4),
+                            'bytes': round(sum(len(encode_tracks(output, backend)) for output in outputs) / len(outputs))}
+
+    encoded = []
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        encoder = CompactEncoder()
+        encoded = [encoder.encode(output) for output in outputs]
+    encode_time = (time.perf_counter() - start_time) / (repeat*len(outputs))
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        decoder = CompactDecoder()
+        for data in encoded:
+            decoder.decode(data)
+    decode_time = (time.perf_counter() - start_time) / (repeat*len(outputs))
+    results['compact'] = {'decode_ms': round(decode_time*1e3, 4), 'encode_ms': round(encode_time*1e3, 4),
+                          'bytes': round(sum(len(data) for data in encoded) / len(outputs))}
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from pprint import pprint
+    from cfg.paths_config import __TRACKING_DATA_DIR__
+
+    files = sorted(__TRACKING_DATA_DIR__.glob('*.json'))
+    if len(sys.argv) > 1:
+        files = files[:int(sys.argv[1])]
+
+    # All the backends must give the same batch
+    reference = [decode_detections(detector_message_from_tracks(json.loads(open(f, 'rb').read())), STDLIB) for f in files[:50]]
+    for backend in available_backends():
+        for file, ref in zip(files[:50], reference):
+            batch = decode_detections(detector_message_from_tracks(json.loads(open(file, 'rb').read())), backend)
+            assert np.array_equal(batch.bbox, ref.bbox) and np.array_equal(batch.camera, ref.camera)
+            assert np.array_equal(batch.kit_color, ref.kit_color, equal_nan=True)
+
+    # The compact frames must give back the tracks, the recorded ids are all 0 so they are also keyed by their index
+    for keyed in (False, True):
+        encoder, decoder = CompactEncoder(keyframe_interval=10), CompactDecoder()
+        for file in files[:50]:
+            tracks = json.loads(open(file, 'rb').read())['tracks']
+            if keyed:
+                for idx, track in enumerate(tracks):
+                    track['tracking-id'] = idx
+            decoded = decoder.decode_tracks(encoder.encode({'tracks': tracks}))
+            assert decoded is not None and len(decoded['tracks']) == len(tracks)
+            for track, result in zip(sorted(tracks, key=lambda t: t['tracking-id']),
+                                     sorted(decoded['tracks'], key=lambda t: t['tracking-id'])):
+                assert track['tracking-id'] == result['tracking-id'] and track['alert'] == result['alert']
+                assert np.allclose(track['coordinates'], result['coordinates'], rtol=1e-6)
+                assert np.allclose(list(track['bbox'].values()), list(result['bbox'].values()), rtol=1e-6)
+                assert abs(track['conf'] - result['conf']) < 1e-3
+                assert (track['kit_color'] is None and result['kit_color'] is None) or list(track['kit_color']) == result['kit_color']
+
+    print(f"{len(files)} frames")
+    pprint(benchmark(files))
@@ -192,6 +192,27 @@ class PerspectiveTransform(BTransformations):
                     result.append((int(transformed_point[0]), int(transformed_point[1])))
         # print(self.__dst_poly)
         return detections, result
+
+    def get_perspective_matrix(self)->np.ndarray:
+        return self.__pers_matrix
+
+    def transform_points(self, points:np.ndarray)->np.ndarray:
+        """
+        Applies the perspective transform to an (N, 2) array of points.
+        """
+        if points.shape[0] == 0:
+            return np.empty((0, 2), dtype=np.float64)
+        trans = cv.perspectiveTransform(np.ascontiguousarray(points, dtype=np.float32)[None, :, :], self.__pers_matrix)
+        return trans[0].astype(np.float64)
+
+    def transform_boxes(self, bboxes:np.ndarray)->np.ndarray:
+        """
+        Moves an (N, 4) array of (x1, y1, x2, y2) boxes by transforming their top left corner, the size is kept.
+        """
+        t_box = np.empty((bboxes.shape[0], 4), dtype=np.float64)
+        t_box[:, :2] = self.transform_points(bboxes[:, :2])
+        t_box[:, 2:] = t_box[:, :2] + (bboxes[:, 2:] - bboxes[:, :2])
+        return t_box
     
     def getDstPts(self)->list:
         if self.__centre_pt is not None:
@@ -253,6 +274,18 @@ class Transformer:
         return None, None, None, None
     
 
+    def get_perspective_matrix(self)->np.ndarray:
+        return self.__pers_transformer.get_perspective_matrix()
+
+    def get_normalization_matrix(self)->np.ndarray:
+        """
+        Returns the 3x3 matrix that maps transformed points to normalized coordinates (see __normalize_coordinates).
+        """
+        left, top, width, height = self.__pers_transformer.get_offsets()
+        return np.array([[1/width, 0, -left/width],
+                         [0, 1/height, -top/height],
+                         [0, 0, 1]], dtype=np.float64)
+
     def set_perspective_transform(self, pers_trans_obj:PerspectiveTransform)->None:
         self.__pers_transformer = pers_trans_obj
         self.__pitch_coordinates = pers_trans_obj.get_src_poly()
@@ -316,6 +349,19 @@ class Transformer:
             return n_pts
         return []
             
+    def transform_batch(self, foot:np.ndarray, bboxes:np.ndarray)->tuple[np.ndarray, np.ndarray]:
+        """
+        Array version of transform, takes the (N, 2) foot points and (N, 4) boxes of one camera
+        and returns the normalized pitch coordinates and the transformed boxes.
+        """
+        if self.__pers_transformer is None:
+            return foot.copy(), bboxes.copy()
+        left, top, width, height = self.__pers_transformer.get_offsets()
+        coordinates = np.trunc(self.__pers_transformer.transform_points(foot))
+        coordinates[:, 0] = (coordinates[:, 0] - left) / width
+        coordinates[:, 1] = (coordinates[:, 1] - top) / height
+        return coordinates, self.__pers_transformer.transform_boxes(bboxes)
+
     def transform(self, detections:list[dict])->list[dict]:
         detections_t = detections
         res_vector = None
@@ -335,3 +381,13 @@ def convert_box_2_points(dets:list)->list:
         a_list.append(bp.get_struct())
     return a_list
         
+
+
+def convert_boxes_2_points(bboxes:np.ndarray)->np.ndarray:
+    """
+    Array version of BoxToPoint, returns the bottom centre of every (x1, y1, x2, y2) box.
+    """
+    points = np.empty((bboxes.shape[0], 2), dtype=np.float64)
+    points[:, 0] = np.trunc(bboxes[:, 2] - (bboxes[:, 2] - bboxes[:, 0])/2)
+    points[:, 1] = np.trunc(bboxes[:, 3])
+    return points
@@ -3,6 +3,7 @@ from pathlib import Path
 import json
 import math
 import numpy as np
+from stitching import StitchingMap
 
 class Point:
     MINIMUM_PROXIMITY_DISTANCE = 0.025
@@ -120,6 +121,13 @@ class StateLoader:
             points.append(Point(coordinates[0], coordinates[1], idx, track)) 
         return points
 
+    @staticmethod
+    def load_coordinates(data:list[dict])->np.ndarray:
+        """
+        Array version of load_points, the (N, 2) coordinates of the tracks.
+        """
+        return np.array([track['coordinates'][:2] for track in data], dtype=np.float64).reshape(-1, 2)
+
 
 class DataLoader:
     def __init__(self) -> None:
@@ -129,6 +137,8 @@ class DataLoader:
     def load_config_data(self)->dict:
         """
         1. This function loads the transformer and space merger config data
+        2. 'cams_config' lists the calib_cam_<index> files in the order of their index (not the directory order)
+        3. 'stitching_map' is the StitchingMap of the rig, built once from the cameras and the optional stitching.json
         """
         result  = {}
         for file in os.scandir(self.__root):
@@ -137,13 +147,19 @@ class DataLoader:
                 name = file.name.split('.')[0]
                 # print(name)
                 result[name] = data
-        result['cams_config'] = []
-        for key in result:
-            if 'cam' in key and 'calib_' in key:
-                # print(key)
-                result['cams_config'].append(result[key])
+        cam_keys = [key for key in result if 'cam' in key and 'calib_' in key]
+        result['cams_config'] = [result[key] for key in sorted(cam_keys, key=DataLoader.camera_index)]
+        result['stitching_map'] = StitchingMap.from_config(result)
         return result
 
+    @staticmethod
+    def camera_index(name:str)->tuple:
+        """
+        Sort key of the calibration files, calib_cam_10 comes after calib_cam_9.
+        """
+        suffix = name.rsplit('_', 1)[-1]
+        return (int(suffix), name) if suffix.isdigit() else (math.inf, name)
+
         
 
         
@@ -0,0 +1,171 @@
+"""
+Columnar (struct-of-arrays) representation of one frame of detections.
+
+A FrameBatch is built once from the kit-detector Kafka message and handed
+through every stage of the live loop:
+    1. InputData            -> bbox, foot point, confidence, class, kit colour
+    2. SpaceTransformer     -> pitch coordinates and transformed boxes
+    3. SpaceMerger          -> unified pitch coordinates, stitched boxes, overlap flags, children
+    4. BoTSORT              -> track ids
+Dicts are only created again at the output boundary with `to_dicts`.
+"""
+import numpy as np
+
+
+class FrameBatch:
+    # flags bit field
+    OVERLAP = 0x01
+    HAS_CHILD = 0x02
+    IS_CHILD = 0x04
+    OVERLAP_PARENT = 0x08 # overlap detection of the camera holding the overlap, it takes the child
+
+    def __init__(self, size:int=0)->None:
+        self.camera = np.zeros(size, dtype=np.int16)
+        self.bbox = np.zeros((size, 4), dtype=np.float64) # x1, y1, x2, y2 in the camera frame
+        self.box = np.zeros((size, 4), dtype=np.float64) # x1, y1, x2, y2 in the stitched frame
+        self.foot = np.zeros((size, 2), dtype=np.float64) # bottom centre of the box in the camera frame
+        self.coordinates = np.zeros((size, 2), dtype=np.float64) # pitch coordinates
+        self.t_box = np.zeros((size, 4), dtype=np.float64) # perspective transformed box
+        self.conf = np.zeros(size, dtype=np.float64)
+        self.cls = np.zeros(size, dtype=np.float64)
+        self.kit_color = np.full((size, 3), np.nan, dtype=np.float64)
+        self.flags = np.zeros(size, dtype=np.uint8)
+        self.overlap_side = np.full(size, -1, dtype=np.int8)
+        self.child = np.full(size, -1, dtype=np.int32) # row index of the child detection
+        self.track_id = np.full(size, -1, dtype=np.int64)
+        self.num_cams = 0
+        self.aligned = False # coordinates are already in the unified pitch space
+
+    def __len__(self)->int:
+        return self.camera.shape[0]
+
+    @staticmethod
+    def from_message(cams_detections_object:dict)->'FrameBatch':
+        """
+        Build the batch straight from the decoded kit-detector message
+            {'cams': {<cam>: {'detections': [{'bbox':{x, y, width, height}, 'confidence', 'class', 'kit_color'}]}}}
+        Cameras are indexed in the order they appear in the message, boxes are converted (x, y, w, h) -> (x1, y1, x2, y2).
+        """
+        cams_data = cams_detections_object['cams']
+        cameras, xywh, conf, cls, colors = [], [], [], [], []
+        for idx, camera in enumerate(cams_data.keys()):
+            for det in cams_data[camera]['detections']:
+                bbox = det['bbox']
+                cameras.append(idx)
+                xywh.append((bbox['x'], bbox['y'], bbox['width'], bbox['height']))
+                conf.append(det.get('confidence', 0))
+                cls.append(det.get('class', 0))
+                color = det.get('kit_color')
+                colors.append(color if color is not None else (np.nan, np.nan, np.nan))
+
+        batch = FrameBatch(len(cameras))
+        batch.num_cams = len(cams_data)
+        if len(cameras) == 0:
+            return batch
+
+        xywh = np.array(xywh, dtype=np.float64)
+        batch.camera[:] = cameras
+        batch.bbox[:, :2] = xywh[:, :2]
+        batch.bbox[:, 2:] = xywh[:, :2] + xywh[:, 2:]
+        batch.box[:] = batch.bbox
+        batch.conf[:] = conf
+        batch.cls[:] = cls
+        batch.kit_color[:] = colors
+        return batch
+
+    def select(self, index)->'FrameBatch':
+        """
+        Returns a new batch with the rows selected by a boolean mask or an index array.
+        Child links are remapped to the new row indices, children that are not selected are dropped.
+        """
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+
+        res = FrameBatch(0)
+        for name in ('camera', 'bbox', 'box', 'foot', 'coordinates', 't_box', 'conf', 'cls',
+                     'kit_color', 'flags', 'overlap_side', 'track_id'):
+            setattr(res, name, getattr(self, name)[index])
+
+        remap = np.full(len(self) + 1, -1, dtype=np.int32)
+        remap[index] = np.arange(index.shape[0], dtype=np.int32)
+        res.child = remap[self.child[index]]
+        res.num_cams = self.num_cams
+        res.aligned = self.aligned
+        return res
+
+    def camera_rows(self, cam:int)->np.ndarray:
+        return np.flatnonzero(self.camera == cam)
+
+    def camera_counts(self)->list[int]:
+        return np.bincount(self.camera, minlength=self.num_cams).tolist()
+
+    def top_level(self)->np.ndarray:
+        """
+        Row indices of the detections that are not held as a child of another detection.
+        """
+        return np.flatnonzero((self.flags & FrameBatch.IS_CHILD) == 0)
+
+    def to_output_results(self)->np.ndarray:
+        """
+        Builds the BoTSORT input matrix for the top level detections
+            [x1, y1, x2, y2, conf, class, pitch_x, pitch_y, t_x1, t_y1, t_x2, t_y2]
+        """
+        rows = self.top_level()
+        output_results = np.empty((rows.shape[0], 12), dtype=np.float64)
+        output_results[:, :4] = self.box[rows]
+        output_results[:, 4] = self.conf[rows]
+        output_results[:, 5] = self.cls[rows]
+        output_results[:, 6:8] = self.coordinates[rows]
+        output_results[:, 8:] = self.t_box[rows]
+        return output_results
+
+    def to_dicts(self)->list[dict]:
+        """
+        Output boundary, returns the top level detections as dicts with their children attached under 'child'.
+        """
+        bbox = self.bbox.tolist()
+        box = self.box.tolist()
+        coordinates = self.coordinates.tolist()
+        t_box = self.t_box.tolist()
+        conf = self.conf.tolist()
+        cls = self.cls.tolist()
+        colors = self.kit_color.tolist()
+        has_color = ~np.isnan(self.kit_color).any(axis=1)
+        camera = self.camera.tolist()
+        flags = self.flags.tolist()
+        sides = self.overlap_side.tolist()
+        children = self.child.tolist()
+        track_ids = self.track_id.tolist()
+
+        def row_dict(i:int)->dict:
+            det = {
+                'bbox': dict(zip(('x1', 'y1', 'x2', 'y2'), bbox[i])),
+                'box': dict(zip(('x1', 'y1', 'x2', 'y2'), box[i])),
+                'coordinates': tuple(coordinates[i]),
+                't_box': dict(zip(('x1', 'y1', 'x2', 'y2'), t_box[i])),
+                'confidence': conf[i],
+                'class': cls[i],
+                'kit_color': tuple(colors[i]) if has_color[i] else None,
+                'camera': camera[i],
+                'is_overlap': bool(flags[i] & FrameBatch.OVERLAP)
+            }
+            if det['is_overlap']:
+                det['overlap_side'] = sides[i]
+            if track_ids[i] >= 0:
+                det['track_id'] = track_ids[i]
+            return det
+
+        result = []
+        for i in self.top_level().tolist():
+            det = row_dict(i)
+            if flags[i] & FrameBatch.OVERLAP_PARENT:
+                det['has_child'] = bool(flags[i] & FrameBatch.HAS_CHILD)
+            if children[i] >= 0:
+                child = row_dict(children[i])
+                child['is_child'] = True
+                child['marker_id'] = i
+                det['child'] = child
+                det['marker_id'] = i
+            result.append(det)
+        return result
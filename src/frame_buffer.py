@@ -0,0 +1,106 @@
+"""
+Bounded hand-off buffer between a Kafka consumer thread and the tracking thread.
+
+Policies
+    latest : only the newest frame is kept, older undelivered frames are dropped (real time tracking).
+    fifo   : up to max_size frames are queued in a deque, the oldest frame is dropped when it is full.
+    block  : up to max_size frames are queued, the consumer thread waits when it is full (no drops).
+
+Every policy counts received, delivered and dropped frames and reports the consumer lag,
+so the operators can see when the tracker is shedding load. Memory stays bounded by max_size.
+"""
+import threading
+import time
+from collections import deque
+
+from tracker.tracking_utils.metrics import metrics
+
+
+class FrameBuffer:
+    LATEST = 'latest'
+    FIFO = 'fifo'
+    BLOCK = 'block'
+
+    def __init__(self, policy:str='latest', max_size:int=32, name:str='input')->None:
+        if policy not in (FrameBuffer.LATEST, FrameBuffer.FIFO, FrameBuffer.BLOCK):
+            raise ValueError("Error: Unknown frame buffer policy:" + str(policy))
+        self.__policy = policy
+        self.__name = name # label of the dropped frames metric
+        self.__max_size = 1 if policy == FrameBuffer.LATEST else max(1, max_size)
+        self.__frames = deque()
+        self.__cv = threading.Condition()
+        self.__closed = False
+
+        self.__received = 0
+        self.__delivered = 0
+        self.__dropped = 0
+        self.__last_age = 0. # seconds between the frame's timestamp and its delivery
+        self.__max_age = 0.
+        self.__offset_lag = None # messages left on the broker after the last delivered one
+
+    @property
+    def policy(self)->str:
+        return self.__policy
+
+    def __len__(self)->int:
+        with self.__cv:
+            return len(self.__frames)
+
+    def put(self, frame, timestamp:float=None, offset_lag:int=None)->bool:
+        """
+        Adds a frame, timestamp is the producer time of the frame in seconds (time.time() if None).
+        Returns False if the buffer was closed while waiting for space.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.__cv:
+            if self.__policy == FrameBuffer.BLOCK:
+                self.__cv.wait_for(lambda: len(self.__frames) < self.__max_size or self.__closed)
+                if self.__closed:
+                    return False
+            elif len(self.__frames) >= self.__max_size:
+                self.__frames.popleft()
+                self.__dropped += 1
+                metrics.inc('dropped_frames_total', buffer=self.__name)
+
+            self.__frames.append((frame, timestamp))
+            self.__received += 1
+            if offset_lag is not None:
+                self.__offset_lag = offset_lag
+            self.__cv.notify_all()
+        return True
+
+    def get(self, timeout:float=None):
+        """
+        Returns the next frame, or None if nothing arrived within the timeout (or the buffer was closed).
+        """
+        with self.__cv:
+            if not self.__cv.wait_for(lambda: len(self.__frames) > 0 or self.__closed, timeout):
+                return None
+            if len(self.__frames) == 0:
+                return None
+            frame, timestamp = self.__frames.popleft()
+            self.__delivered += 1
+            self.__last_age = max(0., time.time() - timestamp)
+            if self.__last_age > self.__max_age:
+                self.__max_age = self.__last_age
+            self.__cv.notify_all()
+            return frame
+
+    def close(self)->None:
+        with self.__cv:
+            self.__closed = True
+            self.__cv.notify_all()
+
+    def get_stats(self)->dict:
+        with self.__cv:
+            return {
+                'policy': self.__policy,
+                'depth': len(self.__frames),
+                'received': self.__received,
+                'delivered': self.__delivered,
+                'dropped': self.__dropped,
+                'lag_frames': len(self.__frames) + (self.__offset_lag or 0),
+                'broker_lag': self.__offset_lag,
+                'last_age_ms': round(self.__last_age*1e3, 3),
+                'max_age_ms': round(self.__max_age*1e3, 3)
+            }
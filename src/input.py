@@ -10,16 +10,21 @@ from confluent_kafka import Consumer, KafkaException
 import json
 from pprint import pprint
 from pre_transform import PreDetectionsTransform
-from coordinate_transforms import convert_box_2_points
+from coordinate_transforms import convert_box_2_points, convert_boxes_2_points
+from frame_batch import FrameBatch
+from frame_buffer import FrameBuffer
+from camera_pool import CameraPool
+from codec import decode_detections
+from kafka import kafka_message_info
+from tracker.tracking_utils.metrics import metrics
 
 class KafkaConsumer:
-    def __init__(self, brokers, group_id, topic):
+    def __init__(self, brokers, group_id, topic, policy=FrameBuffer.LATEST, max_queue=8):
         self.brokers = brokers
         self.group_id = group_id
         self.topic = topic
         self.run = True
-        self.message = None
-        self.cv = threading.Condition()
+        self.frames = FrameBuffer(policy, max_queue)
 
         self.conf = {
             'bootstrap.servers': brokers,
@@ -45,32 +50,39 @@ class KafkaConsumer:
                 else:
                     raise KafkaException(msg.error())
             else:
-                with self.cv:
-                    self.message = msg.value().decode('utf-8')
-                    self.cv.notify_all()
-
-    def wait_for_message(self):
-        with self.cv:
-            self.cv.wait_for(lambda: self.message is not None)
-            # print(f"Received message: {self.message}")
-            temp = self.message
-            self.message = None
-            return temp
+                timestamp, offset_lag = kafka_message_info(self.consumer, msg)
+                self.frames.put(msg.value(), timestamp, offset_lag)
+
+    def wait_for_message(self, timeout=None):
+        return self.frames.get(timeout)
+
+    def get_stats(self)->dict:
+        return self.frames.get_stats()
 
     def stop(self):
         self.run = False
+        self.frames.close()
         self.consumer.close()
 
 
 class InputData:
-    def __init__(self, broker="172.21.243.238:9092", topic = "kit-detector-topic", group_id = "tracking_core_consumer_1") -> None:
+    def __init__(self, broker="172.21.243.238:9092", topic = "kit-detector-topic", group_id = "tracking_core_consumer_1",
+                 policy=FrameBuffer.LATEST, max_queue=8, camera_pool:CameraPool=None) -> None:
         self.__id = 0
-        self.__kafka_consumer = KafkaConsumer(broker, group_id, topic)
+        self.__camera_pool = camera_pool # box-to-point of every camera on its own worker, shared with SpaceTransformer
+        self.__kafka_consumer = KafkaConsumer(broker, group_id, topic, policy, max_queue)
         self.__kafka_consumer.start()
     
     def stop(self):
         self.__kafka_consumer.stop()
 
+    def get_stats(self)->dict:
+        """
+        Dropped frames and consumer lag of the input, see FrameBuffer.get_stats.
+        """
+        return self.__kafka_consumer.get_stats()
+
+    @metrics.timed('input_wait_for_data')
     def wait_for_data(self)->list[list[dict]]:
         
         data = self.__kafka_consumer.wait_for_message()
@@ -81,10 +93,34 @@ class InputData:
         PreDetectionsTransform.xywh2xyxy(data)
         res_list = PreDetectionsTransform.cams2list(data)
         # Perform the coordinate transform (Turn the box to a point for every detection and throw away all the other data we are not using.)
-        for cam_data in res_list:
-            convert_box_2_points(cam_data)
+        if self.__camera_pool is not None:
+            self.__camera_pool.map(lambda idx, cam_data: convert_box_2_points(cam_data), res_list)
+        else:
+            for cam_data in res_list:
+                convert_box_2_points(cam_data)
+        if metrics.enabled:
+            for idx, cam_data in enumerate(res_list):
+                metrics.inc('detections_total', len(cam_data), camera=str(idx))
         return res_list 
 
+    @metrics.timed('input_wait_for_data')
+    def wait_for_batch(self, timeout=None)->FrameBatch|None:
+        """
+        Same as wait_for_data, but decodes the message once into a columnar FrameBatch.
+        Returns None if nothing arrived within the timeout.
+        """
+        data = self.__kafka_consumer.wait_for_message(timeout)
+        if data is None:
+            return None
+        batch = decode_detections(data)
+        if self.__camera_pool is None:
+            # with a camera pool the camera workers of SpaceTransformer compute the foot points
+            batch.foot = convert_boxes_2_points(batch.bbox)
+        if metrics.enabled:
+            for idx, count in enumerate(batch.camera_counts()):
+                metrics.inc('detections_total', count, camera=str(idx))
+        return batch
+
     
 
 
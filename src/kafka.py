@@ -1,9 +1,12 @@
 from configparser import ConfigParser
-from confluent_kafka import Consumer, OFFSET_BEGINNING,  Producer
+from confluent_kafka import Consumer, OFFSET_BEGINNING,  Producer, TopicPartition, TIMESTAMP_NOT_AVAILABLE
 from threading import Thread, Event
+from frame_buffer import FrameBuffer
 import json
 import pprint
 import re
+import time
+from tracker.tracking_utils.metrics import metrics, Histogram
 
 reset = False
 def reset_offset(consumer, partitions):
@@ -12,8 +15,25 @@ def reset_offset(consumer, partitions):
             p.offset = OFFSET_BEGINNING
         consumer.assign(partitions)
 
+def kafka_message_info(consumer:Consumer, msg)->tuple:
+    """
+    Returns (timestamp in seconds or None, messages left on the broker's partition after this one or None).
+    The watermarks come from the consumer's cache, so this doesn't make a broker request.
+    """
+    ts_type, ts = msg.timestamp()
+    timestamp = ts/1000 if ts_type != TIMESTAMP_NOT_AVAILABLE else None
+    offset_lag = None
+    try:
+        _, high = consumer.get_watermark_offsets(TopicPartition(msg.topic(), msg.partition()), cached=True)
+        if high >= 0:
+            offset_lag = max(0, high - msg.offset() - 1)
+    except Exception:
+        pass
+    return timestamp, offset_lag
+
+
 class KConsumer:
-    def __init__(self, config_path:str):
+    def __init__(self, config_path:str, policy:str=FrameBuffer.FIFO, max_queue:int=256):
         self.__config_path = config_path
         self.__config_parser = ConfigParser()
         self.__config = None
@@ -21,8 +41,7 @@ class KConsumer:
         self.__event = Event()
         self.__worker_thread = Thread(target=self.__run)
         self.__data_event = Event()
-        self.__data_queue = [] # for all data
-        self.__tracking_data_queue = []
+        self.__tracking_data_queue = FrameBuffer(policy, max_queue)
         self.__clear_to_leave = Event()
         self.__init()
 
@@ -51,8 +70,9 @@ class KConsumer:
                     print("ERROR: %s".format(msg.error()))
                 else:
                     message = msg.value().decode('utf-8')
-                    self.__data_queue.append(message)
-                    self.__tracking_data_queue.append(message)
+                    timestamp, offset_lag = kafka_message_info(self.__consumer, msg)
+                    if not self.__tracking_data_queue.put(message, timestamp, offset_lag):
+                        break
                     self.__data_event.set()
 
             print("Cleaning up and exiting ...")
@@ -77,6 +97,7 @@ class KConsumer:
 
     def stop(self):
         self.__event.set()
+        self.__tracking_data_queue.close()
         self.__clear_to_leave.wait()
 
 
@@ -88,35 +109,142 @@ class KConsumer:
         self.__data_event.wait(1)
         self.__data_event.clear()
 
-    def getTrackingData(self)->dict:
+    def getTrackingData(self, timeout:float=0)->dict:
         # you can only call this method once.
-        if len(self.__tracking_data_queue) <= 0:
-            return None
-        data_piece = self.__tracking_data_queue.pop(0)
-        return data_piece
+        return self.__tracking_data_queue.get(timeout)
+
+    def get_stats(self)->dict:
+        return self.__tracking_data_queue.get_stats()
+
 
 
+class ControlListener:
+    """
+    Consumes a control topic on its own thread and hands every JSON message (as a dict) to `callback`.
+    """
+    def __init__(self, config_path:str, topic:str, callback)->None:
+        self.__callback = callback
+        self.__consumer = KConsumer(config_path, FrameBuffer.FIFO, 16)
+        self.__consumer.subscribe(topic)
+        self.__event = Event()
+        self.__thread = Thread(target=self.__run, name='control-listener', daemon=True)
+
+    def start(self)->None:
+        self.__consumer.start()
+        self.__thread.start()
+
+    def __run(self)->None:
+        while not self.__event.is_set():
+            message = self.__consumer.getTrackingData(timeout=0.5)
+            if message is None:
+                continue
+            try:
+                self.__callback(json.loads(message))
+            except Exception as e:
+                print(f"Control message {message} failed: {e}")
+
+    def stop(self)->None:
+        self.__event.set()
+        self.__consumer.stop()
+
 
 class KProducer:
-    def __init__(self, config_file):
+    """
+    Output publisher, send_message() only hands the message to a bounded spool and returns.
+    1. A publisher thread moves the spooled messages to the librdkafka producer, which batches them
+       (linger.ms, compression.type, see [producer] in the config file), and serves the delivery callbacks,
+       so neither produce() nor poll() run on the tracking thread.
+    2. The spool keeps the newest `spool_size` messages, when the broker is away the oldest frames are dropped
+       instead of blocking track2 (they are stale by the time the broker is back).
+    3. get_stats() reports the spool depth, the messages in flight, delivered / failed / dropped counters
+       and the delivery latency (send_message -> broker ack).
+    """
+    DEFAULT_SETTINGS = {
+        'linger.ms': '5',
+        'compression.type': 'lz4',
+        'queue.buffering.max.messages': '1000',
+        'message.timeout.ms': '5000'
+    }
+
+    def __init__(self, config_file, spool_size:int=256):
         self.config = ConfigParser()
         self.config.read(config_file)
         conf = {
             'bootstrap.servers': self.config.get('default', 'bootstrap.servers'),
             'client.id': 'tracking_core_producer'
         }
+        conf.update(KProducer.DEFAULT_SETTINGS)
+        if self.config.has_section('producer'):
+            conf.update(dict(self.config['producer']))
         self.producer = Producer(conf)
 
-    def delivery_report(self, err, msg):
-        # return
+        self.__spool = FrameBuffer(FrameBuffer.FIFO, spool_size, 'output')
+        self.__latency = Histogram()
+        self.__delivered = 0
+        self.__failed = 0
+        self.__last_error = None
+        self.__event = Event()
+        self.__thread = Thread(target=self.__run, name='kafka-publisher', daemon=True)
+        self.__thread.start()
+
+    def delivery_report(self, err, msg, sent_time:float=None):
         if err is not None:
-            print(f"Message delivery failed: {err} Message : {msg}")
-        # else:
-            # print(f"Message delivered to {msg.topic()} [{msg.partition()}]")
+            self.__failed += 1
+            self.__last_error = str(err)
+            metrics.inc('kafka_delivery_failed_total', topic=msg.topic())
+            return
+        self.__delivered += 1
+        if sent_time is not None:
+            latency = time.perf_counter() - sent_time
+            self.__latency.record(int(latency*1e6))
+            if metrics.enabled:
+                metrics.histogram('kafka_delivery').record(int(latency*1e6))
 
     def send_message(self, topic, message):
-        self.producer.produce(topic, message.encode('utf-8'),'tracking-data'.encode('utf-8'), callback=self.delivery_report)
-        self.producer.poll(0)
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        self.__spool.put((topic, message, time.perf_counter()))
+
+    def __run(self):
+        while True:
+            item = self.__spool.get(timeout=0.05)
+            if item is None:
+                self.producer.poll(0)
+                if self.__event.is_set() and len(self.__spool) == 0:
+                    break
+                continue
+            topic, message, sent_time = item
+            while True:
+                try:
+                    self.producer.produce(topic, message, 'tracking-data'.encode('utf-8'),
+                                          on_delivery=lambda err, msg, sent_time=sent_time: self.delivery_report(err, msg, sent_time))
+                    break
+                except BufferError:
+                    # librdkafka's queue is full, serve the callbacks to make room
+                    self.producer.poll(0.05)
+            self.producer.poll(0)
+
+    def get_stats(self)->dict:
+        spool = self.__spool.get_stats()
+        p50, p99 = self.__latency.quantiles((0.5, 0.99))
+        return {
+            'spooled': spool['depth'],
+            'in_flight': len(self.producer),
+            'sent': spool['delivered'],
+            'delivered': self.__delivered,
+            'failed': self.__failed,
+            'dropped': spool['dropped'],
+            'last_error': self.__last_error,
+            'delivery_p50_ms': round(p50*1e-3, 3),
+            'delivery_p99_ms': round(p99*1e-3, 3),
+            'delivery_max_ms': round(self.__latency.max*1e-3, 3)
+        }
 
-    def close(self):
-        self.producer.flush()
\ No newline at end of file
+    def close(self, timeout:float=5.):
+        """
+        Publishes what is left in the spool and waits up to `timeout` seconds for the deliveries.
+        """
+        self.__event.set()
+        self.__thread.join(timeout)
+        self.__spool.close()
+        return self.producer.flush(timeout)
@@ -4,28 +4,51 @@ import time
 from pathlib import Path
 from cfg.paths_config import __BASE_DIR__, __TRACKING_DATA_DIR__, __KAFKA_CONFIG__
 from pprint import pprint
+from codec import encode_tracks, CompactEncoder
+from tracker.tracking_utils.metrics import metrics
 
 
 
 class DetectionsOutput:
-    def __init__(self)->None:
+    def __init__(self, output_format:str="json", compact_topic:str="ui-data-compact", keyframe_interval:int=30)->None:
+        """
+        output_format json writes the ui-data frames to 'ui-data', compact writes the binary keyframe / delta frames
+        of codec.CompactEncoder to compact_topic (decoded with codec.CompactDecoder).
+        """
+        if output_format not in ("json", "compact"):
+            raise ValueError(f"Error: Unknown output format {output_format}")
         self.__detections = None
         self.__output = None
         self.__kafka_producer = KProducer(__KAFKA_CONFIG__)
         self.__output_dir = __TRACKING_DATA_DIR__
+        self.__compact_encoder = CompactEncoder(keyframe_interval) if output_format == "compact" else None
+        self.__compact_topic = compact_topic
 
     def update(self, data:dict)->None:
         self.__output = data
 
+    @metrics.timed('output_write_to_kafka')
     def write_to_kafka(self):
         if self.__output is not None:
             # pprint(self.__output)
-            self.__kafka_producer.send_message('ui-data', json.dumps(self.__output))
+            if self.__compact_encoder is not None:
+                self.__kafka_producer.send_message(self.__compact_topic, self.__compact_encoder.encode(self.__output))
+            else:
+                self.__kafka_producer.send_message('ui-data', encode_tracks(self.__output))
             # print("Written data to kafka")
 
+    def get_stats(self)->dict:
+        """
+        Spool depth, deliveries and delivery latency of the output, see KProducer.get_stats.
+        """
+        return self.__kafka_producer.get_stats()
+
+    def close(self)->None:
+        self.__kafka_producer.close()
+
     def write_to_file(self):
         if self.__output is not None:
             
-            with open(self.__output_dir / Path(f'track_data_{time.time()}.json'), 'w') as fp:
-                json.dump(self.__output, fp)
+            with open(self.__output_dir / Path(f'track_data_{time.time()}.json'), 'wb') as fp:
+                fp.write(encode_tracks(self.__output))
         
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+Staged executor for the live loop.
+Every stage runs on its own thread and the stages are connected by bounded queues:
+
+    source (wait + decode) -> [queue] -> geometry -> [queue] -> tracking -> [queue] -> publish
+
+1. A full queue blocks the stage in front of it (backpressure), so at most queue_size frames wait between two stages.
+2. One thread per stage and FIFO queues keep the frames in order.
+3. Only the tracking stage thread touches the tracker state (single writer).
+Throughput then follows the slowest stage instead of the sum of all the stages.
+"""
+import threading
+import queue
+import time
+
+
+class StageTimer:
+    def __init__(self, name:str)->None:
+        self.name = name
+        self.frames = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.last_time = 0.
+        self.blocked_time = 0. # time spent waiting on a full output queue
+        self.__lock = threading.Lock()
+
+    def add(self, duration:float, blocked:float=0.)->None:
+        with self.__lock:
+            self.frames += 1
+            self.total_time += duration
+            self.last_time = duration
+            self.blocked_time += blocked
+            if duration > self.max_time:
+                self.max_time = duration
+
+    def to_dict(self)->dict:
+        with self.__lock:
+            average = self.total_time / self.frames if self.frames else 0.
+            return {
+                'frames': self.frames,
+                'avg_ms': round(average*1e3, 3),
+                'max_ms': round(self.max_time*1e3, 3),
+                'last_ms': round(self.last_time*1e3, 3),
+                'blocked_ms': round(self.blocked_time*1e3, 3)
+            }
+
+
+class Pipeline:
+    STOP = object()
+
+    def __init__(self, source, stages:list[tuple], queue_size:int=2, on_error=None)->None:
+        """
+        source: callable returning the next frame, or None when nothing arrived (it is called again).
+        stages: list of (name, callable) pairs, each callable takes the previous stage's result.
+        """
+        self.__source = source
+        self.__stages = stages
+        self.__running = threading.Event()
+        self.__queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.__timers = [StageTimer('source')] + [StageTimer(name) for name, _ in stages]
+        self.__threads = []
+        self.__on_error = on_error
+        self.error = None
+
+    def start(self)->None:
+        self.__running.set()
+        source_thread = threading.Thread(target=self.__run_source, name='pipeline-source', daemon=True)
+        self.__threads.append(source_thread)
+        for idx, (name, func) in enumerate(self.__stages):
+            out_queue = self.__queues[idx+1] if idx+1 < len(self.__queues) else None
+            t = threading.Thread(target=self.__run_stage, args=(func, self.__queues[idx], out_queue, self.__timers[idx+1]),
+                                 name=f'pipeline-{name}', daemon=True)
+            self.__threads.append(t)
+        for t in self.__threads:
+            t.start()
+
+    def stop(self)->None:
+        self.__running.clear()
+
+    def join(self, timeout:float=None)->None:
+        # The source may be blocked on its input, the other stages drain and exit on the STOP marker
+        for t in self.__threads[1:]:
+            t.join(timeout)
+
+    def is_running(self)->bool:
+        return self.__running.is_set()
+
+    def get_timings(self)->dict:
+        result = {timer.name: timer.to_dict() for timer in self.__timers}
+        result['queues'] = [q.qsize() for q in self.__queues]
+        return result
+
+    def __fail(self, e:Exception)->None:
+        self.error = e
+        self.__running.clear()
+        if self.__on_error is not None:
+            self.__on_error(e)
+
+    def __put(self, out_queue:queue.Queue, item)->float:
+        start_time = time.perf_counter()
+        while True:
+            try:
+                out_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if not self.__running.is_set() and item is not Pipeline.STOP:
+                    break
+        return time.perf_counter() - start_time
+
+    def __run_source(self)->None:
+        timer = self.__timers[0]
+        try:
+            while self.__running.is_set():
+                start_time = time.perf_counter()
+                item = self.__source()
+                if item is None:
+                    continue
+                duration = time.perf_counter() - start_time
+                timer.add(duration, self.__put(self.__queues[0], item))
+        except Exception as e:
+            self.__fail(e)
+        finally:
+            self.__put(self.__queues[0], Pipeline.STOP)
+
+    def __run_stage(self, func, in_queue:queue.Queue, out_queue:queue.Queue, timer:StageTimer)->None:
+        while True:
+            item = in_queue.get()
+            if item is Pipeline.STOP:
+                if out_queue is not None:
+                    self.__put(out_queue, Pipeline.STOP)
+                return
+            if self.error is not None:
+                continue
+            try:
+                start_time = time.perf_counter()
+                res = func(item)
+                duration = time.perf_counter() - start_time
+                blocked = self.__put(out_queue, res) if out_queue is not None else 0.
+                timer.add(duration, blocked)
+            except Exception as e:
+                self.__fail(e)
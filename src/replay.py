@@ -0,0 +1,235 @@
+"""
+Offline replay of the recorded tracking_data_files through the live loop.
+
+    python src/replay.py [--rate max|realtime|<N>x] [--limit N] [--loops N] [--policy block|fifo|latest] [--output report.json]
+                         [--metrics] [--metrics-port PORT] [--camera-workers]
+
+1. ReplayInput stands in for InputData, a producer thread publishes the recorded frames into a FrameBuffer
+   at the requested rate (the gaps between the frames come from the time stamps in the file names).
+2. Every frame goes through decode -> SpaceTransformer -> SpaceMerger -> track2 -> encode, each stage is timed.
+3. The report (p50/p95/p99 per stage in ms, frames/sec, dropped frames and peak RSS) is printed as JSON,
+   with --metrics the hot path metrics (tracking_utils/metrics.py) are enabled and added to it.
+   With --camera-workers the geometry runs on one worker per camera (camera_pool.py) and their latencies are reported.
+Recorded ui-data frames are turned back into detector messages, detector messages are replayed as they are.
+Run it from the repository root, like App.py.
+"""
+import argparse
+import json
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from cfg.paths_config import __TRACKING_DATA_DIR__
+from codec import decode_detections, encode_tracks, detector_message_from_tracks
+from coordinate_transforms import convert_boxes_2_points
+from frame_buffer import FrameBuffer
+from tracker.tracking_utils.metrics import metrics
+
+DEFAULT_FRAME_GAP = 1/30
+
+
+def load_frames(data_dir:Path=__TRACKING_DATA_DIR__, limit:int=None)->list[tuple]:
+    """
+    Returns [(timestamp, detector message bytes)] sorted by time.
+    """
+    frames = []
+    for file in data_dir.glob('*.json'):
+        try:
+            timestamp = float(file.stem.split('_')[-1])
+        except ValueError:
+            timestamp = None
+        frames.append((timestamp, file))
+    frames.sort(key=lambda f: (f[0] is None, f[0] or 0, f[1].name))
+    if limit is not None:
+        frames = frames[:limit]
+
+    result = []
+    for timestamp, file in frames:
+        with open(file, 'rb') as fp:
+            raw = fp.read()
+        data = json.loads(raw)
+        message = raw if 'cams' in data else detector_message_from_tracks(data)
+        result.append((timestamp, message))
+    return result
+
+
+def parse_rate(rate:str)->float:
+    """
+    'max' -> 0 (no pacing), 'realtime' -> 1, '<N>x' or '<N>' -> N times real time.
+    """
+    if rate == 'max':
+        return 0.
+    if rate == 'realtime':
+        return 1.
+    return float(rate.rstrip('x'))
+
+
+class ReplayInput:
+    """
+    In process stand-in for InputData (wait_for_batch, get_stats, stop).
+    """
+    def __init__(self, frames:list[tuple], speed:float=0., loops:int=1, policy:str=FrameBuffer.BLOCK, max_queue:int=8,
+                 foot:bool=True)->None:
+        self.__frames = frames
+        self.__foot = foot
+        self.__speed = speed
+        self.__loops = loops
+        self.__buffer = FrameBuffer(policy, max_queue)
+        self.__done = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='replay-producer', daemon=True)
+
+    def start(self)->None:
+        self.__thread.start()
+
+    def __run(self)->None:
+        start_time = time.perf_counter()
+        offset = 0.
+        for _ in range(self.__loops):
+            first = self.__frames[0][0] if len(self.__frames) else None
+            last = 0.
+            for idx, (timestamp, message) in enumerate(self.__frames):
+                if self.__stop.is_set():
+                    break
+                last = (timestamp - first) if timestamp is not None and first is not None else idx*DEFAULT_FRAME_GAP
+                if self.__speed > 0:
+                    delay = start_time + (offset + last)/self.__speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                if not self.__buffer.put(message):
+                    break
+            offset += last + DEFAULT_FRAME_GAP
+        self.__done.set()
+
+    def finished(self)->bool:
+        return self.__done.is_set() and len(self.__buffer) == 0
+
+    def wait_for_message(self, timeout=None)->bytes|None:
+        return self.__buffer.get(timeout)
+
+    def wait_for_batch(self, timeout=None):
+        message = self.wait_for_message(timeout)
+        if message is None:
+            return None
+        return decode_batch(message, self.__foot)
+
+    def get_stats(self)->dict:
+        return self.__buffer.get_stats()
+
+    def stop(self)->None:
+        self.__stop.set()
+        self.__buffer.close()
+
+
+def decode_batch(message:bytes, foot:bool=True):
+    batch = decode_detections(message)
+    if foot:
+        batch.foot = convert_boxes_2_points(batch.bbox)
+    if metrics.enabled:
+        for idx, count in enumerate(batch.camera_counts()):
+            metrics.inc('detections_total', count, camera=str(idx))
+    return batch
+
+
+def percentiles(samples:list)->dict:
+    if len(samples) == 0:
+        return {'p50': 0., 'p95': 0., 'p99': 0., 'max': 0.}
+    values = np.array(samples)*1e3
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3), 'max': round(float(values.max()), 3)}
+
+
+def peak_rss_mb()->float:
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024*1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def replay(frames:list[tuple], speed:float=0., loops:int=1, policy:str=FrameBuffer.BLOCK, camera_workers:bool=False)->dict:
+    from dataloader import DataLoader
+    from transformer import SpaceTransformer
+    from space_merger import SpaceMerger
+    from camera_pool import CameraPool
+    from botsort_tracker import track2, get_pool_metrics
+
+    stitching_map = DataLoader().load_config_data()['stitching_map']
+    camera_pool = CameraPool(stitching_map.num_cams) if camera_workers else None
+    space_transformer = SpaceTransformer(stitching_map, camera_pool)
+    space_merger = SpaceMerger(stitching_map)
+    if camera_pool is None:
+        space_transformer.fuse()
+
+    stages = ('decode', 'transform', 'merge', 'track', 'encode', 'total')
+    timings = {name: [] for name in stages}
+    output_bytes = 0
+
+    input_data = ReplayInput(frames, speed, loops, policy, foot=camera_pool is None)
+    input_data.start()
+    start_time = time.perf_counter()
+    try:
+        while not input_data.finished():
+            message = input_data.wait_for_message(timeout=0.1)
+            if message is None:
+                continue
+            t0 = time.perf_counter()
+            batch = decode_batch(message, camera_pool is None)
+            t1 = time.perf_counter()
+            transformed_data = space_transformer.apply_transform_batch(batch)
+            t2 = time.perf_counter()
+            merged_data = space_merger.merge_batch(transformed_data)
+            t3 = time.perf_counter()
+            _, tracked_data = track2(merged_data)
+            t4 = time.perf_counter()
+            output_bytes += len(encode_tracks(tracked_data))
+            t5 = time.perf_counter()
+
+            for name, duration in zip(stages, (t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, t5-t0)):
+                timings[name].append(duration)
+    finally:
+        input_data.stop()
+        if camera_pool is not None:
+            camera_pool.close()
+    elapsed = time.perf_counter() - start_time
+
+    frames_done = len(timings['total'])
+    return {
+        'frames': frames_done,
+        'elapsed_s': round(elapsed, 3),
+        'fps': round(frames_done / elapsed, 2) if elapsed > 0 else 0.,
+        'speed': speed,
+        'policy': policy,
+        'latency_ms': {name: percentiles(samples) for name, samples in timings.items()},
+        'input': input_data.get_stats(),
+        'output_bytes': output_bytes,
+        'cameras': camera_pool.get_timings() if camera_pool is not None else None,
+        'pools': {key: value for key, value in get_pool_metrics().items() if key != 'history'},
+        'peak_rss_mb': peak_rss_mb(),
+        'metrics': metrics.snapshot() if metrics.enabled else None
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the recorded frames through the tracker and report the stage latencies.")
+    parser.add_argument('--rate', default='max', help="max, realtime or a speed up like 4x")
+    parser.add_argument('--limit', type=int, default=None, help="number of recorded frames to use")
+    parser.add_argument('--loops', type=int, default=1, help="times the recording is played")
+    parser.add_argument('--policy', default=FrameBuffer.BLOCK, choices=(FrameBuffer.BLOCK, FrameBuffer.FIFO, FrameBuffer.LATEST))
+    parser.add_argument('--data', type=Path, default=__TRACKING_DATA_DIR__, help="directory with the recorded frames")
+    parser.add_argument('--output', type=Path, default=None, help="write the report to this file as well")
+    parser.add_argument('--metrics', action='store_true', help="enable the hot path metrics")
+    parser.add_argument('--metrics-port', type=int, default=None, help="serve the metrics on localhost:PORT/metrics")
+    parser.add_argument('--camera-workers', action='store_true', help="one geometry worker per camera instead of the fused transform")
+    args = parser.parse_args()
+    if args.metrics or args.metrics_port is not None:
+        metrics.configure(True, args.metrics_port)
+
+    report = replay(load_frames(args.data, args.limit), parse_rate(args.rate), args.loops, args.policy, args.camera_workers)
+    report_json = json.dumps(report, indent=2)
+    print(report_json)
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            fp.write(report_json)
@@ -1,36 +1,27 @@
 from pprint import pprint
-import math
+import numpy as np
+from frame_batch import FrameBatch
+from stitching import StitchingMap
+from tracker import matching
+from tracker.tracking_utils.metrics import metrics
 
 
 class SpaceMerger:
-    def __init__(self, main_boundary:list, inner_boundary:list)->None:
-        self.__stream_results = [] # a list of tuples containing the current results
-        self.__left_wing = 7/20
-        self.__right_wing = 7/20
-        self.__middle = 6/20
-        self.__m_overlap = (1/20)*0.3
-        self.__is_init = False
-
-        # Overlap settings
-        self.__overlaping_points = []
-        self.__frame_width = 1
-        self.__frame_height = 1
-        self.__one_frame_width = 1
-        self.__m_left_overlap = 0
-        self.__m_right_overlap = 0
-        self.__main_boundary = main_boundary # These relate to cam 2's transformer.
-        self.__mini_boundary = inner_boundary # Along with this one
-
-        self.init()
-
-
-    def init(self)->None:
-        self.__m_left_overlap = (self.__mini_boundary[0]['coordinates'][0] - self.__main_boundary[0]['coordinates'][0])*self.__left_wing
-        self.__m_right_overlap = (self.__main_boundary[1]['coordinates'][0]- self.__mini_boundary[1]['coordinates'][0])*self.__left_wing
+    CHILD_DISTANCE = 0.035 # pitch distance under which a side camera detection is the child of an overlap detection
+
+    def __init__(self, stitching_map:StitchingMap)->None:
+        """
+        The alignment of the cameras and the overlap bands come from the stitching map (see stitching.py).
+        """
+        self.__stitching_map = stitching_map
+        self.__is_init = True
 
     def is_init(self)->bool:
         return self.__is_init
 
+    def get_stitching_map(self)->StitchingMap:
+        return self.__stitching_map
+
     def align_frame_points(self, dts:list[dict], stream_id)->list[dict]:
         for det in dts:
             det = self.align_detection(det, stream_id)
@@ -43,136 +34,131 @@ class SpaceMerger:
         return det
 
     def align_x(self, x_coord, stream_id):
-        if stream_id == 0:
-            x_scaled = x_coord * self.__left_wing
-            return x_scaled
-        elif stream_id ==1:
-            x_scaled = x_coord * (self.__middle + self.__m_left_overlap + self.__m_right_overlap)
-            x_shifted = x_scaled + (self.__left_wing - self.__m_left_overlap)
-            return x_shifted
-        elif stream_id == 2:
-            x_scaled = x_coord * self.__right_wing
-            x_shifted = x_scaled + (self.__left_wing + self.__middle)
-            return x_shifted
-        return x_coord
-
-    def overlap_has_child(self, det, cam_dets:list[dict])->dict:
-        '''
-        1. Look for the child associated with the overlap center detection, if any.
-        2. return that child or not if no child exists
-
-        Child finding Algorithm
-        1. Check if the current detection is y units below the center detection point
-        2. check if the current detections x offset lives with 0 < x < dist.
-        3. if both the conditions are met, we assign it and mark it. and return
-        4. The child must be in the overlapped region as well
-        '''
-        child_dist = 0.035
-        det['has_child'] = False
-        center_coord = det.get('coordinates')
-        closest_distance = math.inf
-        child_index = math.inf
-
-        for idx, c in enumerate(cam_dets):
-            coord =  c.get('coordinates')
-            if not c.get('is_overlap') and c.get('is_child'):
-                continue
-
-            dist = math.sqrt(((center_coord[0]-coord[0])**2)+((center_coord[1] - coord[1])**2))
-            if dist <= child_dist:
-                distance = dist
-                if distance < closest_distance:
-                    closest_distance = distance
-                    child_index = idx
-
-        if closest_distance is not math.inf:
-            child = cam_dets.pop(child_index)
+        scale, shift = self.get_alignment(stream_id)
+        return x_coord*scale + shift
+
+    def get_alignment(self, stream_id)->tuple[float, float]:
+        """
+        Returns the (scale, shift) pair align_x applies to the x coordinate of the stream.
+        """
+        return self.__stitching_map.alignment(stream_id)
+
+    @metrics.timed('space_merger_merge')
+    def merge(self, cams_detections:list[list[dict]])->list[dict]:
+        """
+        1. The coordinates of all the cameras go in one array, the detections outside the pitch are dropped
+           and the x coordinates aligned to the unified space.
+        2. The overlap flags come from the overlap bands of the stitching map, the boxes are stitched.
+        3. The overlap detections are paired with their children (pair_overlaps), the children leave the camera lists.
+        """
+        stitching_map = self.__stitching_map
+        cams_detections = cams_detections[:stitching_map.num_cams]
+        dets = [det for dets_group in cams_detections for det in dets_group]
+        if len(dets) == 0:
+            return []
+        camera = np.repeat(np.arange(len(cams_detections)), [len(dets_group) for dets_group in cams_detections])
+        coordinates = np.array([det['coordinates'] for det in dets], dtype=np.float64).reshape(-1, 2)
+        rows = np.flatnonzero(stitching_map.in_bounds(coordinates, camera, False))
+        camera = camera[rows]
+        x = stitching_map.align(coordinates[rows, 0], camera)
+        aligned = np.stack((x, coordinates[rows, 1]), axis=1)
+        overlap, side, parent = stitching_map.overlaps(x, camera)
+
+        kept = [dets[row] for row in rows.tolist()]
+        for det, cam, x_aligned, is_overlap, overlap_side, box_offset in zip(kept, camera.tolist(), x.tolist(), overlap.tolist(),
+                                                                            side.tolist(), stitching_map.box_offset[camera].tolist()):
+            det['coordinates'] = (x_aligned, det['coordinates'][1])
+            det['is_overlap'] = is_overlap
+            if is_overlap:
+                det['overlap_side'] = overlap_side
+            if box_offset:
+                det['box']['x1'] += box_offset
+                det['box']['x2'] += box_offset
+            det['camera'] = cam
+
+        parents = np.flatnonzero(parent)
+        candidates = stitching_map.candidates(camera, parent)
+        for p in parents.tolist():
+            kept[p]['has_child'] = False
+        pairs = self.pair_overlaps(aligned[parents], side[parents], aligned[candidates], camera[candidates])
+        is_child = np.zeros(len(kept), dtype=bool)
+        for p, c in pairs.tolist():
+            det, child = kept[parents[p]], kept[candidates[c]]
             child['is_child'] = True
             child['marker_id'] = id(det)
             det['child'] = child
             det['has_child'] = True
-            det['marker_id'] =  id(det)
-            del child
-        return det
-
-    def is_in_overlap(self, det):
-        coord = det.get('coordinates')
-        det['is_overlap'] = False
-        # This is the left overlap region
-        error_constant = 0.01
-        overlap_start = self.__left_wing - self.__m_left_overlap - error_constant
-        overlap_end  = self.__left_wing + error_constant
-        if coord[0] >=overlap_start and coord[0] <=overlap_end:
-            det['is_overlap'] = True
-            det['overlap_side'] = 0 # cam 0
-            # print(det, overlap_start, overlap_end)
-            return det
-
-        # check overlap in the right region
-        error_constant_2 = 0.01
-        overlap_start = (self.__left_wing + self.__middle) - error_constant_2
-        overlap_end  = (self.__left_wing + self.__middle) +  self.__m_right_overlap + error_constant
-        if coord[0] >= overlap_start and coord[0] <= overlap_end:
-            det['is_overlap'] = True
-            det['overlap_side'] = 2 # cam 3
-            # print(det, overlap_start, overlap_end)
-            return det
-
-        return det
-
-    # stream1 = 0-30%; stream2 = 31-70%; stream3 = 71-100%
-    def merge(self, cams_detections:list[list[dict]])->list[dict]:
-        unified_space = []
-        width = 2590
-        cam1_space = []
-        cam2_space = []
-        cam3_space = []
-        offset = 0.004
-        for idx, dets_group in enumerate(cams_detections):
-           for det in dets_group:
-                coord = det['coordinates']
-               # left wing
-                if idx == 0:
-                    
-                    if (coord[0] >= 0 and coord[0]<=1) and (coord[1]>=0 and coord[1] <=1):
-                        x_scaled = self.align_x(coord[0], idx)#coord[0] * self.__left_wing
-                        det['coordinates'] = (x_scaled, coord[1])
-                        det = self.is_in_overlap(det)
-                        det['camera'] = idx
-                        cam1_space.append(det)
-                # middle
-                elif idx == 1:
-                    if (coord[0]>=0 and coord[0]<=1-offset) and (coord[1]>=0 and coord[1]<=1):
-                        x_shifted = self.align_x(coord[0], idx)
-                        det['coordinates'] = (x_shifted, coord[1])
-                        det = self.is_in_overlap(det)
-                        det['box']['x1'] += width
-                        det['box']['x2'] += width
-                        det['camera'] = idx
-                        cam2_space.append(det)
-
-                # Right wing
-                elif idx==2:
-                    if (coord[0] >= 0 and coord[0]<=1) and (coord[1]>=0 and coord[1] <=1):
-                        x_shifted = self.align_x(coord[0], idx)
-                        det['coordinates'] =  (x_shifted, coord[1])
-                        det = self.is_in_overlap(det)
-                        det['box']['x1'] += 2*width
-                        det['box']['x2'] += 2*width
-                        det['camera'] = idx
-                        cam3_space.append(det)
-
-        for c_2_det in cam2_space:
-            if c_2_det.get('is_overlap'):
-                cam_side = c_2_det.get('overlap_side')
-                if cam_side == 0:
-                    c_2_det = self.overlap_has_child(c_2_det, cam1_space)
-                elif cam_side == 2:
-                    c_2_det = self.overlap_has_child(c_2_det, cam3_space)
-
-        unified_space.extend(cam1_space)
-        unified_space.extend(cam2_space)
-        unified_space.extend(cam3_space)
-        return unified_space
-
-
+            det['marker_id'] = id(det)
+        is_child[candidates[pairs[:, 1]]] = True
+
+        # In the camera order like the input, the children are held by their parent
+        order = np.flatnonzero(~is_child)
+        return [kept[row] for row in order[np.argsort(camera[order], kind='stable')].tolist()]
+
+    def pair_overlaps(self, parents:np.ndarray, parent_sides:np.ndarray, candidates:np.ndarray, candidate_cameras:np.ndarray)->np.ndarray:
+        """
+        Gated bipartite assignment of the overlap detections (pitch coordinates (n, 2), overlap side) to the side camera
+        detections (m, 2): a pair must be on the same side and closer than CHILD_DISTANCE, and the summed distance is minimized.
+        Unlike a greedy scan the result does not depend on the order of the detections in crowded overlaps,
+        lapjv only runs when a detection is in reach of more than one other.
+        Returns the (parent, candidate) index pairs as a (k, 2) array sorted by parent.
+        """
+        if parents.shape[0] == 0 or candidates.shape[0] == 0:
+            return np.empty((0, 2), dtype=int)
+        d = parents[:, None, :] - candidates[None, :, :]
+        dist = np.sqrt(d[..., 0]**2 + d[..., 1]**2)
+        feasible = (dist <= SpaceMerger.CHILD_DISTANCE) & (parent_sides[:, None] == candidate_cameras[None, :])
+        if feasible.sum(axis=0).max() <= 1 and feasible.sum(axis=1).max() <= 1:
+            return np.argwhere(feasible)
+        # Only the detections with a pair in reach go to the assignment
+        rows, cols = np.flatnonzero(feasible.any(axis=1)), np.flatnonzero(feasible.any(axis=0))
+        cost = np.where(feasible[np.ix_(rows, cols)], dist[np.ix_(rows, cols)], 1.)
+        matches, _, _ = matching.linear_assignment(cost, thresh=SpaceMerger.CHILD_DISTANCE)
+        return np.stack((rows[matches[:, 0]], cols[matches[:, 1]]), axis=1)
+
+    def overlap_mask(self, x_coords:np.ndarray, camera:np.ndarray)->tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Overlap mask, overlap side (-1 when not in an overlap) and parent mask of aligned x coordinates,
+        see StitchingMap.overlaps.
+        """
+        return self.__stitching_map.overlaps(x_coords, camera)
+
+    def pair_children(self, batch:FrameBatch)->None:
+        """
+        Array version of the pairing in merge, the overlap detections of the wide cameras are assigned to
+        the detections of the camera they overlap with (pair_overlaps).
+        """
+        parents = np.flatnonzero((batch.flags & FrameBatch.OVERLAP_PARENT) != 0)
+        candidates = self.__stitching_map.candidates(batch.camera, (batch.flags & FrameBatch.OVERLAP_PARENT) != 0)
+        pairs = self.pair_overlaps(batch.coordinates[parents], batch.overlap_side[parents],
+                                   batch.coordinates[candidates], batch.camera[candidates])
+        if pairs.shape[0] == 0:
+            return
+        p, c = parents[pairs[:, 0]], candidates[pairs[:, 1]]
+        batch.child[p] = c
+        batch.flags[p] |= FrameBatch.HAS_CHILD
+        batch.flags[c] |= FrameBatch.IS_CHILD
+
+    @metrics.timed('space_merger_merge')
+    def merge_batch(self, batch:FrameBatch)->FrameBatch:
+        """
+        Array version of merge, returns a new batch with the detections outside the pitch removed,
+        the coordinates aligned to the unified space, the boxes stitched and the overlap children paired.
+        One pass over the batch whatever the number of cameras, the per camera values are gathered by the camera column.
+        """
+        stitching_map = self.__stitching_map
+        # The fused transform already produced unified coordinates, the bounds are moved instead
+        keep = stitching_map.in_bounds(batch.coordinates, batch.camera, batch.aligned)
+        merged = batch.select(keep)
+
+        if not merged.aligned:
+            merged.coordinates[:, 0] = stitching_map.align(merged.coordinates[:, 0], merged.camera)
+        merged.box[:, [0, 2]] += stitching_map.box_offset[merged.camera][:, None]
+        merged.aligned = True
+
+        overlap, side, parent = stitching_map.overlaps(merged.coordinates[:, 0], merged.camera)
+        merged.flags[overlap] |= FrameBatch.OVERLAP
+        merged.flags[parent] |= FrameBatch.OVERLAP_PARENT
+        merged.overlap_side[:] = side
+        self.pair_children(merged)
+        return merged
@@ -1,49 +1,89 @@
 import numpy as np
-from tracker.proximity_calculator import ProximityCalculator
-import math
-from dataloader import StateLoader, Point
+from tracker.proximity_calculator import Point, proximity_matches, make_proximity_calculator
+from tracker import matching
+from tracker.tracking_utils.debug_sink import debug_sink
+from dataloader import StateLoader
 
 
 class State:
     """
     1. A state object is an object with a collection of points
     2. It manages the objects and exposes points, while also exposing an indexing method for the points
+    3. The points live in preallocated coordinate arrays next to their detection dicts, the detections of the
+       current state missed by the next state are carried over with an index mask
     """
     MAX_STATE_VOL = 50
-    def __init__(self) -> None:
-        self.__current_state = []
-        self.__next_state = []
+    def __init__(self, linear_assignment=False, capacity:int=MAX_STATE_VOL) -> None:
+        self.__linear_assignment = linear_assignment # Match with the linear assignment (LinearProximityCalculator)
+        self.__buffers = [np.empty((capacity, 2), dtype=np.float64), np.empty((capacity, 2), dtype=np.float64)]
+        self.__distances = np.empty((capacity, capacity), dtype=np.float64) # reused by every match
+        self.__current = 0 # index of the current state buffer, the next state is in the other one
+        self.__current_size = 0
+        self.__next_size = 0
+        self.__current_data = []
+        self.__next_data = []
 
-    def update_state_data(self, data:list[dict])->list[dict]:
-        pts = StateLoader.load_points(data)
-        self.update_state(pts)
+    def update_state_data(self, data:list[dict], coordinates:np.ndarray=None)->list[dict]:
+        """
+        Moves to the detections of a new frame and returns them with the missed detections carried over.
+        coordinates: (N, 2) pitch coordinates of data, read from the dicts if not given.
+        """
+        if coordinates is None:
+            coordinates = StateLoader.load_coordinates(data)
+        self.update_state(coordinates, data)
         return self.get_next_state()
 
-    def update_state(self, state:list[Point])->None:
-        if len(self.__next_state) > 0:
-            self.__current_state = self.__next_state
-            self.__next_state = state
+    def update_state(self, coordinates:np.ndarray, data:list[dict])->None:
+        if self.__next_size > 0:
+            self.__current = 1 - self.__current
+            self.__current_size = self.__next_size
+            self.__current_data = self.__next_data
+            self.__store(1 - self.__current, coordinates, 0)
+            self.__next_size = coordinates.shape[0]
+            self.__next_data = list(data)
         else:
-            self.__next_state = state
-            self.__current_state = state
+            # no next state yet, the frame is both states
+            self.__store(self.__current, coordinates, 0)
+            self.__store(1 - self.__current, coordinates, 0)
+            self.__current_size = self.__next_size = coordinates.shape[0]
+            self.__current_data = self.__next_data = list(data)
+
+    def __store(self, buffer:int, coordinates:np.ndarray, start:int)->None:
+        end = start + coordinates.shape[0]
+        if end > self.__buffers[buffer].shape[0]:
+            grown = np.empty((max(end, 2*self.__buffers[buffer].shape[0]), 2), dtype=np.float64)
+            grown[:start] = self.__buffers[buffer][:start]
+            self.__buffers[buffer] = grown
+        self.__buffers[buffer][start:end] = coordinates
 
     def get_dicts(self)->list[dict]:
-        result = []
-        for point in self.__next_state:
-            result.append(point.data)
-        return result
+        return list(self.__next_data)
 
-    def get_next_state(self)->list[dict]:
-        for idx, point in enumerate(self.__current_state):
-            point.extras.clear()
-            point.extras = ('det', point.data)
-            point.id = idx 
+    def get_coordinates(self)->np.ndarray:
+        """
+        (N, 2) coordinates of the next state, in the order of get_dicts.
+        """
+        return self.__buffers[1 - self.__current][:self.__next_size].copy()
 
-        if len(self.__current_state) <= round(len(self.__next_state)*1.5) :
+    def get_next_state(self)->list[dict]:
+        if self.__current_size <= round(self.__next_size*1.5):
             self.__match_states()
 
         return self.get_dicts()
-    
+
+    def __distance_matrix(self, current:np.ndarray, following:np.ndarray)->np.ndarray:
+        n, m = current.shape[0], following.shape[0]
+        if n > self.__distances.shape[0] or m > self.__distances.shape[1]:
+            size = max(n, m, 2*self.__distances.shape[0])
+            self.__distances = np.empty((size, size), dtype=np.float64)
+        distances = self.__distances[:n, :m]
+        dy = np.subtract.outer(current[:, 1], following[:, 1])
+        np.subtract.outer(current[:, 0], following[:, 0], out=distances)
+        np.square(distances, out=distances)
+        np.square(dy, out=dy)
+        distances += dy
+        np.sqrt(distances, out=distances)
+        return distances
 
     def __match_states(self)->None:
         """
@@ -51,16 +91,92 @@ class State:
         2. Find the holes in state one from all the points that didn't match state 0
         3. Update State 1 with the left over points from State 0
         """
-        prox_calc = ProximityCalculator(self.__current_state, self.__next_state, True)
+        if self.__next_data is self.__current_data:
+            # first frame, the state is matched with itself, nothing can be missed
+            return
+        current = self.__buffers[self.__current][:self.__current_size]
+        following = self.__buffers[1 - self.__current][:self.__next_size]
+        distances = self.__distance_matrix(current, following)
+
+        # X list --> O list
+        if self.__linear_assignment:
+            matches, _, _ = matching.linear_assignment(distances, thresh=Point.MINIMUM_PROXIMITY_DISTANCE)
+            matched = np.asarray(matches, dtype=np.intp).reshape(-1, 2)[:, 0]
+        else:
+            matched = np.array([ix for ix, _ in proximity_matches(distances, True)], dtype=np.intp)
+
+        missed = np.ones(self.__current_size, dtype=bool)
+        missed[matched] = False
+        missed_rows = np.flatnonzero(missed)
+        if debug_sink.enabled():
+            debug_sink.record('state_missed', {'distances': distances, 'missed': missed_rows})
+        if missed_rows.shape[0] == 0:
+            return
+
+        # print(f"Missed Detections: {missed_rows.shape[0]}")
+        self.__store(1 - self.__current, current[missed_rows], self.__next_size)
+        self.__next_size += missed_rows.shape[0]
+        self.__next_data.extend(self.__current_data[idx] for idx in missed_rows.tolist())
+
+
+def __object_step(current:list, following:list, linear:bool)->list:
+    """
+    One frame of the former object based State (dataloader Points and make_proximity_calculator), returns the next state.
+    """
+    for idx, point in enumerate(current):
+        point.extras.clear()
+        point.extras = ('det', point.data)
+        point.id = idx
+    if len(current) <= round(len(following)*1.5):
+        prox_calc = make_proximity_calculator(current, following, True, linear)
         prox_calc.compute()
-        # X list -- > O list
-        self.__current_state, self.__next_state = prox_calc.get_associated_points()
-        missed_dets = []
-        for point in self.__current_state:
-            if 'found_det' not in point.extras:
-                p = point.copy()
-                missed_dets.append(p)
-        
-        # print(f"Missed Detections: {len(missed_dets)}")
-        self.__next_state.extend(missed_dets)            
+        current, following = prox_calc.get_associated_points()
+        following.extend(point.copy() for point in current if 'found_det' not in point.extras)
+    return following
+
+
+def __state_frames(rng:np.random.Generator, spread:float, frames:int)->list[list[dict]]:
+    """
+    22 players in a (spread x spread) corner of the pitch walking randomly, each frame drops a random share of them
+    (sometimes all), in shuffled order.
+    """
+    pos = rng.random((22, 2))*spread
+    result = []
+    for _ in range(frames):
+        pos = np.clip(pos + rng.normal(0, 0.01*spread, pos.shape), 0, spread)
+        keep = rng.random(22) < rng.choice([0.5, 0.9, 1.0])
+        if rng.random() < 0.03:
+            keep[:] = False
+        dets = [{'coordinates': (float(x), float(y)), 'id': idx} for idx, (x, y) in enumerate(pos[keep])]
+        rng.shuffle(dets)
+        result.append(dets)
+    return result
+
+
+def state_check(runs=3, frames=600, seed=0)->int:
+    """
+    Checks the array based State against the former object based one (see __object_step) on random sequences,
+    separated (whole pitch) and crowded (players within a few proximity distances), with both engines:
+    every frame must return the same detection dicts in the same order.
+    """
+    rng = np.random.default_rng(seed)
+    checked = 0
+    for spread in (1.0, 4*Point.MINIMUM_PROXIMITY_DISTANCE):
+        for _ in range(runs):
+            sequence = __state_frames(rng, spread, frames)
+            for linear in (False, True):
+                state, following = State(linear), []
+                for idx, dets in enumerate(sequence):
+                    points = StateLoader.load_points(dets)
+                    following = __object_step(following if following else points, points, linear)
+                    expected = [point.data for point in following]
+                    result = state.update_state_data(dets)
+                    assert [id(d) for d in result] == [id(d) for d in expected], \
+                        f"State differs from the object based State at frame {idx} (spread {spread}, linear {linear})"
+                    checked += 1
+    print(f"State parity: {checked} frames match the object based State")
+    return checked
+
 
+if __name__ == "__main__":
+    state_check()
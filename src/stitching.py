@@ -0,0 +1,149 @@
+"""
+Calibration driven stitching of the camera rig into the unified pitch space, for any number of cameras.
+
+The cameras are laid side by side along the pitch x axis, camera c covers the band
+    [shift[c], shift[c] + pitch_widths[c]]
+of the unified x. A camera with a 'mini_boundary' in its calibration (the centre camera of the 3 camera rig)
+sees past its band into its neighbours: its band grows by the margins measured between its transformed boundary
+and mini boundary, and the detections in those margins are the overlaps, paired with the neighbour's detections
+(the children).
+
+calib_data/stitching.json (optional, the defaults split the pitch evenly):
+    {'frame_width': 2590, 'frame_height': 1942, 'pitch_widths': [...], 'edge_offsets': [...], 'overlap_margin': 0.01}
+
+The map is built once by DataLoader.load_config_data, SpaceTransformer and SpaceMerger then work with
+per camera arrays indexed by the camera column of the batch, without a branch per camera.
+"""
+import numpy as np
+from coordinate_transforms import Transformer
+
+
+class StitchingMap:
+    FRAME_WIDTH = 2590
+    FRAME_HEIGHT = 1942
+    OVERLAP_MARGIN = 0.01
+
+    def __init__(self, cams_config:list[dict], frame_width:int=FRAME_WIDTH, frame_height:int=FRAME_HEIGHT,
+                 pitch_widths:list[float]=None, edge_offsets:list[float]=None, overlap_margin:float=OVERLAP_MARGIN)->None:
+        """
+        1. One Transformer (homography and normalization) per camera, in the order of cams_config.
+        2. The x alignment (scale, shift) of every camera, the wide cameras take their margins over the neighbours.
+        3. The overlap bands in the unified space, with the camera holding the parents and the one holding the children.
+        """
+        self.num_cams = len(cams_config)
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.overlap_margin = overlap_margin
+        self.transformers = [Transformer(frame_width, frame_height, config, idx) for idx, config in enumerate(cams_config)]
+
+        widths = list(pitch_widths) if pitch_widths is not None else [1/self.num_cams]*self.num_cams
+        offsets = list(edge_offsets) if edge_offsets is not None else [0]*self.num_cams
+        if len(widths) != self.num_cams or len(offsets) != self.num_cams:
+            raise ValueError(f"Error: The stitching config has {len(widths)} pitch widths and {len(offsets)} edge offsets for {self.num_cams} cameras")
+        self.pitch_widths = widths
+
+        starts = [0.0]*self.num_cams
+        for idx in range(1, self.num_cams):
+            starts[idx] = starts[idx - 1] + widths[idx - 1]
+        self.pitch_starts = starts
+
+        scale, shift = list(widths), list(starts)
+        bands = [] # (start, end, parent camera, child camera)
+        for idx, config in enumerate(cams_config):
+            if config.get('mini_boundary') is None:
+                continue
+            main_boundary = self.transformers[idx].getDstPts()
+            mini_boundary = self.transformers[idx].get_mini_boudary()
+            left = (mini_boundary[0]['coordinates'][0] - main_boundary[0]['coordinates'][0])*widths[idx - 1] if idx > 0 else 0
+            right = (main_boundary[1]['coordinates'][0] - mini_boundary[1]['coordinates'][0])*widths[idx + 1] \
+                if idx + 1 < self.num_cams else 0
+            scale[idx] = widths[idx] + left + right
+            shift[idx] = starts[idx] - left
+            if idx > 0:
+                bands.append((starts[idx] - left - overlap_margin, starts[idx] + overlap_margin, idx, idx - 1))
+            if idx + 1 < self.num_cams:
+                end = starts[idx] + widths[idx]
+                bands.append((end - overlap_margin, end + right + overlap_margin, idx, idx + 1))
+
+        self.scale = np.array(scale, dtype=np.float64)
+        self.shift = np.array(shift, dtype=np.float64)
+        self.x_limit = 1 - np.array(offsets, dtype=np.float64) # upper bound of the normalized x before the alignment
+        self.box_offset = np.arange(self.num_cams, dtype=np.int64)*frame_width # x offset of the camera in the stitched frame
+        bands = np.array(bands, dtype=np.float64).reshape(-1, 4)
+        self.band_start, self.band_end = bands[:, 0], bands[:, 1]
+        self.band_parent, self.band_child = bands[:, 2].astype(np.int16), bands[:, 3].astype(np.int16)
+        self.parent_cameras = np.unique(self.band_parent)
+        self.child_cameras = np.unique(self.band_child)
+
+    @staticmethod
+    def from_config(config_data:dict)->'StitchingMap':
+        """
+        Builds the map from the DataLoader config, the cameras in 'cams_config' and the optional 'stitching' entry.
+        """
+        stitching = config_data.get('stitching', {})
+        return StitchingMap(config_data['cams_config'],
+                            stitching.get('frame_width', StitchingMap.FRAME_WIDTH),
+                            stitching.get('frame_height', StitchingMap.FRAME_HEIGHT),
+                            stitching.get('pitch_widths'),
+                            stitching.get('edge_offsets'),
+                            stitching.get('overlap_margin', StitchingMap.OVERLAP_MARGIN))
+
+    def alignment(self, camera:int)->tuple[float, float]:
+        """
+        (scale, shift) taking the normalized x of the camera to the unified x, (1, 0) for an unknown camera.
+        """
+        if 0 <= camera < self.num_cams:
+            return self.scale[camera].item(), self.shift[camera].item()
+        return 1.0, 0.0
+
+    def homographies(self)->tuple[np.ndarray, np.ndarray]:
+        """
+        (N, 3, 3) matrices taking the image points of every camera straight to unified pitch coordinates
+        (perspective, normalization and alignment), and the (N, 3, 3) perspective matrices alone.
+        """
+        fused, perspective = [], []
+        for idx, transformer in enumerate(self.transformers):
+            align = np.array([[self.scale[idx], 0, self.shift[idx]],
+                              [0, 1, 0],
+                              [0, 0, 1]], dtype=np.float64)
+            pers_matrix = transformer.get_perspective_matrix()
+            fused.append(align @ transformer.get_normalization_matrix() @ pers_matrix)
+            perspective.append(pers_matrix)
+        return np.stack(fused).reshape(-1, 3, 3), np.stack(perspective).reshape(-1, 3, 3)
+
+    def in_bounds(self, coordinates:np.ndarray, camera:np.ndarray, aligned:bool)->np.ndarray:
+        """
+        Mask of the detections inside the pitch seen by their camera, on normalized or already aligned coordinates.
+        """
+        valid = camera < self.num_cams
+        cam = np.where(valid, camera, 0)
+        x, y = coordinates[:, 0], coordinates[:, 1]
+        x_min, x_max = np.zeros(x.shape[0]), self.x_limit[cam]
+        if aligned:
+            x_min, x_max = self.shift[cam], x_max*self.scale[cam] + self.shift[cam]
+        return valid & (x >= x_min) & (x <= x_max) & (y >= 0) & (y <= 1)
+
+    def align(self, x:np.ndarray, camera:np.ndarray)->np.ndarray:
+        return x*self.scale[camera] + self.shift[camera]
+
+    def overlaps(self, x:np.ndarray, camera:np.ndarray)->tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Classifies aligned x coordinates against all the overlap bands at once (the first band wins),
+        returns the overlap mask, the overlap side (camera of the children, -1 outside the overlaps)
+        and the mask of the parents (overlap detections of the camera holding the band).
+        """
+        inside = (x[:, None] >= self.band_start[None, :]) & (x[:, None] <= self.band_end[None, :])
+        overlap = inside.any(axis=1)
+        band = np.argmax(inside, axis=1) if inside.shape[1] > 0 else np.zeros(x.shape[0], dtype=np.intp)
+        side = np.full(x.shape[0], -1, dtype=np.int8)
+        parent = np.zeros(x.shape[0], dtype=bool)
+        if inside.shape[1] > 0:
+            side[overlap] = self.band_child[band[overlap]]
+            parent[overlap] = camera[overlap] == self.band_parent[band[overlap]]
+        return overlap, side, parent
+
+    def candidates(self, camera:np.ndarray, parent:np.ndarray)->np.ndarray:
+        """
+        Rows that can be the child of an overlap detection, the detections of the neighbour cameras.
+        """
+        return np.flatnonzero(np.isin(camera, self.child_cameras) & ~parent)
@@ -5,18 +5,36 @@ from collections import deque
 from tracker import matching
 from tracker.gmc import GMC
 from tracker.basetrack import BaseTrack, TrackState
-from tracker.kalman_filter import KalmanFilter
+from tracker.kalman_filter import KalmanFilter, PitchKalmanFilter
+from tracker.track_table import TrackTable, TableField
+from tracker.retention import TombstoneLog
+from tracker.tracking_utils.metrics import metrics
+from tracker.tracking_utils.profiler import profiler
 # from fast_reid.fast_reid_interfece import FastReIDInterface
 import time
 
 class STrack(BaseTrack):
     shared_kalman = KalmanFilter()
 
+    # Stored in the BoTSORT TrackTable once the track is activated
+    track_id = TableField()
+    state = TableField()
+    is_activated = TableField()
+    score = TableField()
+    tracklet_len = TableField()
+    frame_id = TableField()
+    start_frame = TableField()
+    mean = TableField()
+    covariance = TableField()
+    coordinates = TableField()
+    det_index = TableField() # row of output_results the track was updated with in the last frame, -1 if none
+
     def __init__(self, tlwh, score, feat=None, feat_history=50, **kwargs):
         self.coordinates = None
         if 'coordinates' in kwargs:
             self.coordinates = kwargs['coordinates']
             # print(self.coordinates)
+        self.det_index = kwargs.get('det_index', -1)
         # wait activate
         self._tlwh = np.asarray(tlwh, dtype=np.float64)
         self.kalman_filter = None
@@ -46,21 +64,96 @@ class STrack(BaseTrack):
     def predict(self):
         mean_state = self.mean.copy()
         if self.state != TrackState.Tracked:
-            mean_state[6] = 0
-            mean_state[7] = 0
+            mean_state[self.kalman_filter.lost_velocity_dims] = 0
 
         self.mean, self.covariance = self.kalman_filter.predict(mean_state, self.covariance)
 
+    @staticmethod
+    def table_rows(stracks):
+        """
+        Returns (table, rows) if all the tracks are rows of the same TrackTable, else (None, None).
+        """
+        table = stracks[0].__dict__.get('_table') if len(stracks) > 0 else None
+        if table is None or any(st.__dict__.get('_table') is not table for st in stracks):
+            return None, None
+        return table, np.array([st._row for st in stracks], dtype=np.intp)
+
+    @staticmethod
+    def filter_of(stracks):
+        """
+        The Kalman filter the tracks were activated with (box or pitch space), the shared box filter if there is none.
+        """
+        kalman_filter = stracks[0].kalman_filter if len(stracks) > 0 else None
+        return kalman_filter if kalman_filter is not None else STrack.shared_kalman
+
+    @staticmethod
+    def multi_state(stracks):
+        """
+        Stacked (means, covariances) of the tracks.
+        """
+        table, rows = STrack.table_rows(stracks)
+        if table is not None:
+            return table.column('mean')[rows], table.column('covariance')[rows]
+        return np.asarray([st.mean for st in stracks]), np.asarray([st.covariance for st in stracks])
+
+    def to_measurement(self, kalman_filter):
+        """
+        The measurement of this detection for the filter, (x, y, w, h) for the box filter or the pitch coordinates.
+        """
+        if kalman_filter.box_state:
+            return self.tlwh_to_xywh(self.tlwh)
+        return np.asarray(self.coordinates, dtype=np.float64)
+
+    @staticmethod
+    def multi_measurement(stracks, kalman_filter):
+        if kalman_filter.box_state:
+            measurements = np.asarray([st.tlwh for st in stracks])
+            measurements[:, :2] += measurements[:, 2:] / 2
+            return measurements
+        return np.asarray([st.coordinates for st in stracks], dtype=np.float64).reshape(-1, 2)
+
+    @staticmethod
+    def multi_tlbr(stracks):
+        """
+        (N, 4) tlbr array of the tracks, straight from the mean column when they are in the track table.
+        """
+        table, rows = STrack.table_rows(stracks)
+        if table is not None and STrack.filter_of(stracks).box_state:
+            ret = table.column('mean')[rows, :4]
+            ret[:, :2] -= ret[:, 2:] / 2
+            ret[:, 2:] += ret[:, :2]
+            return ret
+        return np.array([st.tlbr for st in stracks], dtype=np.float64).reshape(-1, 4)
+
+    @staticmethod
+    def multi_ids(stracks)->tuple[np.ndarray, np.ndarray]:
+        """
+        (det_index, track_id) arrays of the tracks, the join between the BoTSORT output and its input rows.
+        """
+        table, rows = STrack.table_rows(stracks)
+        if table is not None:
+            return table.column('det_index')[rows], table.column('track_id')[rows]
+        return (np.array([st.det_index for st in stracks], dtype=np.int64),
+                np.array([st.track_id for st in stracks], dtype=np.int64))
+
     @staticmethod
     def multi_predict(stracks):
-        if len(stracks) > 0:
+        table, rows = STrack.table_rows(stracks)
+        kalman_filter = STrack.filter_of(stracks)
+        if table is not None:
+            multi_mean = table.column('mean')[rows]
+            not_tracked = np.flatnonzero(table.column('state')[rows] != TrackState.Tracked)
+            multi_mean[np.ix_(not_tracked, kalman_filter.lost_velocity_dims)] = 0
+            multi_mean, multi_covariance = kalman_filter.multi_predict(multi_mean, table.column('covariance')[rows])
+            table.column('mean')[rows] = multi_mean
+            table.column('covariance')[rows] = multi_covariance
+        elif len(stracks) > 0:
             multi_mean = np.asarray([st.mean.copy() for st in stracks])
             multi_covariance = np.asarray([st.covariance for st in stracks])
             for i, st in enumerate(stracks):
                 if st.state != TrackState.Tracked:
-                    multi_mean[i][6] = 0
-                    multi_mean[i][7] = 0
-            multi_mean, multi_covariance = STrack.shared_kalman.multi_predict(multi_mean, multi_covariance)
+                    multi_mean[i][kalman_filter.lost_velocity_dims] = 0
+            multi_mean, multi_covariance = kalman_filter.multi_predict(multi_mean, multi_covariance)
             for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
                 stracks[i].mean = mean
                 stracks[i].covariance = cov
@@ -75,20 +168,44 @@ class STrack(BaseTrack):
             R8x8 = np.kron(np.eye(4, dtype=float), R)
             t = H[:2, 2]
 
-            for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
-                mean = R8x8.dot(mean)
-                mean[:2] += t
-                cov = R8x8.dot(cov).dot(R8x8.transpose())
+            multi_mean = multi_mean @ R8x8.T
+            multi_mean[:, :2] += t
+            multi_covariance = R8x8 @ multi_covariance @ R8x8.T
 
+            for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
                 stracks[i].mean = mean
                 stracks[i].covariance = cov
 
+    @staticmethod
+    def multi_update(stracks, new_tracks, frame_id):
+        """
+        Batched update of matched tracks, stracks[i] is matched with new_tracks[i].
+        Tracked tracks are updated and the others are re-activated, like update() and re_activate().
+        """
+        if len(stracks) > 0:
+            table, rows = STrack.table_rows(stracks)
+            kalman_filter = STrack.filter_of(stracks)
+            multi_mean, multi_covariance = STrack.multi_state(stracks)
+            measurements = STrack.multi_measurement(new_tracks, kalman_filter)
+            multi_mean, multi_covariance = kalman_filter.multi_update(multi_mean, multi_covariance, measurements)
+            if table is not None:
+                table.column('mean')[rows] = multi_mean
+                table.column('covariance')[rows] = multi_covariance
+            for i, track in enumerate(stracks):
+                if table is None:
+                    track.mean = multi_mean[i]
+                    track.covariance = multi_covariance[i]
+                if track.state == TrackState.Tracked:
+                    track._update_state(new_tracks[i], frame_id)
+                else:
+                    track._re_activate_state(new_tracks[i], frame_id)
+
     def activate(self, kalman_filter, frame_id):
         """Start a new tracklet"""
         self.kalman_filter = kalman_filter
         self.track_id = self.next_id()
 
-        self.mean, self.covariance = self.kalman_filter.initiate(self.tlwh_to_xywh(self._tlwh))
+        self.mean, self.covariance = self.kalman_filter.initiate(self.to_measurement(self.kalman_filter))
 
         self.tracklet_len = 0
         self.state = TrackState.Tracked
@@ -99,7 +216,10 @@ class STrack(BaseTrack):
 
     def re_activate(self, new_track, frame_id, new_id=False):
 
-        self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, self.tlwh_to_xywh(new_track.tlwh))
+        self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, new_track.to_measurement(self.kalman_filter))
+        self._re_activate_state(new_track, frame_id, new_id)
+
+    def _re_activate_state(self, new_track, frame_id, new_id=False):
         if new_track.curr_feat is not None:
             self.update_features(new_track.curr_feat)
         self.tracklet_len = 0
@@ -107,6 +227,9 @@ class STrack(BaseTrack):
         self.is_activated = True
         self.frame_id = frame_id
         self.coordinates = new_track.coordinates
+        self.det_index = new_track.det_index
+        if not self.kalman_filter.box_state:
+            self._tlwh = new_track.tlwh
         if new_id:
             self.track_id = self.next_id()
         self.score = new_track.score
@@ -119,13 +242,16 @@ class STrack(BaseTrack):
         :type update_feature: bool
         :return:
         """
+        self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, new_track.to_measurement(self.kalman_filter))
+        self._update_state(new_track, frame_id)
+
+    def _update_state(self, new_track, frame_id):
         self.frame_id = frame_id
         self.tracklet_len += 1
-
-        new_tlwh = new_track.tlwh
         self.coordinates = new_track.coordinates
-
-        self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, self.tlwh_to_xywh(new_tlwh))
+        self.det_index = new_track.det_index
+        if not self.kalman_filter.box_state:
+            self._tlwh = new_track.tlwh
 
         if new_track.curr_feat is not None:
             self.update_features(new_track.curr_feat)
@@ -140,7 +266,8 @@ class STrack(BaseTrack):
         """Get current position in bounding box format `(top left x, top left y,
                 width, height)`.
         """
-        if self.mean is None:
+        if self.mean is None or not self.kalman_filter.box_state:
+            # The pitch filter has no box, the box of the last detection is used
             return self._tlwh.copy()
         ret = self.mean[:4].copy()
         ret[:2] -= ret[2:] / 2
@@ -205,9 +332,12 @@ class STrack(BaseTrack):
 class BoTSORT(object):
     def __init__(self, args, frame_rate=30):
 
-        self.tracked_stracks = []  # type: list[STrack]
-        self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
+        # 'image': IoU of the stitched boxes with a box Kalman filter, 'pitch': distance in the pitch space with a 2-D filter
+        self.association_space = args.association_space
+        self.kalman_filter = PitchKalmanFilter() if self.association_space == 'pitch' else KalmanFilter()
+        self.tombstones = TombstoneLog(args.removed_history_size)
+        self.tracks = TrackTable(compact_interval=args.track_table_compact_interval, tombstones=self.tombstones,
+                                 state_dim=self.kalman_filter.state_dim)
         BaseTrack.clear_count()
 
         self.frame_id = 0
@@ -219,17 +349,54 @@ class BoTSORT(object):
 
         self.buffer_size = int(frame_rate / 10.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
-        self.kalman_filter = KalmanFilter()
 
         # ReID module
         self.proximity_thresh = args.proximity_thresh
         self.appearance_thresh = args.appearance_thresh
+        self.pitch_gate = args.pitch_gate_distance
+        self.pitch_metric = args.pitch_gate_metric
+        # Cost limits of the low score and unconfirmed passes, the image ones are tuned for the IoU distance
+        if self.association_space == 'pitch':
+            self.second_thresh, self.unconfirmed_thresh = args.pitch_second_thresh, args.pitch_unconfirmed_thresh
+        else:
+            self.second_thresh, self.unconfirmed_thresh = 0.5, 0.7
 
         # if args.with_reid:
         #     self.encoder = FastReIDInterface(args.fast_reid_config, args.fast_reid_weights, args.device)
 
         self.gmc = GMC(method=args.cmc_method, verbose=[args.name, args.ablation])
 
+    @property
+    def tracked_stracks(self):
+        return self.tracks.tracks(self.tracks.tracked)  # type: list[STrack]
+
+    @property
+    def lost_stracks(self):
+        return self.tracks.tracks(self.tracks.lost)  # type: list[STrack]
+
+    @property
+    def removed_stracks(self):
+        # Only the removed tracks that were not compacted yet
+        return self.tracks.tracks(self.tracks.removed)  # type: list[STrack]
+
+    def association_distance(self, tracks, detections):
+        """
+        Cost matrix of an association step in [0, 1], IoU distance of the boxes or pitch distance of the states.
+        """
+        if self.association_space == 'pitch':
+            return matching.pitch_distance(self.kalman_filter, tracks, detections, self.pitch_gate, self.pitch_metric)
+        return matching.iou_distance(tracks, detections)
+
+    def is_removed(self, track_id:int)->bool:
+        if track_id in self.tombstones:
+            return True
+        return any(track.track_id == track_id for track in self.removed_stracks)
+
+    def pool_sizes(self)->dict:
+        return self.tracks.sizes()
+
+    @metrics.timed('botsort_update')
+    @profiler.profiled('botsort_update')
     def update(self, output_results, img=None):
         s_time = time.time()
         self.frame_id += 1
@@ -237,6 +404,8 @@ class BoTSORT(object):
         refind_stracks = []
         lost_stracks = []
         removed_stracks = []
+        # Only the tracks updated in this frame point to a detection
+        self.tracks.column('det_index')[:] = -1
 
         if len(output_results):
             if output_results.shape[1] >= 12:
@@ -258,6 +427,7 @@ class BoTSORT(object):
 
             # Find high threshold detections
             remain_inds = (scores >= self.args.track_high_thresh) #or scores <  self.args.track_high_thresh)
+            indices_keep = np.flatnonzero(remain_inds)
             dets = bboxes[remain_inds]
             scores_keep = scores[remain_inds]
             classes_keep = classes[remain_inds]
@@ -278,11 +448,11 @@ class BoTSORT(object):
         if len(dets) > 0:
             # Detections
             if self.args.with_reid:
-                detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s, f, coordinates=cc) for
-                              (tlbr, s, f, cc) in zip(dets, scores_keep, features_keep,  coordinates_keep)]
+                detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s, f, coordinates=cc, det_index=i) for
+                              (tlbr, s, f, cc, i) in zip(dets, scores_keep, features_keep,  coordinates_keep, indices_keep.tolist())]
             else:
-                detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s, coordinates=cc) for
-                              (tlbr, s, cc) in zip(dets, scores_keep, coordinates_keep)]
+                detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s, coordinates=cc, det_index=i) for
+                              (tlbr, s, cc, i) in zip(dets, scores_keep, coordinates_keep, indices_keep.tolist())]
         else:
             detections = []
         
@@ -296,7 +466,8 @@ class BoTSORT(object):
                 tracked_stracks.append(track)
 
         # Step 2: First association, with high score detection boxes
-        strack_pool = joint_stracks(tracked_stracks, self.lost_stracks)
+        lost_pool = self.lost_stracks
+        strack_pool = joint_stracks(tracked_stracks, lost_pool)
 
         # Predict the current location with KF
         STrack.multi_predict(strack_pool)
@@ -307,7 +478,7 @@ class BoTSORT(object):
         # STrack.multi_gmc(unconfirmed, warp)
 
         # Associate with high score detection boxes
-        ious_dists = matching.iou_distance(strack_pool, detections)
+        ious_dists = self.association_distance(strack_pool, detections)
         ious_dists_mask = (ious_dists > self.proximity_thresh)
         # print(ious_dists, self.proximity_thresh)
       
@@ -334,22 +505,15 @@ class BoTSORT(object):
 
         matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.args.match_thresh)
         # print(f"Unmatched Tracks:{len(u_detection)}\nDetections Length: {len(detections)}\nMatched Tracks Length: {len(matches)}\nTracking Vector State: {len(self.tracked_stracks)}")
-        for itracked, idet in matches:
-            track = strack_pool[itracked]
-            det = detections[idet]
-            # print(f"Index: {idet} \t Track-id: {track.track_id}")
-            if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+        self.__update_matches([strack_pool[i] for i, _ in matches], [detections[i] for _, i in matches],
+                              activated_starcks, refind_stracks)
 
         ''' Step 3: Second association, with low score detection boxes'''
         if len(scores):
             inds_high = scores < self.args.track_high_thresh
             inds_low = scores > self.args.track_low_thresh
             inds_second = np.logical_and(inds_low, inds_high)
+            indices_second = np.flatnonzero(inds_second)
             dets_second = bboxes[inds_second]
             scores_second = scores[inds_second]
             classes_second = classes[inds_second]
@@ -362,24 +526,17 @@ class BoTSORT(object):
         # association the untrack to the low score detections
         if len(dets_second) > 0:
             '''Detections'''
-            detections_second = [STrack(STrack.tlbr_to_tlwh(tlbr), s, coordinates=cc) for
-                                 (tlbr, s, cc) in zip(dets_second, scores_second, coordinates_second)]
+            detections_second = [STrack(STrack.tlbr_to_tlwh(tlbr), s, coordinates=cc, det_index=i) for
+                                 (tlbr, s, cc, i) in zip(dets_second, scores_second, coordinates_second, indices_second.tolist())]
         else:
             detections_second = []
 
         r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
-        dists = matching.iou_distance(r_tracked_stracks, detections_second)
+        dists = self.association_distance(r_tracked_stracks, detections_second)
 
-        matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=0.5)
-        for itracked, idet in matches:
-            track = r_tracked_stracks[itracked]
-            det = detections_second[idet]
-            if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+        matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=self.second_thresh)
+        self.__update_matches([r_tracked_stracks[i] for i, _ in matches], [detections_second[i] for _, i in matches],
+                              activated_starcks, refind_stracks)
 
         for it in u_track:
             track = r_tracked_stracks[it]
@@ -389,7 +546,7 @@ class BoTSORT(object):
 
         '''Deal with unconfirmed tracks, usually tracks with only one beginning frame'''
         detections = [detections[i] for i in u_detection]
-        ious_dists = matching.iou_distance(unconfirmed, detections)
+        ious_dists = self.association_distance(unconfirmed, detections)
         ious_dists_mask = (ious_dists > self.proximity_thresh)
         if not self.args.mot20:
             ious_dists = matching.fuse_score(ious_dists, detections)
@@ -403,10 +560,9 @@ class BoTSORT(object):
         else:
             dists = ious_dists
 
-        matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
-        for itracked, idet in matches:
-            unconfirmed[itracked].update(detections[idet], self.frame_id)
-            activated_starcks.append(unconfirmed[itracked])
+        matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=self.unconfirmed_thresh)
+        self.__update_matches([unconfirmed[i] for i, _ in matches], [detections[i] for _, i in matches],
+                              activated_starcks, refind_stracks)
         for it in u_unconfirmed:
             track = unconfirmed[it]
             track.mark_removed()
@@ -422,26 +578,54 @@ class BoTSORT(object):
             activated_starcks.append(track)
 
         # """ Step 5: Update state"""
-        for track in self.lost_stracks:
-            if self.frame_id - track.end_frame > self.max_time_lost:
-                track.mark_removed()
-                removed_stracks.append(track)
+        table = self.tracks
+        lost_rows = np.array([track._row for track in lost_pool], dtype=np.intp)
+        expired = lost_rows[self.frame_id - table.column('frame_id')[lost_rows] > self.max_time_lost]
+        table.column('state')[expired] = TrackState.Removed
+        removed_stracks.extend(table.track(row) for row in expired.tolist())
 
         """ Merge """
-        self.tracked_stracks = [t for t in self.tracked_stracks if t.state == TrackState.Tracked]
-        # if len(self.tracked_stracks) < len(detections):
-        self.tracked_stracks = joint_stracks(self.tracked_stracks, activated_starcks)
-        self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
-        self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
-        self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
+        # The lists are masks over the track table, a track entering a list goes to the end of its order
+        for track in activated_starcks:
+            if track.__dict__.get('_table') is None:
+                table.add(track)
+        table.tracked &= table.column('state') == TrackState.Tracked
+        joined = [track._row for track in activated_starcks + refind_stracks if not table.tracked[track._row]]
+        table.enter(table.tracked, list(dict.fromkeys(joined)))
+        table.lost &= ~table.tracked
+        table.enter(table.lost, [track._row for track in lost_stracks])
+        # removed_stracks of the previous frames, the ones removed in this frame are taken out of lost next frame
+        table.lost &= ~table.removed
+        table.removed[[track._row for track in removed_stracks]] = True
+        if self.association_space == 'pitch':
+            tracked_stracks, lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks,
+                                                                     matching.pitch_position_distance, self.args.pitch_duplicate_distance)
+        else:
+            tracked_stracks, lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
+        keep = np.zeros_like(table.tracked)
+        keep[[track._row for track in tracked_stracks + lost_stracks]] = True
+        table.tracked &= keep
+        table.lost &= keep
+        table.step(self.frame_id)
 
         # output_stracks = [track for track in self.tracked_stracks if track.is_activated]
-        output_stracks = [track for track in self.tracked_stracks]
+        # STrack.multi_ids(output_stracks) gives the output_results row of every track
+        output_stracks = tracked_stracks
+        metrics.set('active_tracklets', len(output_stracks))
+        metrics.set('lost_tracklets', len(lost_stracks))
         return output_stracks
 
+    def __update_matches(self, tracks, dets, activated_starcks, refind_stracks):
+        """
+        One batched Kalman update for all the matches of an association step.
+        """
+        for track in tracks:
+            if track.state == TrackState.Tracked:
+                activated_starcks.append(track)
+            else:
+                refind_stracks.append(track)
+        STrack.multi_update(tracks, dets, self.frame_id)
+
 
 def joint_stracks(tlista, tlistb):
     exists = {}
@@ -468,9 +652,9 @@ def sub_stracks(tlista, tlistb):
     return list(stracks.values())
 
 
-def remove_duplicate_stracks(stracksa, stracksb):
-    pdist = matching.iou_distance(stracksa, stracksb)
-    pairs = np.where(pdist < 0.15)
+def remove_duplicate_stracks(stracksa, stracksb, distance=matching.iou_distance, thresh=0.15):
+    pdist = distance(stracksa, stracksb)
+    pairs = np.where(pdist < thresh)
     dupa, dupb = list(), list()
     for p, q in zip(*pairs):
         timep = stracksa[p].frame_id - stracksa[p].start_frame
@@ -0,0 +1,110 @@
+"""
+IoU kernels for the BoTSORT association.
+
+1. bbox_ious       : broadcast NumPy kernel, a drop in for cython_bbox.bbox_overlaps (same +1 pixel box convention).
+2. bbox_ious_numba : the same kernel compiled with numba, only if numba is installed (compiled on its first call).
+All of them take (N, 4) / (M, 4) tlbr arrays, see STrack.multi_tlbr to stack them from the track store.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def bbox_ious(atlbrs:np.ndarray, btlbrs:np.ndarray)->np.ndarray:
+    atlbrs = np.asarray(atlbrs, dtype=np.float64).reshape(-1, 4)
+    btlbrs = np.asarray(btlbrs, dtype=np.float64).reshape(-1, 4)
+    if atlbrs.shape[0] == 0 or btlbrs.shape[0] == 0:
+        return np.zeros((atlbrs.shape[0], btlbrs.shape[0]), dtype=np.float64)
+
+    # Coordinate rows are contiguous, the outer products and the in place ops avoid most of the temporaries
+    a = np.ascontiguousarray(atlbrs.T)
+    b = np.ascontiguousarray(btlbrs.T)
+    a_area = (a[2] - a[0] + 1) * (a[3] - a[1] + 1)
+    b_area = (b[2] - b[0] + 1) * (b[3] - b[1] + 1)
+
+    iw = np.minimum.outer(a[2], b[2])
+    iw -= np.maximum.outer(a[0], b[0])
+    iw += 1
+    np.maximum(iw, 0, out=iw)
+    ih = np.minimum.outer(a[3], b[3])
+    ih -= np.maximum.outer(a[1], b[1])
+    ih += 1
+    np.maximum(ih, 0, out=ih)
+
+    inter = iw
+    inter *= ih
+    union = np.add.outer(a_area, b_area)
+    union -= inter
+    inter /= union
+    return inter
+
+
+if numba is not None:
+    # Compiled lazily on the first call, the import stays cheap and processes that never call it pay nothing
+    @numba.njit
+    def __bbox_ious_numba(atlbrs, btlbrs):
+        n, m = atlbrs.shape[0], btlbrs.shape[0]
+        ious = np.zeros((n, m), dtype=np.float64)
+        for j in range(m):
+            b_area = (btlbrs[j, 2] - btlbrs[j, 0] + 1) * (btlbrs[j, 3] - btlbrs[j, 1] + 1)
+            for i in range(n):
+                iw = min(atlbrs[i, 2], btlbrs[j, 2]) - max(atlbrs[i, 0], btlbrs[j, 0]) + 1
+                if iw <= 0:
+                    continue
+                ih = min(atlbrs[i, 3], btlbrs[j, 3]) - max(atlbrs[i, 1], btlbrs[j, 1]) + 1
+                if ih <= 0:
+                    continue
+                a_area = (atlbrs[i, 2] - atlbrs[i, 0] + 1) * (atlbrs[i, 3] - atlbrs[i, 1] + 1)
+                inter = iw * ih
+                ious[i, j] = inter / (a_area + b_area - inter)
+        return ious
+
+    def bbox_ious_numba(atlbrs:np.ndarray, btlbrs:np.ndarray)->np.ndarray:
+        return __bbox_ious_numba(np.ascontiguousarray(atlbrs, dtype=np.float64).reshape(-1, 4),
+                                 np.ascontiguousarray(btlbrs, dtype=np.float64).reshape(-1, 4))
+else:
+    bbox_ious_numba = None
+
+
+def benchmark(sizes=(10, 50, 200), repeat:int=200)->dict:
+    """
+    Times the kernels against cython_bbox (when it is installed) on random boxes, results in microseconds per call.
+    """
+    import time
+    try:
+        from cython_bbox import bbox_overlaps
+    except ImportError:
+        bbox_overlaps = None
+
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in sizes:
+        def boxes():
+            tl = rng.uniform(0, 7770, (size, 2))
+            wh = rng.uniform(20, 120, (size, 2))
+            return np.hstack((tl, tl + wh))
+        a, b = boxes(), boxes()
+
+        kernels = {'numpy': lambda: bbox_ious(a, b)}
+        if bbox_ious_numba is not None:
+            bbox_ious_numba(a, b) # compile
+            kernels['numba'] = lambda: bbox_ious_numba(a, b)
+        if bbox_overlaps is not None:
+            kernels['cython_bbox'] = lambda: bbox_overlaps(a, b)
+            assert np.allclose(bbox_ious(a, b), bbox_overlaps(a, b))
+
+        results[size] = {}
+        for name, kernel in kernels.items():
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                kernel()
+            results[size][name] = round((time.perf_counter() - start_time) / repeat * 1e6, 2)
+    return results
+
+
+if __name__ == "__main__":
+    from pprint import pprint
+    pprint(benchmark())
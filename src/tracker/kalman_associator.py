@@ -2,8 +2,12 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import math
+from collections import deque
 from pprint import pprint
-from .proximity_calculator import Point, ProximityCalculator, JumpsInvestigator
+from .proximity_calculator import Point, ProximityCalculator, JumpsInvestigator, make_proximity_calculator
+from .spatial_index import DetectionIndex, as_detection_index
+from .tracking_utils.metrics import metrics
+from .tracking_utils.profiler import profiler
 
 """
 This module implement the second layer of our Data Association problem
@@ -73,8 +77,110 @@ class KalmanFilter:
         return self.x
 
 
+class KalmanBank:
+    """
+    Holds the Kalman filter states of all the tracklets in (N, 4) / (N, 4, 4) arrays,
+    so predict and update run as one batched operation for the whole pool.
+    Every tracklet gets a slot and a KalmanView on it, the view has the same interface as the KalmanFilter.
+    """
+    def __init__(self, dt, state_dim, meas_dim, Q, R, capacity=32):
+        self.dt = dt
+        self.state_dim = state_dim
+        self.meas_dim = meas_dim
+        self.Q = Q
+        self.R = R
+        self.x = np.zeros((capacity, state_dim))
+        self.P = np.zeros((capacity, state_dim, state_dim))
+        self.__size = 0
+        self.__free_slots = []
+
+        # Measurement matrix
+        self.H = np.zeros((meas_dim, state_dim))
+        self.H[0, 0] = 1  # x position
+        self.H[1, 1] = 1  # y position
+
+        # State transition matrix
+        self.F = np.eye(state_dim)
+        self.F[0, 2] = dt
+        self.F[1, 3] = dt
+
+    def allocate(self)->int:
+        if len(self.__free_slots) > 0:
+            slot = self.__free_slots.pop()
+        else:
+            if self.__size == self.x.shape[0]:
+                self.x = np.concatenate((self.x, np.zeros_like(self.x)))
+                self.P = np.concatenate((self.P, np.zeros_like(self.P)))
+            slot = self.__size
+            self.__size += 1
+        self.x[slot] = 0
+        self.P[slot] = 0
+        return slot
+
+    def release(self, slot:int)->None:
+        self.__free_slots.append(slot)
+
+    def __len__(self)->int:
+        return self.__size - len(self.__free_slots)
+
+    def view(self, slot:int)->'KalmanView':
+        return KalmanView(self, slot)
+
+    def predict(self, slots)->None:
+        slots = np.asarray(slots, dtype=np.intp)
+        self.x[slots] = self.x[slots] @ self.F.T
+        self.P[slots] = self.F @ self.P[slots] @ self.F.T + self.Q
+
+    def update(self, slots, z:np.ndarray)->None:
+        """
+        Batched KalmanFilter.update, z is the (N, 2) measurement of every slot.
+        The gain is solved with np.linalg.solve instead of inverting S.
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        if slots.shape[0] == 0:
+            return
+        x = self.x[slots]
+        P = self.P[slots]
+        z = np.asarray(z, dtype=np.float64).reshape(-1, self.meas_dim)
+
+        PHt = P @ self.H.T
+        S = self.H @ PHt + self.R
+        # K = P H^T S^-1  <=>  K^T = S^-T (P H^T)^T
+        K = np.linalg.solve(np.swapaxes(S, 1, 2), np.swapaxes(PHt, 1, 2)).swapaxes(1, 2)
+        self.P[slots] = P - K @ (self.H @ P)
+        x = x + (K @ (z - x @ self.H.T)[:, :, None])[:, :, 0]
+        x[:, :2] = z
+        self.x[slots] = x
+
+
+class KalmanView:
+    """
+    A tracklet's slot in the KalmanBank, exposes the KalmanFilter interface.
+    """
+    def __init__(self, bank:KalmanBank, slot:int)->None:
+        self.bank = bank
+        self.slot = slot
+
+    @property
+    def x(self)->np.ndarray:
+        return self.bank.x[self.slot]
+
+    @property
+    def P(self)->np.ndarray:
+        return self.bank.P[self.slot]
+
+    def predict(self):
+        self.bank.predict([self.slot])
+
+    def update(self, z):
+        self.bank.update([self.slot], z)
+
+    def get_state(self):
+        return self.bank.x[self.slot].copy()
+
+
 class TrackLet:
-    def __init__(self, global_id,  det:dict, color=None)->None:
+    def __init__(self, global_id,  det:dict, color=None, kalman_bank:KalmanBank=None)->None:
         self.dt = 1
         self.state_dim = 4
         self.meas_dim = 2
@@ -88,7 +194,10 @@ class TrackLet:
         self.__coordinates = None       
         self.__color = color
         self.__vanished = False
-        self.__kalman_filter = KalmanFilter(self.dt, self.state_dim, self.meas_dim, self.Q, self.R, self.global_id)
+        if kalman_bank is not None:
+            self.__kalman_filter = kalman_bank.view(kalman_bank.allocate())
+        else:
+            self.__kalman_filter = KalmanFilter(self.dt, self.state_dim, self.meas_dim, self.Q, self.R, self.global_id)
         self.__is_updated = False
         self.__life_span_reset = 50
         self.__life_span = self.__life_span_reset
@@ -166,36 +275,21 @@ class TrackLet:
     def coordinates(self, coord)->None:
         self.__coordinates = coord
     
-    def __find_closest_detection(self, pred_coordinates:list, dets:list)->dict|None:
-        closest_det = None
-        min_dist = math.inf
-        min_idx = math.inf
-        dist_list = []
-        for idx, det in enumerate(dets):
-            coord = det.get('coordinates')
-            dist = self.__euclidean_dist(pred_coordinates, coord)
-            dist_list.append(dist)
-            if dist < min_dist and dist < 0.05:
-                min_dist = dist
-                closest_det = det
-                min_idx = idx
-        if len(dets) > 0 and min_idx is not math.inf:
-            closest_det = dets.pop(min_idx)
+    def __pop_nearest(self, point, dets, max_dist=math.inf)->dict|None:
+        index = as_detection_index(dets)
+        idx, _ = index.nearest(point, max_dist)
+        if idx < 0:
+            return None
+        closest_det = index.remove(idx)
+        if index is not dets:
+            index.sync()
         return closest_det
 
+    def __find_closest_detection(self, pred_coordinates:list, dets:list)->dict|None:
+        return self.__pop_nearest(pred_coordinates, dets, 0.05)
+
     def __find_closest_detection_reassign(self, dets:list)->dict|None:
-        min_idx = math.inf
-        min_dist = math.inf
-        closest_det = None
-        for ix, det in enumerate(dets):
-            coord = det.get('coordinates')
-            dist = self.__euclidean_dist(coord, self.__coordinates)
-            if dist < min_dist:
-                min_dist = dist
-                min_idx = ix
-        if min_idx is not math.inf:
-            closest_det = dets.pop(min_idx)
-        return closest_det
+        return self.__pop_nearest(self.__coordinates, dets)
 
     def __euclidean_dist(self, point1, point2)->float:
         return np.sqrt(((point1[0]-point2[0])**2)+((point1[1] - point2[1])**2))
@@ -221,24 +315,17 @@ class TrackLet:
         self.__past_track_ids.append(self.__tracked_id)
 
     # ID Associations
-    def associate_id(self, dets:list)->bool:
-        for idx, det in enumerate(dets):
-            id = det.get('track_id')
-            if id is None:
-                continue
-
-            if self.__tracked_id == id:
-                self.__coordinates = det.get('coordinates')
-                self.__tracked_id = det.get('track_id')
-                self.__det_raw = dets.pop(idx)
-                self.__life_span = self.__life_span_reset
-                
-                if self.__alert_state:
-                    self.__det_raw['alert'] = self.__alert_state
-                return True
-
+    def associate_id(self, det:dict)->None:
+        """
+        Takes the detection that carries the BoTSORT id of the tracklet, found by AssociationsManager.associate_ids.
+        """
+        self.__coordinates = det.get('coordinates')
+        self.__tracked_id = det.get('track_id')
+        self.__det_raw = det
+        self.__life_span = self.__life_span_reset
 
-        return False
+        if self.__alert_state:
+            self.__det_raw['alert'] = self.__alert_state
 
     def associate_prediction(self, dets:list)->bool:
         """
@@ -280,35 +367,18 @@ class TrackLet:
         return (False, None)
     
     def find_closer_than_det(self, x, dets:list[dict])->tuple[bool, dict]:
-        min_closest = math.inf
-        min_index = math.inf
-
-        for idx, det in enumerate(dets):
-            _, dist = self.closer_than_x(x, det)
-            if _ and dist < min_closest:
-                min_closest = dist
-                min_index = idx
-
-        if min_closest is not math.inf:
-            return (True, dets[min_index])
+        index = as_detection_index(dets)
+        idx, _ = index.nearest(self.__coordinates, x)
+        if idx >= 0:
+            return (True, index.get(idx))
         return (False, None)
 
     def find_closest(self, dets:list[dict])->tuple[float, dict]:
-        min_idx = math.inf
-        min_dist = math.inf
-        closest_det = None
-
-        for ix, det in enumerate(dets):
-            coord = det.get('coordinates')
-            dist = self.__euclidean_dist(coord, self.__coordinates)
-            if dist < min_dist:
-                min_dist = dist
-                min_idx = ix
-
-        if min_idx is not math.inf:
-            closest_det = dets[min_idx]
-
-        return (min_dist, closest_det)
+        index = as_detection_index(dets)
+        idx, min_dist = index.nearest(self.__coordinates)
+        if idx >= 0:
+            return (min_dist, index.get(idx))
+        return (min_dist, None)
     
     def commit(self)->None:
         if self.__temporary_state is None:
@@ -395,17 +465,9 @@ class TrackLet:
             self.__life_span -= 1
             return False
 
-        shortest_distance = math.inf
-        closest_index = math.inf
-        for i, det in enumerate(dets):
-            coord = det.get('coordinates')
-            dist = self.__euclidean_dist(coord, self.__coordinates)
-            if dist < shortest_distance:
-                shortest_distance = dist
-                closest_index = i
-
-        if shortest_distance is not math.inf:
-            self.__det_raw = dets.pop(closest_index)
+        closest_det = self.__pop_nearest(self.__coordinates, dets)
+        if closest_det is not None:
+            self.__det_raw = closest_det
             self.__tracked_id = self.__det_raw.get('track_id')
             self.__coordinates = self.__det_raw.get('coordinates')
             self.__det_raw['color'] = (0, 245, 185)
@@ -428,6 +490,12 @@ class TrackLet:
             self.__life_span -= 1
         return self.__det_raw
 
+    @property
+    def kalman_slot(self)->int|None:
+        if isinstance(self.__kalman_filter, KalmanView):
+            return self.__kalman_filter.slot
+        return None
+
     def update(self)->None:
         self.__kalman_filter.update(np.array(self.__coordinates))
 
@@ -461,13 +529,17 @@ class TrackLet:
     
 
 class AssociationsManager:
-    def __init__(self, teams_colors:tuple)->None:
+    def __init__(self, teams_colors:tuple, linear_assignment=False, reset_compact_interval=30)->None:
+        self.__linear_assignment = linear_assignment # Use the LinearProximityCalculator
+        self.__reset_compact_interval = reset_compact_interval
+        self.__frame_count = 0
         self.__associated_tracklets = []
         self.__unfound_tracklets = []
         self.__guid_counter = 1
         self.__tracklets_pool = [] # Full list of tracklets
         self.__reset_tracks = [] # This contains a list of the tracks that need to be reset.
         self.__tracklets_limit = 26
+        self.__kalman_bank = KalmanBank(1, 4, 2, np.eye(4) * 0.01, np.eye(2) * 0.1)
         self.__team_ids_track = [{'ids_track':0, 'tracklets':[], 'color':teams_colors[0], 'init':False, 'id':2, 'guid':0}, 
                                  {'ids_track':0, 'tracklets':[], 'color':teams_colors[1], 'init':False, 'id':1, 'guid':0}]
         self.__teams_init = False
@@ -602,9 +674,10 @@ class AssociationsManager:
     
     def proximity_association(self, dets, tracks_list, min_dist=True)->None:
           # Convert the remaining detections to points using
+        index = as_detection_index(dets)
         o_list = []
         x_list = []
-        for idx, det in enumerate(dets):
+        for idx, det in enumerate(index.detections()):
             det['id'] = idx 
             point = TrackLet.detection_to_point(det)
             o_list.append(point)
@@ -612,7 +685,7 @@ class AssociationsManager:
         for track in tracks_list:
             x_list.append(track.to_point())
 
-        pc = ProximityCalculator(x_list, o_list, min_dist)
+        pc = make_proximity_calculator(x_list, o_list, min_dist, self.__linear_assignment)
         pc.compute()
         x_list, _ = pc.get_associated_points()
         for x in x_list:
@@ -620,8 +693,7 @@ class AssociationsManager:
                 if x.id == t.guid:
                     if x.extras.get('found_det') is not None:
                         t.assign_det(x.extras['found_det'])
-                        i = dets.index(x.extras['found_det'])
-                        dets.pop(i)
+                        index.remove_det(x.extras['found_det'])
                         # print(f"Detection Index: {i}")
                         t.set_found()
                     break
@@ -633,29 +705,58 @@ class AssociationsManager:
             for track in commits:
                 track.commit()
 
+        if index is not dets:
+            index.sync()
 
     
-    def update(self, dets:list)->None:
+    def associate_ids(self, dets:list)->None:
         """
-        1. Associate with IDS
-        2. Associate using secondary state prediction
-        3. Initialize new tracklets if tracklets are < x_num_of_players
+        ID association, every tracklet takes the first detection left with its BoTSORT id and the detection leaves dets.
+        The detections are indexed by id once (track_id -> rows), the tracklets are served in pool order.
         """
+        rows_by_id = {}
+        for idx, det in enumerate(dets):
+            track_id = det.get('track_id')
+            if track_id is not None:
+                rows_by_id.setdefault(track_id, deque()).append(idx)
+
+        taken = set()
         for tracklet in self.__tracklets_pool:
-            if tracklet.associate_id(dets):
+            rows = rows_by_id.get(tracklet.get_id())
+            if rows:
+                idx = rows.popleft()
+                taken.add(idx)
+                tracklet.associate_id(dets[idx])
                 self.__associated_tracklets.append(tracklet)
                 tracklet.set_found()
             else:
                 self.__unfound_tracklets.append(tracklet)
                 tracklet.clear_found()
 
+        if len(taken) > 0:
+            dets[:] = [det for idx, det in enumerate(dets) if idx not in taken]
+
+    @metrics.timed('associations_update')
+    @profiler.profiled('associations_update')
+    def update(self, dets:list)->None:
+        """
+        1. Associate with IDS
+        2. Associate using secondary state prediction
+        3. Initialize new tracklets if tracklets are < x_num_of_players
+        """
+        self.associate_ids(dets)
+
 
         if self.__teams_init:      
-            self.proximity_association(dets, self.__unfound_tracklets)
+            # One spatial index over the detections left after the ID association, shared by both passes
+            index = DetectionIndex(dets)
+            self.proximity_association(index, self.__unfound_tracklets)
             # Associate the available detections with the tracklets that are ready to be reset
-            self.proximity_association(dets, self.__reset_tracks, False)
+            self.proximity_association(index, self.__reset_tracks, False)
+            index.sync()
             
             # Remove the tracks that are reset.
+            metrics.inc('reassignments_total', sum(1 for track in self.__reset_tracks if track.found()))
             for i, track in enumerate(self.__reset_tracks):
                 if track.found():
                     i = self.__reset_tracks.index(track)
@@ -683,7 +784,7 @@ class AssociationsManager:
                     id = self.__guid_counter+1#team['guid'] + team['id'] if team['id'] == 0 else (len(team['tracklets']) * 2) + (team['id'])
                         
                     # team['guid'] = id
-                    track =  TrackLet(id, det, kit_color)
+                    track =  TrackLet(id, det, kit_color, self.__kalman_bank)
                     
                     # if not team['init']:
                     #     team['init'] = True
@@ -699,13 +800,42 @@ class AssociationsManager:
                     )
                     self.__guid_counter += 1
 
-        # update the Kalman filters in the tracklets found and asscoiated
-        for tracklet in self.__tracklets_pool:
-            tracklet.update()
+        # update the Kalman filters in the tracklets found and asscoiated, in one batched step
+        if len(self.__tracklets_pool) > 0:
+            slots = [tracklet.kalman_slot for tracklet in self.__tracklets_pool]
+            coordinates = np.array([tracklet.coordinates for tracklet in self.__tracklets_pool], dtype=np.float64)
+            self.__kalman_bank.update(slots, coordinates)
 
         self.__associated_tracklets = []
         self.__unfound_tracklets = []
 
+        self.__frame_count += 1
+        if self.__frame_count % self.__reset_compact_interval == 0:
+            self.compact_reset_tracks()
+
+    def compact_reset_tracks(self)->int:
+        """
+        Drops the tracklets that came back to life from the reset list (the removal in update() can skip some of them),
+        and the duplicates, returns the number of tracklets dropped.
+        """
+        seen = set()
+        result = []
+        for tracklet in self.__reset_tracks:
+            if tracklet.life_span > 0 or id(tracklet) in seen:
+                continue
+            seen.add(id(tracklet))
+            result.append(tracklet)
+        dropped = len(self.__reset_tracks) - len(result)
+        self.__reset_tracks = result
+        return dropped
+
+    def pool_sizes(self)->dict:
+        return {
+            'tracklets': len(self.__tracklets_pool),
+            'reset_tracklets': len(self.__reset_tracks),
+            'kalman_slots': len(self.__kalman_bank)
+        }
+
     def get_dets(self)->list:
         result = []
         for tracklet in self.__tracklets_pool:
@@ -749,6 +879,7 @@ class AssociationsManager:
         return None
 
     def closest_associations(self, dets:list, unfound_tracks:list[TrackLet])->tuple[list[TrackLet], list[TrackLet]]:
+        index = as_detection_index(dets)
         un_assigned = []
         assigned_tracks = []
         skip = False
@@ -756,10 +887,10 @@ class AssociationsManager:
             if track in assigned_tracks:
                 continue
 
-            dist, closest_det = track.find_closest(dets)
+            dist, closest_det = track.find_closest(index)
             if dist <= 0.02: # Close enough to just assign
                 track.assign_det(closest_det)
-                dets.remove(closest_det)
+                index.remove_det(closest_det)
                 assigned_tracks.append(track)
                 continue
             elif not track.object_vanished:
@@ -768,12 +899,14 @@ class AssociationsManager:
             # Check if your object vanished first circle of doubt (Our object may have reappeared a bit far from us).
             if track.object_vanished and dist <= 0.05: 
                 track.assign_det(closest_det)
-                dets.remove(closest_det)
+                index.remove_det(closest_det)
                 assigned_tracks.append(track)
             else:
                 track.decrease_dead_span()
                 un_assigned.append(track)
 
+        if index is not dets:
+            index.sync()
         return un_assigned, assigned_tracks
             
 
@@ -36,6 +36,9 @@ class KalmanFilter(object):
     observation model).
 
     """
+    state_dim = 8
+    box_state = True # the state holds the box, the measurement is (x, y, w, h)
+    lost_velocity_dims = [6, 7] # velocities cleared while a track is not tracked
 
     def __init__(self):
         ndim, dt = 4, 1.
@@ -179,10 +182,9 @@ class KalmanFilter(object):
             self._std_weight_velocity * mean[:, 3]]
         sqr = np.square(np.r_[std_pos, std_vel]).T
 
-        motion_cov = []
-        for i in range(len(mean)):
-            motion_cov.append(np.diag(sqr[i]))
-        motion_cov = np.asarray(motion_cov)
+        motion_cov = np.zeros((len(mean), 8, 8))
+        diag = np.arange(8)
+        motion_cov[:, diag, diag] = sqr
 
         mean = np.dot(mean, self._motion_mat.T)
         left = np.dot(self._motion_mat, covariance).transpose((1, 0, 2))
@@ -190,6 +192,62 @@ class KalmanFilter(object):
 
         return mean, covariance
 
+    def multi_project(self, mean, covariance):
+        """Project state distributions to measurement space (Vectorized version).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 covariance matrices of the
+            given state estimates.
+
+        """
+        std = self._std_weight_position * mean[:, [2, 3, 2, 3]]
+        innovation_cov = np.zeros((len(mean), 4, 4))
+        diag = np.arange(4)
+        innovation_cov[:, diag, diag] = np.square(std)
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = self._update_mat @ covariance @ self._update_mat.T
+        return mean, covariance + innovation_cov
+
+    def multi_update(self, mean, covariance, measurement):
+        """Run Kalman filter correction step (Vectorized version).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the predicted states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the states.
+        measurement : ndarray
+            The Nx4 dimensional measurement matrix (x, y, w, h), one row per
+            state.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+
+        # K = P H^T S^-1, solved for all the states at once
+        cov_ht = covariance @ self._update_mat.T
+        kalman_gain = np.linalg.solve(projected_cov, cov_ht.transpose((0, 2, 1))).transpose((0, 2, 1))
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.transpose((0, 2, 1))
+        return new_mean, new_covariance
+
     def update(self, mean, covariance, measurement):
         """Run Kalman filter correction step.
 
@@ -266,4 +324,111 @@ class KalmanFilter(object):
             squared_maha = np.sum(z * z, axis=0)
             return squared_maha
         else:
-            raise ValueError('invalid distance metric')
\ No newline at end of file
+            raise ValueError('invalid distance metric')
+
+
+class PitchKalmanFilter(KalmanFilter):
+    """
+    A simple Kalman filter for tracking players in the normalized pitch space.
+
+    The 4-dimensional state space
+
+        x, y, vx, vy
+
+    contains the pitch coordinates (x, y) of the player and their velocities,
+    the pitch coordinates are the direct observation of the state space.
+    Unlike the box filter the noise does not depend on the state, it is given
+    in normalized pitch units (1 is the length of the pitch).
+
+    """
+    state_dim = 4
+    box_state = False
+    lost_velocity_dims = []
+
+    def __init__(self, std_position=0.002, std_velocity=0.001, std_measurement=0.002):
+        ndim, dt = 2, 1.
+
+        self._motion_mat = np.eye(2 * ndim, 2 * ndim)
+        for i in range(ndim):
+            self._motion_mat[i, ndim + i] = dt
+        self._update_mat = np.eye(ndim, 2 * ndim)
+
+        self._motion_cov = np.diag(np.square([std_position, std_position, std_velocity, std_velocity]))
+        self._innovation_cov = np.diag(np.square([std_measurement, std_measurement]))
+        self._std_measurement = std_measurement
+        self._std_velocity = std_velocity
+
+    def initiate(self, measurement):
+        """Create track from unassociated measurement.
+
+        Parameters
+        ----------
+        measurement : ndarray
+            Pitch coordinates (x, y).
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean vector (4 dimensional) and covariance matrix (4x4
+            dimensional) of the new track. Unobserved velocities are initialized
+            to 0 mean.
+
+        """
+        mean = np.r_[measurement, np.zeros(2)]
+        std = [
+            2 * self._std_measurement,
+            2 * self._std_measurement,
+            10 * self._std_velocity,
+            10 * self._std_velocity]
+        covariance = np.diag(np.square(std))
+        return mean, covariance
+
+    def predict(self, mean, covariance):
+        mean = np.dot(self._motion_mat, mean)
+        covariance = np.linalg.multi_dot((
+            self._motion_mat, covariance, self._motion_mat.T)) + self._motion_cov
+        return mean, covariance
+
+    def project(self, mean, covariance):
+        mean = np.dot(self._update_mat, mean)
+        covariance = np.linalg.multi_dot((
+            self._update_mat, covariance, self._update_mat.T))
+        return mean, covariance + self._innovation_cov
+
+    def multi_predict(self, mean, covariance):
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = self._motion_mat @ covariance @ self._motion_mat.T + self._motion_cov
+        return mean, covariance
+
+    def multi_project(self, mean, covariance):
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = self._update_mat @ covariance @ self._update_mat.T
+        return mean, covariance + self._innovation_cov
+
+    def multi_gating_distance(self, mean, covariance, measurements):
+        """Squared Mahalanobis distance between every state and every
+        measurement (Vectorized version of gating_distance).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx4 dimensional mean matrix of the states.
+        covariance : ndarray
+            The Nx4x4 dimensional covariance matrices of the states.
+        measurements : ndarray
+            The Mx2 dimensional matrix of the measured pitch coordinates.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM array, compare it with `chi2inv95[2]`.
+
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+        d = measurements[None, :, :] - projected_mean[:, None, :]
+        # d^T S^-1 d for the 2x2 innovation covariances, with the closed form inverse
+        a, b, c = projected_cov[:, 0, 0], projected_cov[:, 0, 1], projected_cov[:, 1, 1]
+        det = a * c - b * b
+        dx, dy = d[:, :, 0], d[:, :, 1]
+        return (c[:, None] * dx * dx - 2 * b[:, None] * dx * dy + a[:, None] * dy * dy) / det[:, None]
+
@@ -1,10 +1,19 @@
 import numpy as np
 import scipy
 import lap
+from scipy.sparse.csgraph import connected_components
 from scipy.spatial.distance import cdist
 
-from cython_bbox import bbox_overlaps as bbox_ious
 from tracker import kalman_filter
+from tracker.iou import bbox_ious, bbox_ious_numba
+
+try:
+    from cython_bbox import bbox_overlaps as cython_bbox_ious
+except ImportError:
+    cython_bbox_ious = None
+
+# cython_bbox when it is installed (fastest at the live sizes), then the numba kernel, then the NumPy kernel
+_ious_kernel = cython_bbox_ious or bbox_ious_numba or bbox_ious
 
 
 def merge_matches(m1, m2, shape):
@@ -35,18 +44,103 @@ def _indices_to_matches(cost_matrix, indices, thresh):
     return matches, unmatched_a, unmatched_b
 
 
-def linear_assignment(cost_matrix, thresh):
+# Matrices with fewer cells than this are solved in one lapjv call, gating them costs more than it saves
+DECOMPOSE_MIN_SIZE = 10000
+# Size of the blocks the small components are grouped into, lapjv is superlinear in the block size
+ASSIGNMENT_GROUP_SIZE = 1600
+
+
+def __lapjv_block(cost_matrix, thresh):
+    """
+    lapjv on a dense block, returns the (rows, cols) of the matches.
+    """
+    _, x, _ = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
+    rows = np.flatnonzero(x >= 0)
+    return rows, x[rows]
+
+
+def __component_labels(feasible:np.ndarray)->tuple[int, np.ndarray]:
+    """
+    (number of components, component of each row then of each column) of the feasible pairs graph.
+    """
+    n, m = feasible.shape
+    rows, cols = np.nonzero(feasible)
+    graph = scipy.sparse.coo_matrix((np.ones(rows.shape[0], dtype=np.int8), (rows, cols + n)), shape=(n + m, n + m))
+    return connected_components(graph, directed=False)
+
+
+def __gated_assignment(cost_matrix, thresh):
+    """
+    1. Pairs over the threshold can not be matched (leaving both unmatched costs the same), they are gated out
+       and the feasible pairs are split into connected components, the components are independent problems.
+    2. Components without a row or a column are unmatched, the 1x1 ones are matched directly.
+    3. The other components are grouped so each lapjv call gets up to about ASSIGNMENT_GROUP_SIZE cells,
+       the pairs between two components are infeasible so solving them together gives the same matches.
+    """
+    n = cost_matrix.shape[0]
+    num_components, labels = __component_labels(cost_matrix <= thresh)
+    row_labels, col_labels = labels[:n], labels[n:]
+    num_rows = np.bincount(row_labels, minlength=num_components)
+    num_cols = np.bincount(col_labels, minlength=num_components)
+
+    # 1x1 components
+    single = (num_rows == 1) & (num_cols == 1)
+    single_rows = np.flatnonzero(single[row_labels])
+    col_of = np.empty(num_components, dtype=np.int64)
+    single_cols_mask = single[col_labels]
+    col_of[col_labels[single_cols_mask]] = np.flatnonzero(single_cols_mask)
+    single_cols = col_of[row_labels[single_rows]]
+    matched = cost_matrix[single_rows, single_cols] < thresh
+    matched_rows, matched_cols = [single_rows[matched]], [single_cols[matched]]
+
+    # Group the others
+    num_rows, num_cols = num_rows.tolist(), num_cols.tolist()
+    group_of = np.full(num_components, -1, dtype=np.int64)
+    group, group_rows, group_cols = 0, 0, 0
+    for label in np.flatnonzero(~single & (np.array(num_rows) > 0) & (np.array(num_cols) > 0)).tolist():
+        if group_rows > 0 and (group_rows + num_rows[label])*(group_cols + num_cols[label]) > ASSIGNMENT_GROUP_SIZE:
+            group += 1
+            group_rows = group_cols = 0
+        group_of[label] = group
+        group_rows += num_rows[label]
+        group_cols += num_cols[label]
+
+    if group_rows > 0:
+        row_groups, col_groups = group_of[row_labels], group_of[col_labels]
+        rows, cols = np.flatnonzero(row_groups >= 0), np.flatnonzero(col_groups >= 0)
+        rows = rows[np.argsort(row_groups[rows], kind='stable')]
+        cols = cols[np.argsort(col_groups[cols], kind='stable')]
+        row_splits = np.cumsum(np.bincount(row_groups[rows], minlength=group + 1))[:-1]
+        col_splits = np.cumsum(np.bincount(col_groups[cols], minlength=group + 1))[:-1]
+        for block_rows, block_cols in zip(np.split(rows, row_splits), np.split(cols, col_splits)):
+            r, c = __lapjv_block(cost_matrix[np.ix_(block_rows, block_cols)], thresh)
+            matched_rows.append(block_rows[r])
+            matched_cols.append(block_cols[c])
+
+    matched_rows, matched_cols = np.concatenate(matched_rows), np.concatenate(matched_cols)
+    order = np.argsort(matched_rows, kind='stable')
+    return matched_rows[order], matched_cols[order]
+
+
+def linear_assignment(cost_matrix, thresh, decompose:bool=True):
+    """
+    Assignment of the pairs with a cost under thresh, same result as lapjv on the whole matrix.
+    With decompose the large matrices are gated and split first (see __gated_assignment),
+    one lapjv call is faster than the gating on the small ones. When several assignments have the lowest cost
+    (tied costs, costs exactly at thresh) the decomposed one may pick another of them (see decompose_check).
+    """
     if cost_matrix.size == 0:
         return np.empty((0, 2), dtype=int), tuple(range(cost_matrix.shape[0])), tuple(range(cost_matrix.shape[1]))
-    matches, unmatched_a, unmatched_b = [], [], []
-    cost, x, y = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
-    for ix, mx in enumerate(x):
-        if mx >= 0:
-            matches.append([ix, mx])
-    unmatched_a = np.where(x < 0)[0]
-    unmatched_b = np.where(y < 0)[0]
-    matches = np.asarray(matches)
-    return matches, unmatched_a, unmatched_b
+    if decompose and cost_matrix.size >= DECOMPOSE_MIN_SIZE:
+        rows, cols = __gated_assignment(cost_matrix, thresh)
+    else:
+        rows, cols = __lapjv_block(cost_matrix, thresh)
+
+    unmatched_a = np.ones(cost_matrix.shape[0], dtype=bool)
+    unmatched_a[rows] = False
+    unmatched_b = np.ones(cost_matrix.shape[1], dtype=bool)
+    unmatched_b[cols] = False
+    return np.stack((rows, cols), axis=1).astype(int), np.flatnonzero(unmatched_a), np.flatnonzero(unmatched_b)
 
 
 def ious(atlbrs, btlbrs):
@@ -61,7 +155,7 @@ def ious(atlbrs, btlbrs):
     if ious.size == 0:
         return ious
 
-    ious = bbox_ious(
+    ious = _ious_kernel(
         np.ascontiguousarray(atlbrs, dtype=np.float64),
         np.ascontiguousarray(btlbrs, dtype=np.float64)
     )
@@ -69,6 +163,15 @@ def ious(atlbrs, btlbrs):
     return ious
 
 
+def stack_tlbrs(tracks)->np.ndarray:
+    """
+    (N, 4) tlbr array of the tracks, stacked from the track store when the tracks support it.
+    """
+    if len(tracks) > 0 and hasattr(tracks[0], 'multi_tlbr'):
+        return type(tracks[0]).multi_tlbr(tracks)
+    return np.array([track.tlbr for track in tracks], dtype=np.float64).reshape(-1, 4)
+
+
 def tlbr_expand(tlbr, scale=1.2):
     w = tlbr[2] - tlbr[0]
     h = tlbr[3] - tlbr[1]
@@ -96,14 +199,62 @@ def iou_distance(atracks, btracks):
         atlbrs = atracks
         btlbrs = btracks
     else:
-        atlbrs = [track.tlbr for track in atracks]
-        btlbrs = [track.tlbr for track in btracks]
+        atlbrs = stack_tlbrs(atracks)
+        btlbrs = stack_tlbrs(btracks)
     _ious = ious(atlbrs, btlbrs)
     cost_matrix = 1 - _ious
 
     return cost_matrix
 
 
+def stack_states(tracks)->tuple[np.ndarray, np.ndarray]:
+    """
+    (N, dim) means and (N, dim, dim) covariances of the tracks, from the track store when the tracks support it.
+    """
+    if len(tracks) > 0 and hasattr(tracks[0], 'multi_state'):
+        return type(tracks[0]).multi_state(tracks)
+    return np.asarray([track.mean for track in tracks]), np.asarray([track.covariance for track in tracks])
+
+
+def pitch_distance(kf, tracks, detections, gate:float, metric='maha'):
+    """
+    Compute cost based on the pitch coordinates, for the PitchKalmanFilter states
+    :type tracks: list[STrack]
+    :type detections: list[STrack]
+    :param gate: pitch distance over which a pair is not matched
+    :param metric: 'maha' (squared Mahalanobis over chi2inv95[2]) or 'euclidean' (distance over gate)
+
+    :rtype cost_matrix np.ndarray, in [0, 1], 1 for the pairs outside the gate
+    """
+    cost_matrix = np.ones((len(tracks), len(detections)), dtype=np.float64)
+    if cost_matrix.size == 0:
+        return cost_matrix
+
+    means, covariances = stack_states(tracks)
+    measurements = np.asarray([det.coordinates for det in detections], dtype=np.float64).reshape(-1, 2)
+    dists = cdist(means[:, :2], measurements)
+    if metric == 'maha':
+        gating_threshold = kalman_filter.chi2inv95[2]
+        maha = kf.multi_gating_distance(means, covariances, measurements)
+        feasible = (maha <= gating_threshold) & (dists <= gate)
+        cost_matrix[feasible] = maha[feasible] / gating_threshold
+    elif metric == 'euclidean':
+        feasible = dists <= gate
+        cost_matrix[feasible] = dists[feasible] / gate
+    else:
+        raise ValueError('invalid distance metric')
+    return cost_matrix
+
+
+def pitch_position_distance(atracks, btracks)->np.ndarray:
+    """
+    Euclidean distance between the pitch positions of two lists of PitchKalmanFilter tracks.
+    """
+    if len(atracks) == 0 or len(btracks) == 0:
+        return np.zeros((len(atracks), len(btracks)), dtype=np.float64)
+    return cdist(stack_states(atracks)[0][:, :2], stack_states(btracks)[0][:, :2])
+
+
 def v_iou_distance(atracks, btracks):
     """
     Compute cost based on IoU
@@ -194,4 +345,44 @@ def fuse_score(cost_matrix, detections):
     det_scores = np.expand_dims(det_scores, axis=0).repeat(cost_matrix.shape[0], axis=0)
     fuse_sim = iou_sim * det_scores
     fuse_cost = 1 - fuse_sim
-    return fuse_cost
\ No newline at end of file
+    return fuse_cost
+
+
+def __assignment_cost(cost_matrix, rows, cols, thresh)->float:
+    # lapjv objective with cost_limit, an unmatched row or column costs half the threshold
+    return cost_matrix[rows, cols].sum() + thresh/2*(sum(cost_matrix.shape) - 2*rows.shape[0])
+
+
+def decompose_check(runs:int=1000, seed:int=0)->None:
+    """
+    Checks the gated and split linear_assignment against one lapjv call on the whole matrix, on random sparse
+    cost matrices:
+    1. distinct costs, the matches must be the same
+    2. tied costs and costs exactly at the threshold, several assignments are optimal, the matches must cost the same
+    Run with: python -m tracker.matching
+    """
+    rng = np.random.default_rng(seed)
+    for run in range(runs):
+        n, m = rng.integers(1, 150, 2)
+        a, b = rng.uniform(0, 1, (n, 2)), rng.uniform(0, 1, (m, 2))
+        dists = cdist(a, b) / rng.uniform(0.01, 0.3)
+        thresh = rng.uniform(0.3, 0.95)
+        ties = run % 3 == 1
+        at_thresh = run % 3 == 2
+        if ties:
+            dists = np.round(dists, 1)
+        cost_matrix = np.where(dists < 1, dists, rng.choice([1.0, np.inf]))
+        if at_thresh:
+            cost_matrix[rng.random(cost_matrix.shape) < 0.02] = thresh
+        gated = __gated_assignment(cost_matrix, thresh)
+        dense = __lapjv_block(cost_matrix, thresh)
+        if ties or at_thresh:
+            assert np.isclose(__assignment_cost(cost_matrix, *gated, thresh), __assignment_cost(cost_matrix, *dense, thresh)), \
+                "gated assignment costs more than the dense one"
+        else:
+            assert all(np.array_equal(x, y) for x, y in zip(gated, dense)), "gated assignment differs from the dense one"
+    print(f"linear_assignment decomposition: {runs} random matrices agree with the dense assignment")
+
+
+if __name__ == "__main__":
+    decompose_check()
@@ -3,6 +3,10 @@ import numpy as np
 import json
 import time
 import math
+from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
+from tracker import matching
+from tracker.tracking_utils.debug_sink import debug_sink
 
 class Point:
     MINIMUM_PROXIMITY_DISTANCE = 0.05
@@ -156,7 +160,8 @@ class ProximityCalculator:
         self.build_distances_graph()
         self.run()
         self.__associate_points()
-        self.write_to_json()
+        if debug_sink.enabled():
+            debug_sink.record('proximity_graph', self.__graph)
       
 
     def __calculate_distances(self, point)->np.ndarray:
@@ -255,6 +260,116 @@ class ProximityCalculator:
                 current_index += 1
 
 
+class LinearProximityCalculator:
+    """
+    Matrix based version of the ProximityCalculator.
+    1. Build one distance matrix between the X points and the O points
+    2. Gate it with Point.MINIMUM_PROXIMITY_DISTANCE (if min_dist is set)
+    3. Solve the assignment with the linear assignment solver
+    The results are written to the same point extras ('vertex', 'distance', 'found_det') as the ProximityCalculator.
+    Behavior change: the pairs are the assignment with the lowest total distance, the ProximityCalculator resolves
+    the conflicts greedily (closest pair first). Both agree when the players are further apart than the proximity
+    distance, in crowded scenes they can pair the points differently (see parity_check).
+    """
+    def __init__(self, x_list:list, o_list:list, min_dist = False)->None:
+        self.__x_list = x_list
+        self.__o_list = o_list
+        self.__filter = min_dist
+        self.__distances = None
+        self.__matches = []
+
+    def get_associated_points(self)->tuple:
+        return self.__x_list, self.__o_list
+
+    def get_distances(self)->np.ndarray:
+        return self.__distances
+
+    def get_matches(self)->list[tuple]:
+        return self.__matches
+
+    def compute(self)->None:
+        if len(self.__x_list) == 0 or len(self.__o_list) == 0:
+            return
+        xy_x = np.array([(point.x, point.y) for point in self.__x_list], dtype=np.float64)
+        xy_o = np.array([(point.x, point.y) for point in self.__o_list], dtype=np.float64)
+        self.__distances = cdist(xy_x, xy_o)
+
+        thresh = Point.MINIMUM_PROXIMITY_DISTANCE if self.__filter else np.inf
+        matches, _, _ = matching.linear_assignment(self.__distances, thresh=thresh)
+        self.__matches = [(int(ix), int(io)) for ix, io in matches]
+
+        for ix, io in self.__matches:
+            point = self.__x_list[ix]
+            o_point = self.__o_list[io]
+            point.extras = ('vertex', o_point.id)
+            point.extras = ('distance', float(self.__distances[ix, io]))
+            o_point.marker = point.marker
+            point.extras = ('found_det', o_point.extras['det'])
+
+        if debug_sink.enabled():
+            debug_sink.record('proximity_assignment', {'distances': self.__distances, 'matches': self.__matches})
+
+
+def proximity_matches(distances:np.ndarray, min_dist=False)->list[tuple]:
+    """
+    ProximityCalculator on a (X, O) distance matrix instead of the graph of dicts, same matches in the same cases:
+    1. Every X point takes its closest free O point, unless a free X point is closer to that O point, which goes first
+    2. X points that lose their O point move on to their next closest one
+    3. With min_dist the matches further than Point.MINIMUM_PROXIMITY_DISTANCE are dropped
+    Returns the (x index, o index) pairs.
+    """
+    n_x, n_o = distances.shape
+    order = np.argsort(distances, axis=1, kind='stable')
+    selected = np.zeros(n_x, dtype=bool)
+    used = np.zeros(n_o, dtype=bool)
+
+    def assign(index:int, key:int=0)->list[tuple]:
+        keys = order[index]
+        if key >= n_o:
+            return []
+        while used[keys[key]]:
+            key += 1
+            if key >= n_o:
+                return []
+        vertex = keys[key]
+        dist = distances[index, vertex]
+        column = distances[:, vertex]
+        closer = ~selected & (column < dist)
+        if not closer.any():
+            selected[index] = True
+            used[vertex] = True
+            return [(index, vertex)]
+
+        res = assign(int(np.argmin(np.where(closer, column, np.inf))))
+        if used[vertex]:
+            res.extend(assign(index, key + 1))
+            return res
+        selected[index] = True
+        used[vertex] = True
+        res.append((index, vertex))
+        return res
+
+    matches = []
+    index = 0
+    while index < n_x:
+        matches.extend(assign(index))
+        index += 1
+        while index < n_x and selected[index]:
+            index += 1
+    if min_dist:
+        matches = [(ix, io) for ix, io in matches if distances[ix, io] <= Point.MINIMUM_PROXIMITY_DISTANCE]
+    return [(int(ix), int(io)) for ix, io in matches]
+
+
+def make_proximity_calculator(x_list:list, o_list:list, min_dist=False, linear=False):
+    """
+    Returns the matrix based engine if linear is set, otherwise the graph based ProximityCalculator.
+    """
+    if linear:
+        return LinearProximityCalculator(x_list, o_list, min_dist)
+    return ProximityCalculator(x_list, o_list, min_dist)
+
+
 class JumpsInvestigator:
     def __init__(self, tracks:list)->None:
         self.__all_tracklets = tracks
@@ -285,15 +400,20 @@ class JumpsInvestigator:
         decide to perform 360 obstruction where we check if there exists a track that's so close
         to us that it might be obstructing us.
         """
-        closest_track = None
+        if len(self.__flagged_tracklets) == 0:
+            return
+        # One KD-Tree over all the tracklets, the closest other tracklet is the nearest neighbour that isn't us
+        coordinates = np.array([t.coordinates for t in self.__all_tracklets], dtype=np.float64).reshape(-1, 2)
+        tree = cKDTree(coordinates)
+        positions = {id(t):idx for idx, t in enumerate(self.__all_tracklets)}
+        k = min(2, len(self.__all_tracklets))
         for track in self.__flagged_tracklets:
+            dists, idxs = tree.query(np.asarray(track.coordinates, dtype=np.float64)[:2], k=k)
             min_dist = math.inf
-            for t2 in self.__all_tracklets:
-                if t2.guid != track.guid:
-                    dist = track.euclidean_dist(t2.coordinates)
-                    if dist  < min_dist:
-                        min_dist = dist
-                    closest_track = t2
+            for dist, idx in zip(np.atleast_1d(dists), np.atleast_1d(idxs)):
+                if idx != positions[id(track)] and self.__all_tracklets[idx].guid != track.guid:
+                    min_dist = dist
+                    break
             
             if min_dist > self.__obstruction_dist: #This object is too far to be obstructing you.
                 # print(track.guid, min_dist, closest_track.guid if closest_track is not None else "", len(self.__all_tracklets))
@@ -329,6 +449,95 @@ class JumpsInvestigator:
 
 
 
-if __name__ == "__main__":        
-    res = ProximityCalculator(None, None)
-    res.run()
\ No newline at end of file
+def __parity_scenes(rng, kind:str, size:int)->tuple[list, list]:
+    """
+    Random X / O scene of the parity check, the O points are the X points with a jitter, 20% of them missing.
+    separated: the players on a grid spaced at 3 proximity distances
+    crowded: the players packed in a 0.15 x 0.15 square
+    tied: crowded, with duplicated X and O points so several pairs are at the same distance
+    """
+    if kind == 'separated':
+        spacing = 3 * Point.MINIMUM_PROXIMITY_DISTANCE
+        grid = np.array([(x, y) for x in np.arange(0.05, 0.95, spacing) for y in np.arange(0.05, 0.95, spacing)])
+        xy = grid[rng.choice(len(grid), size=size, replace=False)]
+    else:
+        xy = 0.4 + rng.random((size, 2))*0.15
+        if kind == 'tied':
+            xy[size//2:] = xy[rng.integers(0, size//2, size - size//2)]
+    x_list = [Point(x, y, 'X', 10, id=idx) for idx, (x, y) in enumerate(xy)]
+    o_list = []
+    for idx, (x, y) in enumerate(xy):
+        if rng.random() < 0.8:
+            jitter = rng.normal(0, Point.MINIMUM_PROXIMITY_DISTANCE / 4, 2) if kind != 'tied' or rng.random() < 0.5 else (0, 0)
+            o_point = Point(x + jitter[0], y + jitter[1], 'O', 10, id=len(o_list))
+            o_point.extras = ('det', {'id':idx})
+            o_list.append(o_point)
+    rng.shuffle(o_list)
+    for idx, o_point in enumerate(o_list):
+        o_point.id = idx
+    return x_list, o_list
+
+
+def __parity_matches(x_list:list, o_list:list, min_dist:bool, linear:bool)->list[tuple]:
+    for point in x_list:
+        point.extras.clear()
+    pc = make_proximity_calculator(x_list, o_list, min_dist, linear)
+    pc.compute()
+    return [(p.id, p.extras['found_det']['id']) for p in x_list if p.extras.get('found_det') is not None]
+
+
+def __assignment_cost(x_list:list, o_list:list, matches:list[tuple], thresh:float)->float:
+    # lapjv objective with cost_limit, an unmatched point costs half the threshold
+    position = {o.extras['det']['id']: o for o in o_list}
+    cost = sum(math.dist((x_list[ix].x, x_list[ix].y), (position[det].x, position[det].y)) for ix, det in matches)
+    return cost + thresh/2*(len(x_list) + len(o_list) - 2*len(matches))
+
+
+def __parity_matrix_matches(x_list:list, o_list:list, min_dist:bool)->list[tuple]:
+    # same distance formula as the ProximityCalculator, the ties must break the same way
+    dx = np.subtract.outer([p.x for p in x_list], [p.x for p in o_list])
+    dy = np.subtract.outer([p.y for p in x_list], [p.y for p in o_list])
+    distances = np.sqrt(np.power(dx, 2) + np.power(dy, 2)).reshape(len(x_list), len(o_list))
+    matches = sorted(proximity_matches(distances, min_dist))
+    return [(x_list[ix].id, o_list[io].extras['det']['id']) for ix, io in matches]
+
+
+def parity_check(runs=100, size=22, seed=0)->dict:
+    """
+    Checks the LinearProximityCalculator and proximity_matches against the ProximityCalculator on random scenes
+    (see __parity_scenes):
+    1. proximity_matches must find the same matches as the ProximityCalculator in every scene, with and without min_dist
+    2. separated scenes, the linear engine must find the same matches, with and without min_dist
+    3. crowded and tied scenes, the linear engine may pair differently (lowest total distance instead of greedy),
+       its matches must be within the proximity distance and cost at most as much as the greedy ones
+    Raises an AssertionError on a failure, returns the number of scenes where the engines differ per kind.
+    Run with: python -m tracker.proximity_calculator
+    """
+    rng = np.random.default_rng(seed)
+    thresh = Point.MINIMUM_PROXIMITY_DISTANCE
+    differ = {'separated': 0, 'crowded': 0, 'tied': 0}
+    for kind in differ:
+        for _ in range(runs):
+            x_list, o_list = __parity_scenes(rng, kind, size)
+            for min_dist in (True, False):
+                graph = __parity_matches(x_list, o_list, min_dist, False)
+                assert graph == __parity_matrix_matches(x_list, o_list, min_dist), \
+                    f"{kind} scene, proximity_matches differs from the ProximityCalculator"
+                if kind != 'separated' and not min_dist:
+                    continue
+                linear = __parity_matches(x_list, o_list, min_dist, True)
+                if kind == 'separated':
+                    assert graph == linear, f"separated scene, graph {graph} != linear {linear}"
+                    continue
+                differ[kind] += graph != linear
+                assert __assignment_cost(x_list, o_list, linear, thresh) <= __assignment_cost(x_list, o_list, graph, thresh) + 1e-9, \
+                    f"{kind} scene, the linear matches cost more than the greedy ones"
+                for ix, det in linear:
+                    assert x_list[ix].extras['distance'] <= thresh, f"{kind} scene, match over the proximity distance"
+    print(f"ProximityCalculator parity: proximity_matches agrees in all the {3*runs} scenes, the linear engine pairs"
+          f" differently in {differ['crowded']} crowded and {differ['tied']} tied scenes out of {runs} each, 0 separated")
+    return differ
+
+
+if __name__ == "__main__":
+    parity_check()
\ No newline at end of file
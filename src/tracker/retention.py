@@ -0,0 +1,57 @@
+from collections import deque
+
+
+class TombstoneLog:
+    """
+    Bounded history of the removed track ids.
+    The tracks themselves are compacted away, only (track_id, frame removed) is kept for the last `capacity` removals,
+    so a late lookup of an old id can still be answered without the removed list growing for the whole match.
+    """
+    def __init__(self, capacity:int=1024)->None:
+        self.capacity = capacity
+        self.__order = deque()
+        self.__removed_at = {}
+        self.evicted = 0
+
+    def __len__(self)->int:
+        return len(self.__removed_at)
+
+    def __contains__(self, track_id)->bool:
+        return track_id in self.__removed_at
+
+    def add(self, track_id:int, frame_id:int)->None:
+        if track_id not in self.__removed_at:
+            self.__order.append(track_id)
+        self.__removed_at[track_id] = frame_id
+        while len(self.__order) > self.capacity:
+            del self.__removed_at[self.__order.popleft()]
+            self.evicted += 1
+
+    def removed_at(self, track_id:int)->int|None:
+        return self.__removed_at.get(track_id)
+
+
+class PoolMetrics:
+    """
+    Keeps the pool sizes of the last `history` frames, to watch the tracker's memory over a session.
+    """
+    def __init__(self, history:int=600)->None:
+        self.__samples = deque(maxlen=history)
+        self.__peak = {}
+
+    def record(self, frame_id:int, sizes:dict)->None:
+        sample = {'frame_id': frame_id}
+        sample.update(sizes)
+        self.__samples.append(sample)
+        for key, value in sizes.items():
+            if value > self.__peak.get(key, value - 1):
+                self.__peak[key] = value
+
+    def latest(self)->dict:
+        return dict(self.__samples[-1]) if len(self.__samples) > 0 else {}
+
+    def peak(self)->dict:
+        return dict(self.__peak)
+
+    def history(self)->list[dict]:
+        return list(self.__samples)
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class DetectionIndex:
+    """
+    Per frame KD-Tree over the normalized pitch coordinates of a list of detections.
+    1. It is built once per frame and shared by all the nearest detection searches.
+    2. Matched detections are removed by marking them, the tree is never rebuilt.
+    3. sync() writes the detections that are left back into the original list.
+    4. The coordinates and the tree are only built when they are queried, the first query is a linear scan
+       and the tree is built on the second one (an index that is only used to remove detections costs nothing).
+    Ties are resolved in favour of the lower list index, like the linear scans it replaces.
+    """
+    def __init__(self, dets:list[dict])->None:
+        self.__dets = dets
+        self.__size = len(dets)
+        self.__alive = np.ones(self.__size, dtype=bool)
+        self.__alive_count = self.__size
+        self.__positions = None
+        self.__coordinates = None
+        self.__tree = None
+        self.__queries = 0
+
+    def __points(self)->np.ndarray:
+        if self.__coordinates is None:
+            self.__coordinates = np.array([det.get('coordinates') for det in self.__dets], dtype=np.float64).reshape(-1, 2)
+        return self.__coordinates
+
+    def __use_tree(self)->bool:
+        self.__queries += 1
+        if self.__tree is None and self.__queries > 1:
+            self.__tree = cKDTree(self.__points())
+        return self.__tree is not None
+
+    def __scan(self, point:np.ndarray)->np.ndarray:
+        # distances of all the detections, the dead ones are inf
+        dists = np.sqrt(((self.__points() - point)**2).sum(axis=1))
+        dists[~self.__alive] = math.inf
+        return dists
+
+    def __len__(self)->int:
+        return self.__alive_count
+
+    def is_alive(self, idx:int)->bool:
+        return bool(self.__alive[idx])
+
+    def get(self, idx:int)->dict:
+        return self.__dets[idx]
+
+    def detections(self)->list[dict]:
+        return [det for idx, det in enumerate(self.__dets) if self.__alive[idx]]
+
+    def position(self, det:dict)->int:
+        if self.__positions is None:
+            self.__positions = {id(det):idx for idx, det in enumerate(self.__dets)}
+        return self.__positions.get(id(det), -1)
+
+    def nearest(self, point, max_dist=math.inf)->tuple[int, float]:
+        """
+        Returns (index, distance) of the closest detection still in the index that is strictly closer than max_dist,
+        or (-1, inf) if there is none.
+        """
+        if self.__alive_count == 0:
+            return -1, math.inf
+        point = np.asarray(point, dtype=np.float64)[:2]
+        if not self.__use_tree():
+            dists = self.__scan(point)
+            found = dists < max_dist
+            if not found.any():
+                return -1, math.inf
+            best = dists[found].min()
+            return int(np.flatnonzero(found & (dists == best))[0]), float(best)
+        bound = np.nextafter(max_dist, math.inf) if max_dist != math.inf else math.inf
+        k = min(4, self.__size)
+        while True:
+            dists, idxs = self.__tree.query(point, k=k, distance_upper_bound=bound)
+            dists, idxs = np.atleast_1d(dists), np.atleast_1d(idxs)
+            found = (idxs < self.__size)
+            found[found] = self.__alive[idxs[found]]
+            found &= dists < max_dist
+            exhausted = k >= self.__size or np.isinf(dists[-1])
+            if found.any():
+                best = dists[found].min()
+                # All the candidates at the best distance must be in the result to break the tie on the index
+                if exhausted or dists[-1] > best:
+                    ties = idxs[found & (dists == best)]
+                    return int(ties.min()), float(best)
+            elif exhausted:
+                return -1, math.inf
+            k = min(k*2, self.__size)
+
+    def within(self, point, radius:float)->list[int]:
+        """
+        Returns the indices of the detections still in the index that are strictly closer than radius, closest first.
+        """
+        if self.__alive_count == 0:
+            return []
+        point = np.asarray(point, dtype=np.float64)[:2]
+        if not self.__use_tree():
+            dists = self.__scan(point)
+            idxs = np.flatnonzero(dists < radius)
+            return idxs[np.lexsort((idxs, dists[idxs]))].tolist()
+        idxs = [idx for idx in self.__tree.query_ball_point(point, radius) if self.__alive[idx]]
+        if len(idxs) == 0:
+            return []
+        dists = np.linalg.norm(self.__tree.data[idxs] - point, axis=1)
+        order = np.lexsort((idxs, dists))
+        return [idxs[i] for i in order if dists[i] < radius]
+
+    def remove(self, idx:int)->dict:
+        if self.__alive[idx]:
+            self.__alive[idx] = False
+            self.__alive_count -= 1
+        return self.__dets[idx]
+
+    def remove_det(self, det:dict)->int:
+        idx = self.position(det)
+        if idx >= 0:
+            self.remove(idx)
+        return idx
+
+    def sync(self)->list[dict]:
+        """
+        Write the detections that are left back into the list the index was built from,
+        the index must not be used after this.
+        """
+        if self.__alive_count != len(self.__dets):
+            self.__dets[:] = self.detections()
+        return self.__dets
+
+
+def as_detection_index(dets)->DetectionIndex:
+    if isinstance(dets, DetectionIndex):
+        return dets
+    return DetectionIndex(dets)
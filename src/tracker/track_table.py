@@ -0,0 +1,195 @@
+import numpy as np
+from tracker.basetrack import BaseTrack
+from tracker.retention import TombstoneLog
+
+
+class TrackTable:
+    """
+    Struct-of-arrays store for the BoTSORT tracks.
+    1. Every activated STrack gets a row, its fields (ids, state, Kalman mean and covariance, score, frame ids, coordinates, detection row)
+       live in the table arrays and the STrack reads and writes them through TableField.
+    2. The tracked, lost and removed lists are boolean masks over the rows, the order of the tracked and lost tracks
+       is the order they entered the mask (seq), like the lists they replace.
+    3. Rows that are neither tracked nor lost are compacted periodically: the track is detached (its fields are copied
+       back to the object) and the row goes on the free list, so memory follows the live tracks instead of the whole match.
+       The ids of the removed tracks that are compacted go to the bounded TombstoneLog.
+    """
+    SCALAR_FIELDS = {
+        'track_id': np.int64,
+        'state': np.int8,
+        'is_activated': bool,
+        'score': np.float64,
+        'tracklet_len': np.int64,
+        'frame_id': np.int64,
+        'start_frame': np.int64,
+        'det_index': np.int64
+    }
+    ARRAY_FIELDS = ('mean', 'covariance', 'coordinates')
+
+    def __init__(self, capacity:int=64, compact_interval:int=30, tombstones:TombstoneLog=None, state_dim:int=8)->None:
+        self.compact_interval = compact_interval
+        self.tombstones = tombstones if tombstones is not None else TombstoneLog()
+        self.__columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in TrackTable.SCALAR_FIELDS.items()}
+        self.__columns['mean'] = np.zeros((capacity, state_dim), dtype=np.float64)
+        self.__columns['covariance'] = np.zeros((capacity, state_dim, state_dim), dtype=np.float64)
+        self.__columns['coordinates'] = np.zeros((capacity, 2), dtype=np.float64)
+        self.tracked = np.zeros(capacity, dtype=bool)
+        self.lost = np.zeros(capacity, dtype=bool)
+        self.removed = np.zeros(capacity, dtype=bool)
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.__tracks = [None]*capacity
+        self.__size = 0
+        self.__free_rows = []
+        self.__seq = 0
+        self.__frames_since_compact = 0
+        self.__frame_id = 0
+
+    def __len__(self)->int:
+        return self.__size - len(self.__free_rows)
+
+    @property
+    def capacity(self)->int:
+        return self.seq.shape[0]
+
+    def column(self, name:str)->np.ndarray:
+        return self.__columns[name]
+
+    def get(self, name:str, row:int):
+        value = self.__columns[name][row]
+        return value if name in TrackTable.ARRAY_FIELDS else value.item()
+
+    def set(self, name:str, row:int, value)->None:
+        if value is None and name == 'coordinates':
+            value = np.nan
+        self.__columns[name][row] = value
+
+    def __grow(self)->None:
+        capacity = self.capacity
+        for name, column in self.__columns.items():
+            self.__columns[name] = np.concatenate((column, np.zeros_like(column)))
+        self.tracked = np.concatenate((self.tracked, np.zeros_like(self.tracked)))
+        self.lost = np.concatenate((self.lost, np.zeros_like(self.lost)))
+        self.removed = np.concatenate((self.removed, np.zeros_like(self.removed)))
+        self.seq = np.concatenate((self.seq, np.zeros_like(self.seq)))
+        self.__tracks.extend([None]*capacity)
+
+    def add(self, track)->int:
+        """
+        Moves the track's fields into a new row, the track then reads them from the table.
+        """
+        if len(self.__free_rows) > 0:
+            row = self.__free_rows.pop()
+        else:
+            if self.__size == self.capacity:
+                self.__grow()
+            row = self.__size
+            self.__size += 1
+
+        values = {name: TableField.instance_value(track, name) for name in self.__columns}
+        for name, value in values.items():
+            self.set(name, row, value)
+            track.__dict__.pop(name, None)
+        self.tracked[row] = self.lost[row] = self.removed[row] = False
+        self.__tracks[row] = track
+        track._table = self
+        track._row = row
+        return row
+
+    def release(self, row:int)->None:
+        """
+        Detaches the track of the row (its fields are copied back to the object) and frees the row.
+        """
+        track = self.__tracks[row]
+        if track is not None:
+            for name in self.__columns:
+                value = self.get(name, row)
+                track.__dict__[name] = value.copy() if isinstance(value, np.ndarray) else value
+            track._table = None
+            track._row = -1
+        self.__tracks[row] = None
+        self.tracked[row] = self.lost[row] = self.removed[row] = False
+        self.__free_rows.append(row)
+
+    def enter(self, mask:np.ndarray, rows)->None:
+        """
+        Sets the rows in the tracked or lost mask, they go to the end of its order.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        mask[rows] = True
+        self.seq[rows] = self.__seq + 1 + np.arange(rows.shape[0])
+        self.__seq += rows.shape[0]
+
+    def rows(self, mask:np.ndarray)->np.ndarray:
+        """
+        Rows set in the mask in the order they entered it.
+        """
+        rows = np.flatnonzero(mask[:self.__size])
+        return rows[np.argsort(self.seq[rows], kind='stable')]
+
+    def tracks(self, mask:np.ndarray)->list:
+        return [self.__tracks[row] for row in self.rows(mask).tolist()]
+
+    def track(self, row:int):
+        return self.__tracks[row]
+
+    def step(self, frame_id:int)->None:
+        """
+        Called once per frame, compacts the table every compact_interval frames.
+        """
+        self.__frame_id = frame_id
+        self.__frames_since_compact += 1
+        if self.__frames_since_compact >= self.compact_interval:
+            self.compact()
+
+    def compact(self)->int:
+        """
+        Frees the rows that are neither tracked nor lost (removed and dropped tracks), returns the number of rows freed.
+        """
+        self.__frames_since_compact = 0
+        in_use = np.array([track is not None for track in self.__tracks[:self.__size]], dtype=bool)
+        rows = np.flatnonzero(in_use & ~self.tracked[:self.__size] & ~self.lost[:self.__size])
+        track_ids = self.__columns['track_id']
+        for row in rows.tolist():
+            if self.removed[row]:
+                self.tombstones.add(track_ids[row].item(), self.__frame_id)
+            self.release(row)
+        return rows.shape[0]
+
+    def sizes(self)->dict:
+        return {
+            'tracked': int(np.count_nonzero(self.tracked)),
+            'lost': int(np.count_nonzero(self.lost)),
+            'removed': int(np.count_nonzero(self.removed)),
+            'rows': len(self),
+            'capacity': self.capacity,
+            'tombstones': len(self.tombstones)
+        }
+
+
+class TableField:
+    """
+    STrack attribute that lives in the TrackTable once the track has a row, and on the object before that.
+    """
+    def __set_name__(self, owner, name)->None:
+        self.name = name
+
+    @staticmethod
+    def instance_value(track, name:str):
+        if name in track.__dict__:
+            return track.__dict__[name]
+        return getattr(BaseTrack, name, None)
+
+    def __get__(self, track, owner=None):
+        if track is None:
+            return self
+        table = track.__dict__.get('_table')
+        if table is None:
+            return TableField.instance_value(track, self.name)
+        return table.get(self.name, track._row)
+
+    def __set__(self, track, value)->None:
+        table = track.__dict__.get('_table')
+        if table is None:
+            track.__dict__[self.name] = value
+        else:
+            table.set(self.name, track._row, value)
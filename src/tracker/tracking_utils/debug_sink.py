@@ -0,0 +1,135 @@
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class DebugSink(object):
+    """
+    Collects debug traces (graphs, cost matrices, assignments) off the tracking hot path.
+
+    Modes
+        off     : record() returns straight away.
+        sampled : every `sample_every`-th record is handed to the writer thread.
+        ring    : the last `capacity` records are kept in memory and only written on flush(),
+                  at exit or when an uncaught exception reaches the interpreter.
+
+    Records are serialized to JSON lines on a background thread, the payloads are kept by reference,
+    so callers must not mutate them after calling record().
+    """
+    OFF = 'off'
+    SAMPLED = 'sampled'
+    RING = 'ring'
+
+    def __init__(self, mode='off', path='debug.jsonl', sample_every=100, capacity=256, queue_size=64):
+        self.mode = self.OFF
+        self.path = path
+        self.sample_every = 1
+        self.dropped = 0
+        self.written = 0
+        self.__count = 0
+        self.__lock = threading.Lock()
+        self.__ring = deque(maxlen=capacity)
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__worker = None
+        self.__hooks_installed = False
+        self.configure(mode, path, sample_every, capacity)
+
+    def configure(self, mode='off', path=None, sample_every=None, capacity=None):
+        if mode not in (self.OFF, self.SAMPLED, self.RING):
+            raise ValueError("Error: Unknown debug sink mode:" + str(mode))
+        with self.__lock:
+            self.mode = mode
+            if path is not None:
+                self.path = path
+            if sample_every is not None:
+                self.sample_every = max(1, int(sample_every))
+            if capacity is not None and capacity != self.__ring.maxlen:
+                self.__ring = deque(self.__ring, maxlen=capacity)
+        if mode != self.OFF:
+            self.__start()
+
+    def enabled(self):
+        return self.mode != self.OFF
+
+    def record(self, kind, payload):
+        if self.mode == self.OFF:
+            return
+        self.__count += 1
+        entry = (self.__count, time.time(), kind, payload)
+        if self.mode == self.RING:
+            self.__ring.append(entry)
+        elif self.__count % self.sample_every == 0:
+            self.__put(entry)
+
+    def flush(self, timeout=5.0):
+        """Hand the ring buffer to the writer and wait until everything queued is on disk."""
+        if self.__worker is None:
+            return
+        with self.__lock:
+            entries = list(self.__ring)
+            self.__ring.clear()
+        for entry in entries:
+            self.__put(entry, block=True)
+        deadline = time.time() + timeout
+        while self.__queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.005)
+
+    def __put(self, entry, block=False):
+        try:
+            self.__queue.put(entry, block=block, timeout=1.0 if block else None)
+        except queue.Full:
+            self.dropped += 1
+
+    def __start(self):
+        if self.__worker is None:
+            self.__worker = threading.Thread(target=self.__run, name='debug-sink', daemon=True)
+            self.__worker.start()
+        if not self.__hooks_installed:
+            self.__install_hooks()
+
+    def __install_hooks(self):
+        self.__hooks_installed = True
+        atexit.register(self.flush)
+
+        previous_excepthook = sys.excepthook
+        def excepthook(*args):
+            self.flush()
+            previous_excepthook(*args)
+        sys.excepthook = excepthook
+
+        previous_thread_excepthook = threading.excepthook
+        def thread_excepthook(args):
+            self.flush()
+            previous_thread_excepthook(args)
+        threading.excepthook = thread_excepthook
+
+    def __run(self):
+        while True:
+            seq, stamp, kind, payload = self.__queue.get()
+            try:
+                line = json.dumps({'seq': seq, 'time': stamp, 'kind': kind, 'data': payload}, default=_to_json)
+                with open(self.path, 'a') as fp:
+                    fp.write(line + '\n')
+                self.written += 1
+            except Exception as e:
+                print(f"Debug sink failed to write {kind}: {e}")
+            finally:
+                self.__queue.task_done()
+
+
+def _to_json(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+# Process wide sink, configure it with debug_sink.configure(...)
+debug_sink = DebugSink()
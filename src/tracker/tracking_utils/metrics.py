@@ -0,0 +1,258 @@
+"""
+Hot path instrumentation: stage timers, counters and gauges, exposed in the Prometheus text format.
+
+    from tracker.tracking_utils.metrics import metrics
+
+    with metrics.timer('botsort_update'):
+        ...
+
+    @metrics.timed('space_merger_merge')
+    def merge(self, ...):
+        ...
+
+    metrics.inc('detections_total', 12, camera='0')
+    metrics.set('active_tracklets', 22)
+
+1. Durations go to log-linear histograms (HdrHistogram style): the bucket width grows with the value,
+   so every recorded duration is kept within ~1.5% whatever its range, in a fixed amount of memory.
+2. Disabled (the default) the timers, counters and gauges return straight away.
+3. serve(port) starts a daemon thread answering GET /metrics with the text format (the timers are summaries
+   with their quantiles, in seconds), on localhost only.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class Histogram:
+    """
+    Log-linear histogram of integer values (microseconds for the timers).
+    Values under 2**SUB_BITS have their own bucket, above that every power of two is split in 2**(SUB_BITS-1) buckets.
+    """
+    SUB_BITS = 7
+    MAX_SHIFT = 36 # values are clamped to about 2**43 (~100 days in microseconds)
+
+    def __init__(self)->None:
+        self.__half = 1 << (Histogram.SUB_BITS - 1)
+        self.__counts = [0]*((Histogram.MAX_SHIFT + 2)*self.__half)
+        self.__max_value = (1 << (Histogram.MAX_SHIFT + Histogram.SUB_BITS)) - 1
+        self.__lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value:int)->int:
+        shift = value.bit_length() - Histogram.SUB_BITS
+        if shift <= 0:
+            return value
+        return shift*self.__half + (value >> shift)
+
+    def lower_bound(self, index:int)->int:
+        if index < 2*self.__half:
+            return index
+        shift = index // self.__half - 1
+        return (index - shift*self.__half) << shift
+
+    def record(self, value:int)->None:
+        value = min(max(value, 0), self.__max_value)
+        with self.__lock:
+            self.__counts[self.index(value)] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def quantiles(self, qs)->list[int]:
+        """
+        Value at each quantile (the middle of its bucket), 0 when nothing was recorded.
+        """
+        with self.__lock:
+            counts = np.array(self.__counts, dtype=np.int64)
+            count, max_value = self.count, self.max
+        if count == 0:
+            return [0 for _ in qs]
+        cumulative = np.cumsum(counts)
+        result = []
+        for q in qs:
+            index = int(np.searchsorted(cumulative, max(1, int(np.ceil(q*count)))))
+            low, high = self.lower_bound(index), self.lower_bound(index + 1)
+            result.append(min((low + high - 1) // 2, max_value))
+        return result
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start_time')
+
+    def __init__(self, histogram:Histogram)->None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc)->None:
+        self.histogram.record(int((time.perf_counter() - self.start_time)*1e6))
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc)->None:
+        pass
+
+
+class Metrics:
+    """
+    Registry of the timers, counters and gauges of the process.
+    """
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, enabled:bool=False, prefix:str='tracking_')->None:
+        self.enabled = enabled
+        self.prefix = prefix
+        self.__lock = threading.Lock()
+        self.__histograms = {}
+        self.__counters = {}
+        self.__gauges = {}
+        self.__null_timer = _NullTimer()
+        self.__server = None
+
+    def configure(self, enabled:bool=False, port:int=None)->None:
+        """
+        Enables the metrics, and serves them on localhost:port when a port is given.
+        """
+        self.enabled = enabled
+        if enabled and port:
+            self.serve(port)
+
+    def histogram(self, name:str)->Histogram:
+        histogram = self.__histograms.get(name)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timer(self, name:str):
+        """
+        Context manager timing its block into the `name` histogram.
+        """
+        if not self.enabled:
+            return self.__null_timer
+        return _Timer(self.histogram(name))
+
+    def timed(self, name:str):
+        """
+        Decorator version of timer().
+        """
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start_time = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.histogram(name).record(int((time.perf_counter() - start_time)*1e6))
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            wrapper.__wrapped__ = func
+            return wrapper
+        return decorator
+
+    def inc(self, name:str, value:float=1, **labels)->None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def set(self, name:str, value:float, **labels)->None:
+        if not self.enabled:
+            return
+        self.__gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self)->dict:
+        """
+        {'timers': {name: {'count', 'sum_s', 'max_s', 'p50_s', ...}}, 'counters': {series: value}, 'gauges': {series: value}},
+        a series is the name with its labels, like detections_total{camera="0"}.
+        """
+        timers = {}
+        for name, histogram in list(self.__histograms.items()):
+            stats = {'count': histogram.count, 'sum_s': round(histogram.total*1e-6, 6), 'max_s': round(histogram.max*1e-6, 6)}
+            for q, value in zip(Metrics.QUANTILES, histogram.quantiles(Metrics.QUANTILES)):
+                stats[f'p{q*100:g}_s'] = round(value*1e-6, 6)
+            timers[name] = stats
+        with self.__lock:
+            counters = {Metrics.series(name, labels): value for (name, labels), value in self.__counters.items()}
+        gauges = {Metrics.series(name, labels): value for (name, labels), value in list(self.__gauges.items())}
+        return {'timers': timers, 'counters': counters, 'gauges': gauges}
+
+    @staticmethod
+    def series(name:str, labels:tuple)->str:
+        if len(labels) == 0:
+            return name
+        return name + '{' + ','.join(f'{key}="{label}"' for key, label in labels) + '}'
+
+    def render(self)->str:
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        snapshot = self.snapshot()
+        for name, stats in sorted(snapshot['timers'].items()):
+            metric = f'{self.prefix}{name}_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for q in Metrics.QUANTILES:
+                lines.append(f'{metric}{{quantile="{q:g}"}} {stats[f"p{q*100:g}_s"]:.9g}')
+            lines.append(f'{metric}_sum {stats["sum_s"]:.9g}')
+            lines.append(f'{metric}_count {stats["count"]}')
+        for kind, values in (('counter', snapshot['counters']), ('gauge', snapshot['gauges'])):
+            typed = set()
+            for series, value in sorted(values.items()):
+                metric = self.prefix + series.split('{')[0]
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f'# TYPE {metric} {kind}')
+                lines.append(f'{self.prefix}{series} {value:.9g}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port:int, host:str='127.0.0.1')->ThreadingHTTPServer:
+        """
+        Starts the /metrics endpoint on a daemon thread (once), returns the server.
+        """
+        if self.__server is not None:
+            return self.__server
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, name='metrics-http', daemon=True).start()
+        return self.__server
+
+    def shutdown(self)->None:
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+
+# Process wide registry, configure it with metrics.configure(...)
+metrics = Metrics()
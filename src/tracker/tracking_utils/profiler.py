@@ -0,0 +1,243 @@
+"""
+Runtime profiling of a live match, without restarting under cProfile.
+
+1. sample(seconds): a daemon thread samples the stack of the tracking thread every `interval` seconds and writes
+       <output_dir>/stacks_<time>.collapsed        one "frame;frame;frame count" line per stack (flamegraph.pl, speedscope)
+       <output_dir>/stacks_<time>.speedscope.json  sampled profile for https://www.speedscope.app
+2. profile_frames(frames): the functions wrapped with @profiler.profiled(name) run under cProfile for their next
+   `frames` calls, the stats go to <output_dir>/<name>_<time>.prof (pstats) and a .txt summary.
+3. Both are started at runtime: SIGUSR1 samples for `seconds`, SIGUSR2 profiles `frames` frames (install_signal_handlers),
+   or handle_command() with a control message {'command': 'sample', 'seconds': 10} / {'command': 'profile_frames', 'frames': 100}.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+
+class Profiler:
+    def __init__(self, output_dir:Path=Path('profiles'), seconds:float=10., interval:float=0.005, frames:int=100,
+                 thread_name:str=None)->None:
+        self.output_dir = Path(output_dir)
+        self.seconds = seconds
+        self.interval = interval
+        self.frames = frames
+        self.thread_name = thread_name
+        self.__lock = threading.Lock()
+        self.__sampler = None
+        self.__frame_profiles = {} # name -> [cProfile.Profile, calls left]
+        self.__generation = 0 # profile_frames() requests, each @profiled function is profiled once per request
+        self.__profiled_generation = {}
+        self.__request_frames = frames
+        self.__local = threading.local()
+
+    def configure(self, output_dir:Path=None, seconds:float=None, interval:float=None, frames:int=None,
+                  thread_name:str=None)->None:
+        if output_dir is not None:
+            self.output_dir = Path(output_dir)
+        if seconds is not None:
+            self.seconds = seconds
+        if interval is not None:
+            self.interval = interval
+        if frames is not None:
+            self.frames = frames
+        self.thread_name = thread_name
+
+    def __output_path(self, name:str, suffix:str)->Path:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        return self.output_dir / f'{name}_{time.strftime("%Y%m%d_%H%M%S")}{suffix}'
+
+    # Stack sampling
+
+    def __target_thread(self)->threading.Thread:
+        if self.thread_name is not None:
+            for thread in threading.enumerate():
+                if thread.name == self.thread_name:
+                    return thread
+        return threading.main_thread()
+
+    def sampling(self)->bool:
+        return self.__sampler is not None and self.__sampler.is_alive()
+
+    def sample(self, seconds:float=None)->bool:
+        """
+        Starts sampling the tracking thread for `seconds`, returns False if a sampling is already running.
+        """
+        with self.__lock:
+            if self.sampling():
+                return False
+            self.__sampler = threading.Thread(target=self.__run_sampler, args=(seconds or self.seconds, self.__target_thread()),
+                                              name='profiler-sampler', daemon=True)
+            self.__sampler.start()
+            return True
+
+    def __run_sampler(self, seconds:float, target:threading.Thread)->None:
+        stacks = Counter()
+        start_time = time.perf_counter()
+        deadline = start_time + seconds
+        while time.perf_counter() < deadline and target.is_alive():
+            frame = sys._current_frames().get(target.ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if len(stack) > 0:
+                stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+        elapsed = time.perf_counter() - start_time
+
+        try:
+            self.write_samples(stacks, elapsed, target.name)
+        except Exception as e:
+            print(f"Profiler failed to write the samples: {e}")
+
+    def write_samples(self, stacks:Counter, elapsed:float, thread_name:str)->tuple[Path, Path]:
+        """
+        Writes the sampled stacks as collapsed stacks and as a speedscope profile, returns both paths.
+        """
+        def label(name, filename, line):
+            return f'{name} ({os.path.basename(filename)}:{line})'
+
+        collapsed_path = self.__output_path('stacks', '.collapsed')
+        with open(collapsed_path, 'w') as fp:
+            for stack, count in stacks.most_common():
+                fp.write(';'.join(label(*frame) for frame in stack) + f' {count}\n')
+
+        frames, frame_index = [], {}
+        samples, weights = [], []
+        for stack, count in stacks.most_common():
+            sample = []
+            for name, filename, line in stack:
+                key = (name, filename, line)
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    frames.append({'name': name, 'file': filename, 'line': line})
+                sample.append(frame_index[key])
+            samples.append(sample)
+            weights.append(count*self.interval)
+        speedscope = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f'{thread_name} {time.strftime("%Y-%m-%d %H:%M:%S")}',
+            'exporter': 'tracking profiler',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': thread_name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': elapsed,
+                'samples': samples,
+                'weights': weights
+            }]
+        }
+        speedscope_path = collapsed_path.with_suffix('.speedscope.json')
+        with open(speedscope_path, 'w') as fp:
+            json.dump(speedscope, fp)
+        return collapsed_path, speedscope_path
+
+    # Deterministic profiling
+
+    def profiled(self, name:str):
+        """
+        Decorator, the function runs under cProfile for the next frames once profile_frames() is called.
+        """
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                entry = self.__frame_profiles.get(name)
+                if entry is None:
+                    if self.__profiled_generation.get(name, 0) == self.__generation or getattr(self.__local, 'active', False):
+                        return func(*args, **kwargs)
+                    entry = self.__start_frame_profile(name)
+                    if entry is None:
+                        return func(*args, **kwargs)
+                elif getattr(self.__local, 'active', False):
+                    return func(*args, **kwargs)
+                self.__local.active = True
+                entry[0].enable()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    entry[0].disable()
+                    self.__local.active = False
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        self.__finish(name)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            wrapper.__wrapped__ = func
+            return wrapper
+        return decorator
+
+    def profile_frames(self, frames:int=None)->None:
+        """
+        Profiles the next `frames` calls of every @profiled function.
+        """
+        with self.__lock:
+            self.__request_frames = frames or self.frames
+            self.__generation += 1
+
+    def __start_frame_profile(self, name:str)->list|None:
+        with self.__lock:
+            if self.__profiled_generation.get(name) == self.__generation:
+                return None
+            self.__profiled_generation[name] = self.__generation
+            entry = self.__frame_profiles[name] = [cProfile.Profile(), self.__request_frames]
+            return entry
+
+    def __finish(self, name:str)->None:
+        with self.__lock:
+            entry = self.__frame_profiles.pop(name, None)
+        if entry is None:
+            return
+        try:
+            path = self.__output_path(name, '.prof')
+            entry[0].dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(entry[0], stream=summary).sort_stats('cumulative').print_stats(40)
+            with open(path.with_suffix('.txt'), 'w') as fp:
+                fp.write(summary.getvalue())
+        except Exception as e:
+            print(f"Profiler failed to write {name}: {e}")
+
+    # Triggers
+
+    def handle_command(self, message:dict)->bool:
+        """
+        Control message: {'command': 'sample', 'seconds': N} or {'command': 'profile_frames', 'frames': N}.
+        """
+        command = message.get('command')
+        if command == 'sample':
+            return self.sample(message.get('seconds'))
+        if command == 'profile_frames':
+            self.profile_frames(message.get('frames'))
+            return True
+        return False
+
+    def install_signal_handlers(self)->bool:
+        """
+        SIGUSR1 samples for `seconds`, SIGUSR2 profiles `frames` frames. Must be called from the main thread,
+        returns False where the signals do not exist (Windows).
+        The handlers run on the main thread between two bytecodes, possibly while it holds the profiler lock
+        (the @profiled functions take it), so they only hand the request off to a thread.
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return False
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.__hand_off(self.sample))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.__hand_off(self.profile_frames))
+        return True
+
+    @staticmethod
+    def __hand_off(request)->None:
+        threading.Thread(target=request, name='profiler-signal', daemon=True).start()
+
+
+# Process wide profiler, configure it with profiler.configure(...)
+profiler = Profiler()
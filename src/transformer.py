@@ -1,21 +1,75 @@
-from coordinate_transforms import Transformer
+import numpy as np
+from coordinate_transforms import Transformer, convert_boxes_2_points
+from camera_pool import CameraPool
+from frame_batch import FrameBatch
+from stitching import StitchingMap
+from tracker.tracking_utils.metrics import metrics
 
 
 
 
+class FusedSpaceTransform:
+    """
+    Applies the transforms of all the cameras in one call.
+    For every camera the perspective transform, the normalization offsets and the stitching x alignment
+    are combined into one 3x3 matrix (StitchingMap.homographies), so the foot points go straight to unified pitch coordinates.
+    The box corners only need the perspective transform, those matrices are stacked after the fused ones.
+    """
+    def __init__(self, stitching_map:StitchingMap)->None:
+        fused, perspective = stitching_map.homographies()
+        self.__num_cams = stitching_map.num_cams
+        self.__matrices = np.concatenate((fused, perspective))
+
+    def apply(self, points:np.ndarray, matrix_index:np.ndarray)->np.ndarray:
+        """
+        Transforms an (N, 2) array of points, point i with the matrix matrix_index[i].
+        """
+        homogeneous = np.empty((points.shape[0], 3), dtype=np.float64)
+        homogeneous[:, :2] = points
+        homogeneous[:, 2] = 1
+        res = np.einsum('nij,nj->ni', self.__matrices[matrix_index], homogeneous)
+        return res[:, :2] / res[:, 2:]
+
+    def apply_transform_batch(self, batch:FrameBatch)->FrameBatch:
+        rows = np.flatnonzero(batch.camera < self.__num_cams)
+        n = rows.shape[0]
+        cams = batch.camera[rows]
+        points = np.concatenate((batch.foot[rows], batch.bbox[rows, :2]))
+        matrix_index = np.concatenate((cams, cams + self.__num_cams))
+        res = self.apply(points, matrix_index)
+
+        batch.coordinates[rows] = res[:n]
+        batch.t_box[rows, :2] = res[n:]
+        batch.t_box[rows, 2:] = res[n:] + (batch.bbox[rows, 2:] - batch.bbox[rows, :2])
+        batch.aligned = True
+        return batch
+
+
 class SpaceTransformer:
-    def __init__(self, width:int, height:int, pitch_coord:list[dict]) -> None:
-        self.__width = width
-        self.__height = height
-        self.__pitch_coordinates = pitch_coord
-        self.__transformers = [ Transformer(width, height, pitch_coord[0], 0), # Cam 1 Transformer
-                                Transformer(width, height, pitch_coord[1], 1), # Cam 2 Transformer
-                                Transformer(width, height, pitch_coord[2], 2)] # Cam 3 Transformer
+    def __init__(self, stitching_map:StitchingMap, camera_pool:CameraPool=None) -> None:
+        """
+        One Transformer per camera of the stitching map.
+        With a camera_pool the cameras are transformed concurrently, one worker per camera (the fused transform wins over it).
+        """
+        self.__stitching_map = stitching_map
+        self.__width = stitching_map.frame_width
+        self.__height = stitching_map.frame_height
+        self.__transformers = stitching_map.transformers
+        self.__fused_transform = None
+        self.__camera_pool = camera_pool
         
     def get_transformer(self, index:int)->Transformer:
         return self.__transformers[index]
+
+    def fuse(self)->FusedSpaceTransform:
+        """
+        Switch apply_transform_batch to the fused transform, the batch then leaves with unified pitch coordinates.
+        """
+        self.__fused_transform = FusedSpaceTransform(self.__stitching_map)
+        return self.__fused_transform
         
     
+    @metrics.timed('space_transformer_apply_transform')
     def apply_transform(self, cams_detections_lists:list[list])->list[list]:
         """
         1. This function receives detections in the format
@@ -27,9 +81,47 @@ class SpaceTransformer:
             Each list corresponds to a camera input streams from the video input system
             It applies perspective transforms to the detections coordinates and returns 
         """
+        if self.__camera_pool is not None:
+            return self.__camera_pool.map(lambda idx, cam_detections: self.__transformers[idx].transform(cam_detections),
+                                          cams_detections_lists)
         results = []
         for idx, cam_detections in enumerate(cams_detections_lists):
             res = self.__transformers[idx].transform(cam_detections)    
             results.append(res)
         
-        return results
\ No newline at end of file
+        return results
+
+    @metrics.timed('space_transformer_apply_transform')
+    def apply_transform_batch(self, batch:FrameBatch)->FrameBatch:
+        """
+        Array version of apply_transform, fills in the pitch coordinates and the transformed boxes
+        of every camera in the batch.
+        """
+        if self.__fused_transform is not None:
+            return self.__fused_transform.apply_transform_batch(batch)
+        if self.__camera_pool is not None:
+            self.__camera_pool.map(self.__transform_camera, [batch]*len(self.__transformers))
+            return batch
+        for idx, transformer in enumerate(self.__transformers):
+            rows = batch.camera_rows(idx)
+            if rows.shape[0] == 0:
+                continue
+            coordinates, t_box = transformer.transform_batch(batch.foot[rows], batch.bbox[rows])
+            batch.coordinates[rows] = coordinates
+            batch.t_box[rows] = t_box
+        return batch
+
+    def __transform_camera(self, idx:int, batch:FrameBatch)->None:
+        """
+        Camera pool task, box-to-point and homography of the rows of one camera.
+        The cameras write disjoint rows of the batch arrays.
+        """
+        rows = batch.camera_rows(idx)
+        if rows.shape[0] == 0:
+            return
+        bbox = batch.bbox[rows]
+        foot = convert_boxes_2_points(bbox)
+        coordinates, t_box = self.__transformers[idx].transform_batch(foot, bbox)
+        batch.foot[rows] = foot
+        batch.coordinates[rows] = coordinates
+        batch.t_box[rows] = t_box